@@ -0,0 +1,146 @@
+# charset.py -- encoding detection for the values of Deb822 objects
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Encoding detection for the values of Deb822 objects
+
+Deb822 objects keep the values they parse as strings, and decode them when
+they are looked up.  The values that can't be decoded with the encoding of
+their paragraph have their encoding guessed here, with chardet, which is
+only imported the first time it is needed since it is slow to import.
+"""
+
+import warnings
+
+
+class _LazyModule(object):
+    """Stand-in for a module that is slow to import and seldom needed
+
+    The module is only imported when one of its attributes is first looked
+    up, so that e.g. deb822.chardet.detect keeps working without chardet
+    being imported with deb822.  Like with an import statement in a module
+    of this package, the modules next to it are looked at first.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(__import__(self._name, globals()), attr)
+
+chardet = _LazyModule('chardet')
+
+
+def _decode_value(value, encoding, detector=None):
+    """Decode the string value, returning a (unicode, encoding) tuple
+
+    If value can't be decoded with encoding, detector (an EncodingDetector)
+    is used to find out the encoding it really is in, which is returned along
+    with the decoded value.  Without a detector, chardet is used directly.
+    """
+    if detector is not None:
+        return detector.decode(value, encoding)
+    try:
+        return value.decode(encoding), encoding
+    except UnicodeDecodeError, e:
+        # Evidently, the value wasn't encoded with the encoding the user
+        # specified.  Try detecting it.
+        warnings.warn('decoding from %s failed; attempting to detect '
+                      'the true encoding' % encoding,
+                      UnicodeWarning)
+        result = chardet.detect(value)
+        try:
+            return value.decode(result['encoding']), result['encoding']
+        except UnicodeDecodeError:
+            raise e
+
+
+# Bytes ignored when caching encoding detection results by byte pattern
+_ASCII = ''.join([chr(i) for i in range(128)])
+
+
+class EncodingDetector(object):
+    """Find out the encoding of values that fail to decode, file-wide
+
+    Deb822 objects normally run chardet on every value that can't be decoded
+    with their encoding, which is slow when many paragraphs of a file are in
+    another encoding (as in old Sources files with a mix of latin1 and utf-8
+    maintainer names).  An EncodingDetector is shared by all the paragraphs
+    of a file, and learns from every value it decodes:
+
+      - the encodings that worked are counted (see the stats attribute), and
+        the most frequent one is tried first;
+      - chardet results are cached by the non-ASCII bytes of the value, so
+        values with the same accented characters are only run through chardet
+        once.
+
+    Alternatively, a list of fallback_encodings (e.g. ['utf-8', 'latin-1'])
+    may be given, which are tried in order instead, without using chardet at
+    all.  Since latin-1 can decode anything, it makes a fast and predictable
+    last resort.
+    """
+
+    # Maximum number of chardet results kept
+    cache_size = 1000
+
+    def __init__(self, fallback_encodings=None):
+        self.fallback_encodings = fallback_encodings
+        # encoding -> number of values it was used for
+        self.stats = {}
+        self._cache = {}
+
+    def decode(self, value, encoding):
+        """Decode the string value, returning a (unicode, encoding) tuple
+
+        encoding is tried first; the encoding returned is the one that
+        worked.
+        """
+        try:
+            return value.decode(encoding), encoding
+        except UnicodeDecodeError, e:
+            error = e
+
+        if self.fallback_encodings is not None:
+            candidates = self.fallback_encodings
+        else:
+            warnings.warn('decoding from %s failed; attempting to detect '
+                          'the true encoding' % encoding,
+                          UnicodeWarning)
+            candidates = self._candidates(value)
+        for candidate in candidates:
+            if not candidate or candidate == encoding:
+                continue
+            try:
+                result = value.decode(candidate)
+            except (UnicodeDecodeError, LookupError):
+                continue
+            self.stats[candidate] = self.stats.get(candidate, 0) + 1
+            return result, candidate
+        raise error
+
+    def _candidates(self, value):
+        """Generator yielding the encodings value might be in, best first"""
+        if self.stats:
+            yield max(self.stats, key=self.stats.get)
+        pattern = value.translate(None, _ASCII)
+        try:
+            yield self._cache[pattern]
+        except KeyError:
+            pass
+        result = chardet.detect(value)['encoding']
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[pattern] = result
+        yield result
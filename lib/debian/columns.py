@@ -0,0 +1,308 @@
+# columns.py -- columnar storage of the fields of deb822 files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Columnar storage of the fields of deb822 files
+
+ColumnTable keeps a few fields of all the paragraphs of a file (typically,
+a Packages file) in one column per field, using numpy if it is available.
+"""
+
+import array
+import itertools
+
+try:
+    import numpy as _numpy
+except ImportError:
+    _numpy = None
+
+from charset import EncodingDetector
+from deb822 import Deb822, _iter_lines, _parse_paragraphs, _strI
+
+
+# Code standing for a missing value in the codes of CategoricalColumn objects
+MISSING = -1
+
+
+class CategoricalColumn(object):
+    """A dictionary-encoded column of a ColumnTable
+
+    The distinct values of the column are kept once, in the categories list,
+    and each row only holds the index of its value in categories (its
+    "code"), or MISSING if the row has no value for the field.
+    """
+
+    def __init__(self, categories, codes):
+        self.categories = categories
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        code = self.codes[i]
+        if code == MISSING:
+            return None
+        return self.categories[code]
+
+    def __iter__(self):
+        for i in xrange(len(self.codes)):
+            yield self[i]
+
+    def code_of(self, value):
+        """Return the code of value, or MISSING if no row has that value"""
+        try:
+            return self.categories.index(value)
+        except ValueError:
+            return MISSING
+
+
+class ColumnTable(object):
+    """Columnar table of some fields of the paragraphs of a file
+
+    Instead of one object per paragraph, a ColumnTable holds one column per
+    field, with one row per paragraph, which makes it cheap to filter and
+    aggregate whole files (e.g. to sum the Installed-Size of packages by
+    Section).  Columns come in three kinds:
+
+      - categorical columns (see CategoricalColumn), for fields with few
+        distinct values, like Architecture, Section or Priority;
+      - numeric columns, arrays of integers, with 0 for missing or
+        unparseable values (use present() to tell them from real zeros);
+      - text columns, lists of unicode objects (or None).
+
+    If numpy is available, codes and numbers are kept in numpy arrays, so
+    that they can be used for vectorized operations; otherwise, they are
+    array.array objects.
+
+    Example:
+
+        table = ColumnTable.from_file(file('Packages'),
+                                      ['Package', 'Section', 'Installed-Size'])
+        for section, size in table.sum_by('Section', 'Installed-Size').items():
+            print section, size
+    """
+
+    categorical_fields = ['Architecture', 'Section', 'Priority',
+                          'Multi-Arch', 'Essential', 'Origin', 'Format']
+
+    numeric_fields = ['Installed-Size', 'Size']
+
+    def __init__(self, fields, columns, length, numpy=None, present=None):
+        self.fields = fields
+        self._columns = dict(zip([_strI(f) for f in fields], columns))
+        self._length = length
+        self._numpy = numpy
+        # Masks of the rows having a value, for numeric columns
+        self._present = dict([(_strI(f), mask)
+                              for f, mask in (present or {}).items()])
+
+    def from_file(cls, sequence, fields, categorical=None, numeric=None,
+                  encoding="utf-8", use_numpy=None):
+        """Read a ColumnTable from the paragraphs in sequence
+
+        :param sequence: same as in Deb822.iter_paragraphs.
+
+        :param fields: the fields to make columns for.  Like with
+            iter_paragraphs, paragraphs with none of these fields are skipped.
+
+        :param categorical: which of fields should be dictionary-encoded
+            (default: those in categorical_fields).
+
+        :param numeric: which of fields hold integers (default: those in
+            numeric_fields).  Values that aren't integers are treated as
+            missing; ValueError is raised for integers too big for the column.
+
+        :param encoding: the encoding values are in.
+
+        :param use_numpy: if True, numpy must be used; if False, it won't be
+            used.  By default, it is used if it can be imported.
+        """
+        if use_numpy and _numpy is None:
+            raise ImportError('No module named numpy')
+        if use_numpy or use_numpy is None:
+            numpy = _numpy
+        else:
+            numpy = None
+        if categorical is None:
+            categorical = cls.categorical_fields
+        if numeric is None:
+            numeric = cls.numeric_fields
+        categorical = frozenset([f.lower() for f in categorical])
+        numeric = frozenset([f.lower() for f in numeric])
+
+        # For each field, its key, kind and the column being built, plus the
+        # mapping of raw values to codes and the list of decoded categories
+        # for categorical ones, or the mask of rows with a value for numeric
+        # ones
+        builders = []
+        for field in fields:
+            key = _strI(field)
+            if key.lower() in categorical:
+                builders.append((key, 'categorical', array.array('l'),
+                                 ({}, [])))
+            elif key.lower() in numeric:
+                builders.append((key, 'numeric', array.array('l'),
+                                 array.array('b')))
+            else:
+                builders.append((key, 'text', [], None))
+
+        # One detector for the whole file, see EncodingDetector
+        detector = EncodingDetector()
+
+        def parse_signed(lines):
+            return Deb822(lines, fields, encoding=encoding, _detector=detector)
+
+        length = 0
+        for parsed in _parse_paragraphs(_iter_lines(sequence), fields,
+                                        parse_signed):
+            length += 1
+            for key, kind, column, extra in builders:
+                value = parsed.get(key)
+                if kind == 'categorical':
+                    if value is None:
+                        column.append(MISSING)
+                        continue
+                    codes, categories = extra
+                    try:
+                        column.append(codes[value])
+                    except KeyError:
+                        # Signed paragraphs give unicode values, the others
+                        # str ones: decode new values, so that both spellings
+                        # of a value get the same code
+                        decoded = value
+                        if isinstance(value, str):
+                            decoded = detector.decode(value, encoding)[0]
+                        try:
+                            code = codes[decoded]
+                        except KeyError:
+                            code = codes[decoded] = len(categories)
+                            categories.append(decoded)
+                        codes[value] = code
+                        column.append(code)
+                elif kind == 'numeric':
+                    try:
+                        number = int(value)
+                    except (TypeError, ValueError):
+                        column.append(0)
+                        extra.append(False)
+                        continue
+                    try:
+                        column.append(number)
+                    except OverflowError:
+                        raise ValueError('%s value %s is out of range for a '
+                                         'numeric column' % (key, value))
+                    extra.append(True)
+                else:
+                    if isinstance(value, str):
+                        value = detector.decode(value, encoding)[0]
+                    column.append(value)
+
+        columns = []
+        present = {}
+        for key, kind, column, extra in builders:
+            if kind != 'text' and numpy is not None:
+                column = numpy.frombuffer(column, dtype=numpy.dtype('l'))
+            if kind == 'categorical':
+                column = CategoricalColumn(extra[1], column)
+            elif kind == 'numeric':
+                if numpy is not None:
+                    extra = numpy.frombuffer(extra, dtype=numpy.bool_)
+                present[str(key)] = extra
+            columns.append(column)
+        return cls(list(fields), columns, length, numpy, present)
+
+    from_file = classmethod(from_file)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, field):
+        return self._columns[_strI(field)]
+
+    def present(self, field):
+        """Return a sequence of booleans telling, for each row, whether it
+        has a (valid) value for field
+
+        This is a numpy array if numpy is used, for numeric and categorical
+        columns.
+        """
+        column = self[field]
+        if isinstance(column, CategoricalColumn):
+            codes = column.codes
+            if self._numpy is not None:
+                return codes != MISSING
+            return [code != MISSING for code in codes]
+        if isinstance(column, list):
+            return [value is not None for value in column]
+        return self._present[_strI(field)]
+
+    def row(self, i):
+        """Return a dict with the values of the i-th row"""
+        row = {}
+        for field in self.fields:
+            present = self._present.get(_strI(field))
+            if present is not None and not present[i]:
+                row[field] = None
+            else:
+                row[field] = self[field][i]
+        return row
+
+    def where(self, field, value):
+        """Return the indices of the rows whose field is value
+
+        For categorical columns, this compares codes rather than strings.
+        """
+        column = self[field]
+        present = None
+        if isinstance(column, CategoricalColumn):
+            column, value = column.codes, column.code_of(value)
+            if value == MISSING:
+                return []
+        elif not isinstance(column, list):
+            present = self._present[_strI(field)]
+        if self._numpy is not None and not isinstance(column, list):
+            matches = column == value
+            if present is not None:
+                matches &= present
+            return self._numpy.flatnonzero(matches)
+        if present is not None:
+            return [i for i, v in enumerate(column)
+                    if v == value and present[i]]
+        return [i for i, v in enumerate(column) if v == value]
+
+    def sum_by(self, group_field, value_field):
+        """Return a dict mapping each value of group_field to the sum of
+        value_field over the rows having it
+
+        group_field must be a categorical column and value_field a numeric
+        one; missing values of either are left out.
+        """
+        group = self[group_field]
+        values = self[value_field]
+        present = self._present[_strI(value_field)]
+        totals = [0] * len(group.categories)
+        if self._numpy is not None:
+            np = self._numpy
+            mask = (group.codes != MISSING) & present
+            sums = np.bincount(group.codes[mask], weights=values[mask],
+                               minlength=len(group.categories))
+            totals = [int(total) for total in sums]
+        else:
+            for code, value, has_value in itertools.izip(group.codes, values,
+                                                         present):
+                if code != MISSING and has_value:
+                    totals[code] += value
+        return dict(zip(group.categories, totals))
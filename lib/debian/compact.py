@@ -0,0 +1,143 @@
+# compact.py -- read-only, memory-efficient deb822 paragraphs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Read-only, memory-efficient deb822 paragraphs
+
+See CompactDeb822, and the compact parameter of Deb822.iter_paragraphs.
+"""
+
+import UserDict
+
+from charset import _decode_value
+from deb822 import Deb822, Deb822Dict
+
+
+# Maximum number of schemas kept by CompactDeb822._get_schema
+COMPACT_SCHEMA_CACHE_SIZE = 1000
+
+# Schemas of CompactDeb822 objects, by the tuple of their keys
+_compact_schemas = {}
+
+
+class CompactDeb822(object):
+    """A read-only, memory-efficient Deb822-like paragraph
+
+    Deb822 objects need a dict, an OrderedSet and a _CaseInsensitiveString
+    per key for every paragraph.  CompactDeb822 objects only keep a tuple of
+    values, plus a reference to a "schema" (the tuple of keys and a mapping
+    from lowercased key to index in the values tuple) which is shared by all
+    the paragraphs with the same keys, in the same order and case.  This
+    makes a big difference when keeping a whole Packages file in memory.
+
+    They are usually obtained through iter_paragraphs(..., compact=True).
+    Lookup is case-insensitive, values are given back as unicode objects like
+    with Deb822, and dump() works the same way, but they can't be modified.
+    Use to_deb822() to get a modifiable copy.
+    """
+
+    __slots__ = ('_schema', '_values', 'encoding', '_detector')
+
+    def __init__(self, paragraph=None, fields=None, encoding="utf-8",
+                 _detector=None):
+        """Create a new CompactDeb822 instance.
+
+        :param paragraph: a Deb822 object, or any dict-like object with a
+            keys() method giving the keys in order.
+
+        :param fields: if given, only these fields of paragraph are kept (in
+            the order they have in paragraph).
+
+        :param encoding: the encoding string values are in.
+
+        :param _detector: internal parameter (see Deb822.__init__).
+        """
+        if paragraph is None:
+            keys = []
+        else:
+            keys = paragraph.keys()
+            if fields is not None:
+                wanted = frozenset([f.lower() for f in fields])
+                keys = [k for k in keys if k.lower() in wanted]
+        # Keys are looked up as given by paragraph.keys(), since the parsers'
+        # helper objects expect the _CaseInsensitiveString objects they hold.
+        self._values = tuple([paragraph[k] for k in keys])
+        self._schema = self._get_schema(tuple([str(k) for k in keys]))
+        self.encoding = getattr(paragraph, 'encoding', encoding)
+        self._detector = _detector
+
+    @staticmethod
+    def _get_schema(keys):
+        try:
+            return _compact_schemas[keys]
+        except KeyError:
+            # Like _strI, simply start over when the cache is full; objects
+            # made earlier keep their schema, it just isn't shared anymore
+            if len(_compact_schemas) >= COMPACT_SCHEMA_CACHE_SIZE:
+                _compact_schemas.clear()
+            index = dict([(key.lower(), i) for i, key in enumerate(keys)])
+            schema = _compact_schemas[keys] = (keys, index)
+            return schema
+
+    ### BEGIN DictMixin methods
+
+    def __getitem__(self, key):
+        value = self._values[self._schema[1][key.lower()]]
+        if isinstance(value, str):
+            value, self.encoding = _decode_value(value, self.encoding,
+                                                 self._detector)
+        return value
+
+    def __setitem__(self, key, value):
+        raise TypeError('CompactDeb822 objects are read-only')
+
+    __delitem__ = __setitem__
+
+    def has_key(self, key):
+        return key.lower() in self._schema[1]
+
+    __contains__ = has_key
+
+    def keys(self):
+        return list(self._schema[0])
+
+    def __iter__(self):
+        return iter(self._schema[0])
+
+    def __len__(self):
+        return len(self._schema[0])
+
+    # Inheriting from DictMixin (a classic class) would give instances a
+    # __dict__, so just borrow the rest of its methods.
+    iteritems = UserDict.DictMixin.iteritems.im_func
+    iterkeys = UserDict.DictMixin.iterkeys.im_func
+    itervalues = UserDict.DictMixin.itervalues.im_func
+    items = UserDict.DictMixin.items.im_func
+    values = UserDict.DictMixin.values.im_func
+    get = UserDict.DictMixin.get.im_func
+    __cmp__ = UserDict.DictMixin.__cmp__.im_func
+
+    ### END DictMixin methods
+
+    __repr__ = Deb822Dict.__repr__.im_func
+    __eq__ = Deb822Dict.__eq__.im_func
+    __str__ = Deb822.__str__.im_func
+    __unicode__ = Deb822.__unicode__.im_func
+    get_as_string = Deb822.get_as_string.im_func
+    dump = Deb822.dump.im_func
+
+    def to_deb822(self, cls=Deb822):
+        """Return a (modifiable) cls object with the contents of self"""
+        return cls(self, encoding=self.encoding)
@@ -0,0 +1,86 @@
+# compression.py -- gzip, bzip2 and xz compression for deb822 files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""gzip, bzip2 and xz compression for deb822 files
+
+Deb822.iter_paragraphs decompresses its input with the helpers of this
+module, and Deb822Writer (see the writer module) compresses its outputs
+with them.  xz needs the lzma module, which is optional.
+"""
+
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+def _new_decompressor(compression):
+    if compression == 'gzip':
+        # Tell zlib to expect (and check) a gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == 'bzip2':
+        return bz2.BZ2Decompressor()
+    elif compression == 'xz':
+        if lzma is None:
+            raise ValueError('reading xz-compressed data needs the lzma '
+                             'module')
+        return lzma.LZMADecompressor()
+    raise ValueError('unknown compression format %r' % compression)
+
+
+def _new_compressor(compression):
+    if compression == 'gzip':
+        # Have zlib write a gzip header and trailer (with no file name or
+        # time stamp, so that the output only depends on the input)
+        return zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif compression == 'bzip2':
+        return bz2.BZ2Compressor(9)
+    elif compression == 'xz':
+        if lzma is None:
+            raise ValueError('writing xz-compressed data needs the lzma '
+                             'module')
+        return lzma.LZMACompressor()
+    raise ValueError('unknown compression format %r' % compression)
+
+
+def _decompress_blocks(blocks, compression):
+    """Generator decompressing an iterable of blocks of compressed data
+
+    Files made of several concatenated streams (like the output of
+    "cat a.gz b.gz") are decompressed as a whole, like gzip -d would.
+    """
+    decompressor = _new_decompressor(compression)
+    for block in blocks:
+        while block:
+            try:
+                data = decompressor.decompress(block)
+            except EOFError:
+                # bz2 and lzma refuse data after the end of a stream
+                decompressor = _new_decompressor(compression)
+                continue
+            if data:
+                yield data
+            block = decompressor.unused_data
+            if block:
+                decompressor = _new_decompressor(compression)
+    flush = getattr(decompressor, 'flush', None)
+    if flush is not None:
+        data = flush()
+        if data:
+            yield data
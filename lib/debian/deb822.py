@@ -32,21 +32,40 @@ try:
 except (ImportError, AttributeError):
     _have_apt_pkg = False
 
-import chardet
+import errno
+import itertools
 import os
 import re
 import string
-import subprocess
 import sys
-import warnings
 
 import StringIO
 import UserDict
 
+from charset import EncodingDetector, _LazyModule, _decode_value, chardet
+
+subprocess = _LazyModule('subprocess')
+threading = _LazyModule('threading')
+
+# Modules of this package holding the optional features, which are only
+# imported when first used (see _LazyModule)
+_compact = _LazyModule('compact')
+_compression = _LazyModule('compression')
+_mapped = _LazyModule('mapped')
+_parallel = _LazyModule('parallel')
+_verify = _LazyModule('verify')
+
 
 GPGV_DEFAULT_KEYRINGS = frozenset(['/usr/share/keyrings/debian-keyring.gpg'])
 GPGV_EXECUTABLE = '/usr/bin/gpgv'
 
+# Amount of data read at a time by the native paragraph parser
+READ_BLOCK_SIZE = 1024 * 1024
+
+# Characters matched by \s in the (non-unicode) regular expressions used by
+# Deb822._internal_parser
+_WHITESPACE = ' \t\n\r\f\v'
+
 
 class TagSectionWrapper(object, UserDict.DictMixin):
     """Wrap a TagSection object, using its find_raw method to get field values
@@ -68,6 +87,11 @@ class TagSectionWrapper(object, UserDict.DictMixin):
         if s is None:
             raise KeyError(key)
 
+        return self._value_of_raw(s)
+
+    @staticmethod
+    def _value_of_raw(s):
+        """Return the value of a field, given its raw text from find_raw"""
         # Get just the stuff after the first ':'
         # Could use s.partition if we only supported python >= 2.5
         data = s[s.find(':')+1:]
@@ -76,6 +100,386 @@ class TagSectionWrapper(object, UserDict.DictMixin):
         # off any newline at the end of the data.
         return data.lstrip(' \t').rstrip('\n')
 
+    @classmethod
+    def project(cls, section, fields):
+        """Return a _ParsedParagraph with the given fields of section
+
+        Only the values of the wanted fields are ever copied out of the
+        section (the first spelling of a field in fields wins).  The result
+        is empty if section has none of them.
+        """
+        parsed = _ParsedParagraph()
+        for field in fields:
+            key = _strI(field)
+            if key in parsed:
+                continue
+            s = section.find_raw(field)
+            if s is not None:
+                parsed.order.append(key)
+                parsed[key] = cls._value_of_raw(s)
+        return parsed
+
+
+class _ParsedParagraph(dict):
+    """Raw field values of a paragraph read by the native parser
+
+    This is the pure-Python counterpart of TagSectionWrapper: it is handed to
+    Deb822Dict as its _parsed argument.  Keys are _CaseInsensitiveString
+    objects, and the order in which they were first seen is preserved.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        # Keys are appended here as they are parsed, and repeated ones are
+        # weeded out only when keys() is called.
+        self.order = []
+
+    def keys(self):
+        if len(self.order) != len(self):
+            # Like Deb822Dict.__setitem__, a repeated field keeps its original
+            # position (and case) but takes the new value.
+            seen = set()
+            order = []
+            for key in self.order:
+                if key not in seen:
+                    seen.add(key)
+                    order.append(key)
+            self.order = order
+        return list(self.order)
+
+    def has_key(self, key):
+        return dict.__contains__(self, _strI(key))
+
+
+class _MappedParagraph(object):
+    """Field offsets of a paragraph in a memory-mapped file
+
+    Like _ParsedParagraph, this is handed to Deb822Dict as its _parsed
+    argument, but it only keeps the byte offsets of each value; the value
+    itself is sliced out of the map (and cleaned up) when it is looked up.
+    Paragraphs with the same fields share their schema, i.e. the tuple of keys
+    and the mapping from key to index.
+    """
+
+    __slots__ = ('map', 'schema', 'offsets')
+
+    def __init__(self, map_, schema, offsets):
+        self.map = map_
+        self.schema = schema
+        # start and end of the paragraph, then start and end of each value
+        self.offsets = offsets
+
+    start = property(lambda self: self.offsets[0])
+    end = property(lambda self: self.offsets[1])
+
+    def keys(self):
+        return list(self.schema[0])
+
+    def has_key(self, key):
+        return _strI(key) in self.schema[1]
+
+    def __getitem__(self, key):
+        i = 2 * self.schema[1][key] + 2
+        return _join_value(self.map[self.offsets[i]:self.offsets[i+1]])
+
+
+def _join_value(raw):
+    """Return the value of a field, given the raw text after its colon
+
+    raw may span several lines; lines that aren't continuation lines (i.e.
+    comments, or junk ignored by the parser) are dropped.
+    """
+    ws = _WHITESPACE
+    lines = raw.split('\n')
+    content = [lines[0].strip(ws)]
+    for line in lines[1:]:
+        line = line.strip('\r\n')
+        if len(line) > 1 and line[0] in ws:
+            content.append(line)
+    return '\n'.join(content)
+
+
+def _scan_paragraphs(buf, fields=None):
+    """Generator yielding the location of each paragraph in buf
+
+    buf is a string, or an object supporting find and slicing, like an mmap
+    object.  For each paragraph with at least one (wanted) field, a
+    (start, end, [[key, value_start, value_end], ...]) tuple is yielded, where
+    buf[start:end] is the text of the paragraph, and each value spans
+    buf[value_start:value_end] (see _join_value).  PGP armor is skipped.
+    """
+    ws = _WHITESPACE
+    if fields is not None:
+        fields = frozenset(fields)
+    # See _parse_paragraphs
+    key_cache = {}
+
+    size = len(buf)
+    pos = 0
+    start = end = None
+    found = []
+    curkey = None
+
+    while pos < size:
+        nl = buf.find('\n', pos)
+        if nl == -1:
+            nl = size
+        line = buf[pos:nl]
+        linepos = pos
+        pos = nl + 1
+
+        stripped = line.strip('\r\n')
+        if not stripped or (stripped.startswith('-----') and
+                            Deb822._gpg_re.match(stripped)):
+            if start is not None:
+                if found:
+                    yield (start, end, found)
+                found = []
+                start = None
+                curkey = None
+            if stripped.startswith('-----BEGIN'):
+                # Skip the armor headers of a signed message, or the whole
+                # signature.
+                if 'SIGNED MESSAGE' in stripped:
+                    terminator = ''
+                else:
+                    terminator = '-----END PGP '
+                while pos < size:
+                    nl = buf.find('\n', pos)
+                    if nl == -1:
+                        nl = size
+                    line = buf[pos:nl].strip('\r\n')
+                    pos = nl + 1
+                    if (terminator and line.startswith(terminator) or
+                            not (terminator or line)):
+                        break
+            continue
+
+        first = stripped[0]
+        if first == '#':
+            continue
+
+        if start is None:
+            start = linepos
+        end = nl
+
+        if first in ws:
+            if curkey is not None and len(stripped) > 1:
+                curkey[2] = nl
+            continue
+
+        colon = stripped.find(':')
+        if colon == -1:
+            continue
+
+        raw_key = stripped[:colon]
+        try:
+            key = key_cache[raw_key]
+        except KeyError:
+            key = raw_key.rstrip(ws)
+            if not key or [c for c in ws if c in key]:
+                key = False
+            elif fields is not None and key not in fields:
+                key = None
+            else:
+                key = _strI(key)
+            key_cache[raw_key] = key
+        if key is False:
+            continue
+
+        if key is None:
+            curkey = None
+        else:
+            value_start = linepos + colon + 1
+            if line[0] == '\r':
+                # Account for the '\r's stripped off the start of the line
+                value_start += len(line) - len(line.lstrip('\r'))
+            curkey = [key, value_start, nl]
+            found.append(curkey)
+
+    if start is not None and found:
+        yield (start, end, found)
+
+
+def _parse_paragraphs(lines, fields, parse_signed):
+    """Generator yielding a _ParsedParagraph for each paragraph in lines
+
+    This gives the same field values as Deb822._internal_parser, but it splits
+    lines with plain string methods instead of regular expressions, and it
+    doesn't need to run every line through _skip_useless_lines and
+    split_gpg_and_payload.  Paragraphs with no (wanted) fields are skipped.
+
+    PGP signed paragraphs are handed over to parse_signed, a function taking an
+    iterator over the lines of the paragraph (it should consume the lines up to
+    the end of the signature); its result is yielded as is, unless it is empty.
+    """
+    ws = _WHITESPACE
+    if fields is not None:
+        fields = frozenset(fields)
+    # Maps the text in front of a colon to the key it stands for; None
+    # means an unwanted field, and False not a field at all.
+    key_cache = {}
+
+    parsed = _ParsedParagraph()
+    started = False
+    curkey = None
+    content = None
+
+    for line in lines:
+        line = line.strip('\r\n')
+
+        if not line:
+            if started:
+                if curkey is not None:
+                    parsed.order.append(curkey)
+                    parsed[curkey] = '\n'.join(content)
+                    curkey = None
+                if parsed:
+                    yield parsed
+                    parsed = _ParsedParagraph()
+                started = False
+            continue
+
+        first = line[0]
+        if first == '#':
+            continue
+
+        if not started:
+            if (line.startswith('-----BEGIN PGP ') and
+                    Deb822._gpg_re.match(line)):
+                # Let the regular parser deal with the signed paragraph,
+                # and go on from the line following the signature.
+                paragraph = parse_signed(itertools.chain([line], lines))
+                if paragraph:
+                    yield paragraph
+                continue
+            started = True
+
+        if first in ws:
+            # Continuation line.  (A lone whitespace character doesn't
+            # count as one.)
+            if curkey is not None and len(line) > 1:
+                content.append(line)
+            continue
+
+        colon = line.find(':')
+        if colon == -1:
+            if line.startswith('-----') and Deb822._gpg_re.match(line):
+                # Stray signature in the middle of a paragraph: drop it,
+                # and end the paragraph, as split_gpg_and_payload does.
+                if line.startswith('-----BEGIN'):
+                    for line in lines:
+                        if line.startswith('-----END PGP '):
+                            break
+                if curkey is not None:
+                    parsed.order.append(curkey)
+                    parsed[curkey] = '\n'.join(content)
+                    curkey = None
+                if parsed:
+                    yield parsed
+                    parsed = _ParsedParagraph()
+                started = False
+            continue
+
+        raw_key = line[:colon]
+        try:
+            key = key_cache[raw_key]
+        except KeyError:
+            key = raw_key.rstrip(ws)
+            if not key or [c for c in ws if c in key]:
+                key = False
+            elif fields is not None and key not in fields:
+                key = None
+            else:
+                key = _strI(key)
+            key_cache[raw_key] = key
+        if key is False:
+            # Not a field at all; _internal_parser ignores such lines.
+            continue
+
+        if curkey is not None:
+            parsed.order.append(curkey)
+            parsed[curkey] = '\n'.join(content)
+        curkey = key
+        if key is not None:
+            content = [line[colon+1:].strip(ws)]
+
+    if curkey is not None:
+        parsed.order.append(curkey)
+        parsed[curkey] = '\n'.join(content)
+    if parsed:
+        yield parsed
+
+
+# Leading bytes of the compressed formats archive indexes are shipped in
+_COMPRESSION_MAGIC = [
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bzip2'),
+    ('\xfd7zXZ\x00', 'xz'),
+]
+
+
+def _compression_of(data):
+    """Return the name of the compression format data starts with, or None"""
+    if not isinstance(data, str):
+        return None
+    for magic, compression in _COMPRESSION_MAGIC:
+        if data.startswith(magic):
+            return compression
+    return None
+
+
+def _file_compression(fd):
+    """Return the compression format of a seekable file, or None
+
+    The file position is left unchanged.
+    """
+    try:
+        pos = fd.tell()
+        magic = fd.read(6)
+        fd.seek(pos)
+    except (IOError, ValueError):
+        return None
+    return _compression_of(magic)
+
+
+def _read_blocks(fd, block_size=None):
+    """Generator yielding the lines of fd in lists, one list per block read
+
+    Lines are split on '\\n' only (like iterating over a file object does) and
+    don't include the newline character.  If the data is gzip, bzip2 or xz
+    compressed (as told by its first bytes), it is decompressed on the fly.
+    """
+    block_size = block_size or READ_BLOCK_SIZE
+    # Make sure the first block is big enough to hold any magic number
+    first = fd.read(max(block_size, 6))
+    if not first:
+        return
+    blocks = itertools.chain([first], iter(lambda: fd.read(block_size), ''))
+    compression = _compression_of(first)
+    if compression is not None:
+        blocks = _compression._decompress_blocks(blocks, compression)
+    tail = ''
+    for block in blocks:
+        lines = (tail + block).split('\n')
+        tail = lines.pop()
+        yield lines
+    if tail:
+        yield [tail]
+
+
+def _iter_lines(sequence):
+    """Return an iterator over the lines of sequence (see Deb822.__init__)"""
+    if isinstance(sequence, basestring):
+        if _compression_of(sequence) is not None:
+            sequence = StringIO.StringIO(sequence)
+        else:
+            return iter(sequence.splitlines())
+    if hasattr(sequence, 'read'):
+        return itertools.chain.from_iterable(_read_blocks(sequence))
+    else:
+        return iter(sequence)
+
 
 class OrderedSet(object):
     """A set-like object that preserves order when iterating over it
@@ -137,16 +541,29 @@ class Deb822Dict(object, UserDict.DictMixin):
 
     If _parsed is not None, an optional _fields parameter specifies which keys
     in the _parsed dictionary are exposed.
+
+    Paragraphs of memory-mapped files (see _MappedParagraph) don't get keys of
+    their own: they use the keys of the schema they share with the other
+    paragraphs with the same fields, until they are modified.
     """
 
     # See the end of the file for the definition of _strI
 
     def __init__(self, _dict=None, _parsed=None, _fields=None,
-                 encoding="utf-8"):
-        self.__dict = {}
-        self.__keys = OrderedSet()
+                 encoding="utf-8", _detector=None):
         self.__parsed = None
         self.encoding = encoding
+        self._detector = _detector
+
+        if (_dict is None and _fields is None and
+                isinstance(_parsed, _MappedParagraph)):
+            # Both are set by __unshare when the keys change
+            self.__dict = self.__keys = None
+            self.__parsed = _parsed
+            return
+
+        self.__dict = {}
+        self.__keys = OrderedSet()
 
         if _dict is not None:
             # _dict may be a dict or a list of two-sized tuples
@@ -171,48 +588,47 @@ class Deb822Dict(object, UserDict.DictMixin):
             else:
                 self.__keys.extend([ _strI(f) for f in _fields if self.__parsed.has_key(f) ])
         
+    def __unshare(self):
+        """Give the object keys of its own, instead of the schema ones"""
+        self.__keys = OrderedSet(self.__parsed.keys())
+        self.__dict = {}
+
     ### BEGIN DictMixin methods
 
     def __setitem__(self, key, value):
         key = _strI(key)
+        if self.__keys is None:
+            self.__unshare()
         self.__keys.add(key)
         self.__dict[key] = value
         
     def __getitem__(self, key):
         key = _strI(key)
-        try:
-            value = self.__dict[key]
-        except KeyError:
-            if self.__parsed is not None and key in self.__keys:
-                value = self.__parsed[key]
-            else:
-                raise
-
-        if isinstance(value, str):
-            # Always return unicode objects instead of strings
+        if self.__keys is None:
+            value = self.__parsed[key]
+        else:
             try:
-                value = value.decode(self.encoding)
-            except UnicodeDecodeError, e:
-                # Evidently, the value wasn't encoded with the encoding the
-                # user specified.  Try detecting it.
-                warnings.warn('decoding from %s failed; attempting to detect '
-                              'the true encoding' % self.encoding,
-                              UnicodeWarning)
-                result = chardet.detect(value)
-                try:
-                    value = value.decode(result['encoding'])
-                except UnicodeDecodeError:
-                    raise e
+                value = self.__dict[key]
+            except KeyError:
+                if self.__parsed is not None and key in self.__keys:
+                    value = self.__parsed[key]
                 else:
-                    # Assume the rest of the paragraph is in this encoding as
-                    # well (there's no sense in repeating this exercise for
-                    # every field).
-                    self.encoding = result['encoding']
+                    raise
+
+        if isinstance(value, str):
+            # Always return unicode objects instead of strings.  If decoding
+            # needed a detected encoding, assume the rest of the paragraph is
+            # in this encoding as well (there's no sense in repeating this
+            # exercise for every field).
+            value, self.encoding = _decode_value(value, self.encoding,
+                                                 self._detector)
 
         return value
 
     def __delitem__(self, key):
         key = _strI(key)
+        if self.__keys is None:
+            self.__unshare()
         self.__keys.remove(key)
         try:
             del self.__dict[key]
@@ -223,9 +639,13 @@ class Deb822Dict(object, UserDict.DictMixin):
 
     def has_key(self, key):
         key = _strI(key)
+        if self.__keys is None:
+            return self.__parsed.has_key(key)
         return key in self.__keys
     
     def keys(self):
+        if self.__keys is None:
+            return [str(key) for key in self.__parsed.keys()]
         return [str(key) for key in self.__keys]
     
     ### END DictMixin methods
@@ -254,10 +674,31 @@ class Deb822Dict(object, UserDict.DictMixin):
     # TODO implement __str__() and make dump() use that?
 
 
+def _format_paragraph(paragraph):
+    """Return the contents of paragraph (a Deb822 or CompactDeb822 object) in
+    the original format, as a unicode object
+    """
+    entries = []
+    for key in paragraph.iterkeys():
+        value = paragraph.get_as_string(key)
+        if not value or value[0] == '\n':
+            # Avoid trailing whitespace after "Field:" if it's on its own
+            # line or the value is empty.  We don't have to worry about the
+            # case where value == '\n', since we ensure that is not the
+            # case in __setitem__.
+            entries.append('%s:%s\n' % (key, value))
+        else:
+            entries.append('%s: %s\n' % (key, value))
+    return ''.join(entries)
+
+
 class Deb822(Deb822Dict):
 
+    _gpg_re = re.compile(
+            r'^-----(?P<action>BEGIN|END) PGP (?P<what>[^-]+)-----$')
+
     def __init__(self, sequence=None, fields=None, _parsed=None,
-                 encoding="utf-8"):
+                 encoding="utf-8", _detector=None):
         """Create a new Deb822 instance.
 
         :param sequence: a string, or any any object that returns a line of
@@ -272,6 +713,9 @@ class Deb822(Deb822Dict):
         :param encoding: When parsing strings, interpret them in this encoding.
             (All values are given back as unicode objects, so an encoding is
             necessary in order to properly interpret the strings.)
+
+        :param _detector: internal parameter (the EncodingDetector shared by
+            the paragraphs of a file).
         """
 
         if hasattr(sequence, 'items'):
@@ -280,7 +724,7 @@ class Deb822(Deb822Dict):
         else:
             _dict = None
         Deb822Dict.__init__(self, _dict=_dict, _parsed=_parsed, _fields=fields,
-                            encoding=encoding)
+                            encoding=encoding, _detector=_detector)
 
         if sequence is not None:
             try:
@@ -291,41 +735,177 @@ class Deb822(Deb822Dict):
         self.gpg_info = None
 
     def iter_paragraphs(cls, sequence, fields=None, use_apt_pkg=True,
-                        shared_storage=False, encoding="utf-8"):
+                        shared_storage=False, encoding="utf-8",
+                        use_mmap=False, compact=False, fallback_encodings=None,
+                        relations=None):
         """Generator that yields a Deb822 object for each paragraph in sequence.
 
-        :param sequence: same as in __init__.
+        :param sequence: same as in __init__.  Strings and file-like objects
+            holding gzip, bzip2 or xz compressed data (e.g. a Packages.gz file
+            opened with file()) are decompressed on the fly; xz needs the lzma
+            module.
 
         :param fields: likewise.
 
-        :param use_apt_pkg: if sequence is a file(), apt_pkg will be used 
+        :param use_apt_pkg: if sequence is a file(), apt_pkg will be used
             if available to parse the file, since it's much much faster.  Set
-            this parameter to False to disable using apt_pkg.
+            this parameter to False to disable using apt_pkg.  Otherwise, a
+            native parser is used, which reads file-like objects in large
+            blocks.  apt_pkg is not used for compressed files either.
         :param shared_storage: not used, here for historical reasons.  Deb822
             objects never use shared storage anymore.
         :param encoding: Interpret the paragraphs in this encoding.
             (All values are given back as unicode objects, so an encoding is
             necessary in order to properly interpret the strings.)
+        :param use_mmap: if True, sequence must be a file() for a regular
+            file, which is memory-mapped instead of read.  Only the offsets of
+            each field are kept, and values are taken from the map when they
+            are looked up, which saves a lot of memory if only a few fields
+            are ever used; paragraphs with the same fields share their keys
+            until they are modified.  The map is kept open as long as any of
+            the yielded objects are alive.  Compressed files can't be mapped:
+            they are read and decompressed by the native parser instead.
+        :param compact: if True, yield read-only CompactDeb822 objects instead
+            of cls objects, to save memory when many paragraphs are kept
+            around (see compact.CompactDeb822).
+        :param fallback_encodings: a list of encodings to try, in order, for
+            values that can't be decoded with encoding, e.g. ['latin-1'].  By
+            default, their encoding is guessed with chardet.  Either way, this
+            is done with an EncodingDetector shared by all the paragraphs.
+        :param relations: a list of relationship fields (e.g. ['depends',
+            'pre-depends']) to parse as each paragraph is read, for classes
+            having a relations property (Packages and Sources).  Other fields
+            are still parsed on demand.  Can't be used with compact=True.
         """
 
-        if _have_apt_pkg and use_apt_pkg and isinstance(sequence, file):
+        if relations:
+            relations = [field.lower() for field in relations]
+            if compact:
+                raise ValueError('relations can not be parsed for compact '
+                                 'paragraphs')
+            known = [field.lower()
+                     for field in getattr(cls, '_relationship_fields', [])]
+            for field in relations:
+                if field not in known:
+                    raise ValueError('%s has no %r relationship field'
+                                     % (cls.__name__, field))
+            for paragraph in cls.iter_paragraphs(
+                    sequence, fields, use_apt_pkg, shared_storage, encoding,
+                    use_mmap, compact, fallback_encodings):
+                parsed = paragraph.relations
+                for field in relations:
+                    parsed[field]
+                yield paragraph
+            return
+
+        detector = EncodingDetector(fallback_encodings)
+        if compact:
+            CompactDeb822 = _compact.CompactDeb822
+
+        if use_mmap and _file_compression(sequence) is None:
+            for parsed in _mapped._iter_mapped(sequence, fields):
+                if compact:
+                    yield CompactDeb822(parsed, encoding=encoding,
+                                        _detector=detector)
+                else:
+                    yield cls(_parsed=parsed, encoding=encoding,
+                              _detector=detector)
+
+        elif (_have_apt_pkg and use_apt_pkg and isinstance(sequence, file)
+              and _file_compression(sequence) is None):
             parser = apt_pkg.TagFile(sequence)
             for section in parser:
-                paragraph = cls(fields=fields,
-                                _parsed=TagSectionWrapper(section),
-                                encoding=encoding)
+                if fields is None:
+                    parsed = TagSectionWrapper(section)
+                else:
+                    # Only take the wanted fields out of the section, and
+                    # don't even build paragraphs that have none of them.
+                    parsed = TagSectionWrapper.project(section, fields)
+                    if not parsed:
+                        continue
+                if compact:
+                    paragraph = CompactDeb822(parsed, encoding=encoding,
+                                              _detector=detector)
+                else:
+                    paragraph = cls(_parsed=parsed, encoding=encoding,
+                                    _detector=detector)
                 if paragraph:
                     yield paragraph
 
         else:
-            iterable = iter(sequence)
-            x = cls(iterable, fields, encoding=encoding)
-            while len(x) != 0:
-                yield x
-                x = cls(iterable, fields, encoding=encoding)
+            for paragraph in cls._iter_paragraphs_native(_iter_lines(sequence),
+                                                         fields, encoding,
+                                                         compact, detector):
+                yield paragraph
 
     iter_paragraphs = classmethod(iter_paragraphs)
 
+    def parallel_iter_paragraphs(cls, sequence, fields=None, processes=None,
+                                 chunk_size=None, ordered=True,
+                                 encoding="utf-8", fallback_encodings=None):
+        """Generator that yields a Deb822 object for each paragraph in sequence,
+        parsing it in a pool of processes.
+
+        The file is split into chunks of whole paragraphs, which are parsed
+        by worker processes with the native parser (see iter_paragraphs).
+        This is meant for big, unsigned files like Packages or Sources.
+
+        :param sequence: the name of the file to parse, or a file() for it.
+            gzip, bzip2 or xz compressed files are first decompressed to a
+            temporary file, which is removed once all the paragraphs are
+            yielded (or the generator is closed).
+
+        :param fields: same as in iter_paragraphs.
+
+        :param processes: the number of worker processes (default: the number
+            of CPUs).
+
+        :param chunk_size: the (approximate) size in bytes of each chunk
+            handed to a worker (default: parallel.PARALLEL_CHUNK_SIZE).
+
+        :param ordered: if False, paragraphs are yielded in no particular
+            order (though paragraphs from the same chunk stay together, in
+            order), as soon as any chunk is parsed.
+
+        :param encoding: same as in iter_paragraphs.
+
+        :param fallback_encodings: likewise.
+        """
+
+        return _parallel.iter_paragraphs(cls, sequence, fields, processes,
+                                         chunk_size, ordered, encoding,
+                                         fallback_encodings)
+
+    parallel_iter_paragraphs = classmethod(parallel_iter_paragraphs)
+
+    @classmethod
+    def _iter_paragraphs_native(cls, lines, fields, encoding, compact=False,
+                                detector=None):
+        """Generator that yields a cls object for each paragraph in lines
+
+        If compact is True, CompactDeb822 objects are yielded instead.  See
+        _parse_paragraphs.
+        """
+        if compact:
+            CompactDeb822 = _compact.CompactDeb822
+
+        def parse_signed(lines):
+            paragraph = cls(lines, fields, encoding=encoding,
+                            _detector=detector)
+            if compact:
+                paragraph = CompactDeb822(paragraph)
+            return paragraph
+
+        for parsed in _parse_paragraphs(lines, fields, parse_signed):
+            if not isinstance(parsed, _ParsedParagraph):
+                yield parsed
+            elif compact:
+                yield CompactDeb822(parsed, encoding=encoding,
+                                    _detector=detector)
+            else:
+                yield cls(_parsed=parsed, encoding=encoding,
+                          _detector=detector)
+
     ###
 
     @staticmethod
@@ -351,7 +931,10 @@ class Deb822(Deb822Dict):
         multi = re.compile(key_part + r"$")
         multidata = re.compile(r"^\s(?P<data>.+?)\s*$")
 
+        if fields is not None:
+            fields = frozenset(fields)
         wanted_field = lambda f: fields is None or f in fields
+        ws = _WHITESPACE
 
         if isinstance(sequence, basestring):
             sequence = sequence.splitlines()
@@ -361,6 +944,17 @@ class Deb822(Deb822Dict):
 
         for line in self.gpg_stripped_paragraph(
                 self._skip_useless_lines(sequence)):
+            if fields is not None:
+                # Don't bother matching the regular expressions against
+                # lines starting unwanted fields.
+                key = line[:max(line.find(':'), 0)].rstrip(ws)
+                if (key and key not in fields
+                        and not [c for c in ws if c in key]):
+                    if curkey:
+                        self[curkey] = content
+                    curkey = None
+                    continue
+
             m = single.match(line)
             if m:
                 if curkey:
@@ -387,10 +981,11 @@ class Deb822(Deb822Dict):
                 content = ""
                 continue
 
-            m = multidata.match(line)
-            if m:
-                content += '\n' + line # XXX not m.group('data')?
-                continue
+            if curkey:
+                m = multidata.match(line)
+                if m:
+                    content += '\n' + line # XXX not m.group('data')?
+                    continue
 
         if curkey:
             self[curkey] = content
@@ -424,32 +1019,13 @@ class Deb822(Deb822Dict):
         """
 
         if fd is None:
-            fd = StringIO.StringIO()
-            return_string = True
-        else:
-            return_string = False
+            return _format_paragraph(self)
 
         if encoding is None:
             # Use the encoding we've been using to decode strings with if none
             # was explicitly specified
             encoding = self.encoding
-
-        for key in self.iterkeys():
-            value = self.get_as_string(key)
-            if not value or value[0] == '\n':
-                # Avoid trailing whitespace after "Field:" if it's on its own
-                # line or the value is empty.  We don't have to worry about the
-                # case where value == '\n', since we ensure that is not the
-                # case in __setitem__.
-                entry = '%s:%s\n' % (key, value)
-            else:
-                entry = '%s: %s\n' % (key, value)
-            if not return_string:
-                fd.write(entry.encode(encoding))
-            else:
-                fd.write(entry)
-        if return_string:
-            return fd.getvalue()
+        fd.write(_format_paragraph(self).encode(encoding))
 
     ###
 
@@ -548,7 +1124,7 @@ class Deb822(Deb822Dict):
         lines = []
         gpg_post_lines = []
         state = 'SAFE'
-        gpgre = re.compile(r'^-----(?P<action>BEGIN|END) PGP (?P<what>[^-]+)-----$')
+        gpgre = Deb822._gpg_re
         blank_line = re.compile('^$')
         first_line = True
 
@@ -663,6 +1239,9 @@ class GpgInfo(dict):
     # keys with format "key keyid uid"
     uidkeys = ('GOODSIG', 'EXPSIG', 'EXPKEYSIG', 'REVKEYSIG', 'BADSIG')
 
+    # Set on the objects returned by from_sequence when gpgv was killed
+    timed_out = False
+
     def valid(self):
         """Is the signature valid?"""
         return self.has_key('GOODSIG') or self.has_key('VALIDSIG')
@@ -711,7 +1290,8 @@ class GpgInfo(dict):
         return n 
 
     @classmethod
-    def from_sequence(cls, sequence, keyrings=None, executable=None):
+    def from_sequence(cls, sequence, keyrings=None, executable=None,
+                      timeout=None):
         """Create a new GpgInfo object from the given sequence.
 
         :param sequence: sequence of lines or a string
@@ -721,8 +1301,35 @@ class GpgInfo(dict):
 
         :param executable: list of args for subprocess.Popen, the first element
             being the gpgv executable (default: ['/usr/bin/gpgv'])
+
+        :param timeout: if given, gpgv is killed after that many seconds; the
+            GpgInfo object then has no keys, and its timed_out attribute is
+            True
+        """
+
+        args = cls._gpgv_args(keyrings, executable)
+        return cls._run_gpgv(args, sequence, timeout)
+
+    @classmethod
+    def from_sequences(cls, sequences, keyrings=None, executable=None,
+                       timeout=None, workers=None):
+        """Return a list of GpgInfo objects for the given sequences, in the
+        same order, running up to workers gpgv processes at once (default:
+        the number of CPUs)
+
+        This is much faster than calling from_sequence for each of many
+        signed documents, e.g. all the .dsc files of an archive.  The other
+        arguments are the same as in from_sequence; timeout applies to each
+        gpgv process separately.
         """
 
+        return cls._run_gpgv_all(sequences, None, keyrings, executable,
+                                 timeout, workers)
+
+    @classmethod
+    def _gpgv_args(cls, keyrings, executable):
+        """Return the arguments to run gpgv with (see from_sequence)"""
+
         keyrings = keyrings or GPGV_DEFAULT_KEYRINGS
         executable = executable or [GPGV_EXECUTABLE]
 
@@ -735,18 +1342,82 @@ class GpgInfo(dict):
         
         if "--keyring" not in args:
             raise IOError, "cannot access any of the given keyrings"
+        return args
+
+    @classmethod
+    def _run_gpgv(cls, args, sequence, timeout=None):
+        """Run gpgv on sequence, and return a GpgInfo object for its output
+        (see from_sequence)"""
 
         p = subprocess.Popen(args, stdin=subprocess.PIPE,
                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         # XXX what to do with exit code?
 
-        if isinstance(sequence, basestring):
-            (out, err) = p.communicate(sequence)
-        else:
-            (out, err) = p.communicate(cls._get_full_string(sequence))
+        if not isinstance(sequence, basestring):
+            sequence = cls._get_full_string(sequence)
 
+        timer = None
+        killed = []
+        if timeout is not None:
+            def kill():
+                killed.append(True)
+                try:
+                    p.kill()
+                except OSError:
+                    # It has just exited
+                    pass
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        try:
+            try:
+                (out, err) = p.communicate(sequence)
+            except (IOError, OSError), e:
+                # Killed before reading all its input
+                if not killed or e.errno != errno.EPIPE:
+                    raise
+                p.wait()
+                out = err = ''
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if killed:
+            # Don't trust the partial output of a killed gpgv
+            n = cls.from_output('', err)
+            n.timed_out = True
+            return n
         return cls.from_output(out, err)
 
+    @classmethod
+    def from_files(cls, targets, *args, **kwargs):
+        """Return a list of GpgInfo objects for the given files, in the same
+        order.
+
+        See GpgInfo.from_sequences.
+        """
+        def read(target):
+            f = file(target)
+            try:
+                return f.read()
+            finally:
+                f.close()
+        return cls._run_gpgv_all(targets, read, *args, **kwargs)
+
+    @classmethod
+    def _run_gpgv_all(cls, items, load=None, keyrings=None, executable=None,
+                      timeout=None, workers=None):
+        """Run gpgv on each of items (or on what load returns for it), in a
+        pool of threads (see from_sequences)"""
+
+        args = cls._gpgv_args(keyrings, executable)
+
+        def verify(item):
+            if load is not None:
+                item = load(item)
+            return cls._run_gpgv(args, item, timeout)
+
+        return _parallel._thread_map(verify, items, workers)
+
     @staticmethod
     def _get_full_string(sequence):
         """Return a string from a sequence of lines.
@@ -774,6 +1445,33 @@ class GpgInfo(dict):
         return cls.from_sequence(file(target), *args, **kwargs)
 
 
+class _FrozenDict(dict):
+    """A dict which can't be modified after its creation"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('%s object is read-only' % type(self).__name__)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+            update = _readonly
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class _FrozenList(list):
+    """A list which can't be modified after its creation"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('%s object is read-only' % type(self).__name__)
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = \
+            __imul__ = append = extend = insert = pop = remove = reverse = \
+            sort = _readonly
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
 class PkgRelation(object):
     """Inter-package relationships
 
@@ -791,44 +1489,158 @@ class PkgRelation(object):
     __pipe_sep_RE = re.compile(r'\s*\|\s*')
     __blank_sep_RE = re.compile(r'\s*')
 
+    # Characters allowed in each part of a relationship by __dep_RE
+    __name_chars = string.ascii_letters + string.digits + '.+-'
+    __version_chars = string.ascii_letters + string.digits + ':-+~.'
+    __arch_chars = string.ascii_letters + string.digits + '_-!' + _WHITESPACE
+
+    # Parsed relationship strings, and parsed relationships, by (type, raw
+    # string); both are emptied when relations_cache_size is reached
+    _relations_cache = {}
+    _relation_cache = {}
+    relations_cache_size = 10000
+
     @classmethod
-    def parse_relations(cls, raw):
-        """Parse a package relationship string (i.e. the value of a field like
-        Depends, Recommends, Build-Depends ...)
+    def __parse_archs(cls, raw):
+        # assumption: no space beween '!' and architecture name
+        archs = []
+        for arch in cls.__blank_sep_RE.split(raw.strip()):
+            if len(arch) and arch[0] == '!':
+                archs.append((False, arch[1:]))
+            else:
+                archs.append((True, arch))
+        return archs
+
+    @classmethod
+    def __scan_rel(cls, raw):
+        """Parse a single relationship without regular expressions
+
+        raw must have been stripped of surrounding whitespace.  Return None
+        unless raw is one of the common forms ("name", "name (relop version)",
+        optionally followed by "[archs]") that __dep_RE would parse the same
+        way.
         """
-        def parse_archs(raw):
-            # assumption: no space beween '!' and architecture name
-            archs = []
-            for arch in cls.__blank_sep_RE.split(raw.strip()):
-                if len(arch) and arch[0] == '!':
-                    archs.append((False, arch[1:]))
-                else:
-                    archs.append((True, arch))
-            return archs
-
-        def parse_rel(raw):
-            match = cls.__dep_RE.match(raw)
-            if match:
-                parts = match.groupdict()
-                d = { 'name': parts['name'] }
-                if not (parts['relop'] is None or parts['version'] is None):
-                    d['version'] = (parts['relop'], parts['version'])
+        ws = _WHITESPACE
+        version = arch = None
+        if raw[-1:] == ']':
+            bracket = raw.find('[')
+            if bracket < 0:
+                return None
+            archs = raw[bracket + 1:-1]
+            if not archs.strip(ws) or archs.strip(cls.__arch_chars):
+                return None
+            arch = []
+            for a in archs.split():
+                if a[0] == '!':
+                    arch.append((False, a[1:]))
                 else:
-                    d['version'] = None
-                if parts['archs'] is None:
-                    d['arch'] = None
-                else:
-                    d['arch'] = parse_archs(parts['archs'])
-                return d
+                    arch.append((True, a))
+            raw = raw[:bracket].rstrip(ws)
+        elif '[' in raw:
+            return None
+        if raw[-1:] == ')':
+            name, paren, inner = raw[:-1].partition('(')
+            if not paren:
+                return None
+            relop = inner.lstrip(ws)
+            version = relop.lstrip('<=>')
+            relop = relop[:len(relop) - len(version)]
+            version = version.strip(ws)
+            if (not relop or not version or
+                    version.strip(cls.__version_chars)):
+                return None
+            version = (relop, version)
+            raw = name.rstrip(ws)
+        elif '(' in raw:
+            return None
+        if len(raw) < 2 or raw.strip(cls.__name_chars):
+            return None
+        return {'name': raw, 'version': version, 'arch': arch}
+
+    @classmethod
+    def __match_rel(cls, raw):
+        match = cls.__dep_RE.match(raw)
+        if match:
+            parts = match.groupdict()
+            d = { 'name': parts['name'] }
+            if not (parts['relop'] is None or parts['version'] is None):
+                d['version'] = (parts['relop'], parts['version'])
             else:
-                print >> sys.stderr, \
-                        'deb822.py: WARNING: cannot parse package' \
-                        ' relationship "%s", returning it raw' % raw
-                return { 'name': raw, 'version': None, 'arch': None }
+                d['version'] = None
+            if parts['archs'] is None:
+                d['arch'] = None
+            else:
+                d['arch'] = cls.__parse_archs(parts['archs'])
+            return d
+        else:
+            print >> sys.stderr, \
+                    'deb822.py: WARNING: cannot parse package' \
+                    ' relationship "%s", returning it raw' % raw
+            return None
+
+    @staticmethod
+    def __freeze(rel):
+        """Return a read-only copy of rel, a single relationship"""
+        if rel['arch'] is not None:
+            rel['arch'] = _FrozenList(rel['arch'])
+        return _FrozenDict(rel)
 
-        tl_deps = cls.__comma_sep_RE.split(raw.strip()) # top-level deps
-        cnf = map(cls.__pipe_sep_RE.split, tl_deps)
-        return map(lambda or_deps: map(parse_rel, or_deps), cnf)
+    @classmethod
+    def __parse_uncached(cls, raw):
+        """Parse raw into a tuple of tuples of shared, read-only relationships
+
+        Return None instead if some relationship couldn't be parsed at all.
+        """
+        ws = _WHITESPACE
+        cache = cls._relation_cache
+        if len(cache) >= cls.relations_cache_size:
+            cache.clear()
+        cnf = []
+        for tl_dep in raw.strip(ws).split(','):     # top-level deps
+            or_deps = []
+            for rel in tl_dep.split('|'):
+                rel = rel.strip(ws)
+                key = (type(rel), rel)
+                d = cache.get(key)
+                if d is None:
+                    d = cls.__scan_rel(rel)
+                    if d is None:
+                        if not cls.__dep_RE.match(rel):
+                            return None
+                        d = cls.__match_rel(rel)
+                    d = cache[key] = cls.__freeze(d)
+                or_deps.append(d)
+            cnf.append(tuple(or_deps))
+        return tuple(cnf)
+
+    @classmethod
+    def parse_relations(cls, raw):
+        """Parse a package relationship string (i.e. the value of a field like
+        Depends, Recommends, Build-Depends ...)
+
+        Results are cached, and the dictionaries representing single
+        relationships are shared by all the strings they appear in: they
+        (and their 'arch' lists) are read-only, unlike the lists containing
+        them.  Trying to modify them raises TypeError; use e.g.
+        dict(rel, version=None) to get a modified copy.
+        """
+        key = (type(raw), raw)
+        cnf = cls._relations_cache.get(key)
+        if cnf is None:
+            cnf = cls.__parse_uncached(raw)
+            if cnf is None:
+                # Some relationship is unparseable; go through the regular
+                # expressions again, so that it's reported and returned raw.
+                tl_deps = cls.__comma_sep_RE.split(raw.strip())
+                return [[cls.__freeze(cls.__match_rel(rel) or
+                                      {'name': rel, 'version': None,
+                                       'arch': None})
+                         for rel in cls.__pipe_sep_RE.split(tl_dep)]
+                        for tl_dep in tl_deps]
+            if len(cls._relations_cache) >= cls.relations_cache_size:
+                cls._relations_cache.clear()
+            cls._relations_cache[key] = cnf
+        return [list(or_deps) for or_deps in cnf]
 
     @staticmethod
     def str(rels):
@@ -863,6 +1675,115 @@ class _lowercase_dict(dict):
         return dict.__getitem__(self, key.lower())
 
 
+class _relations_dict(_lowercase_dict):
+    """Dictionary of the relationship fields of a paragraph, which parses
+    each field the first time it is looked up
+
+    Fields that haven't been parsed yet are kept aside, as raw strings, in
+    the _pending dict: only parsed values are stored in the dict itself, so
+    that code copying it with the dict API (e.g. dict(relations)) never sees
+    placeholders, only the fields parsed so far.  The methods giving access
+    to several values at once parse all the fields first.
+    """
+
+    def __init__(self, parsed, pending):
+        """Create a dict of parsed relationship fields
+
+        :param parsed: dict of the fields already parsed, by lowercased name
+
+        :param pending: dict of the raw values of the other fields, by
+            lowercased name
+        """
+        _lowercase_dict.__init__(self, parsed)
+        self._pending = pending
+
+    def __getitem__(self, key):
+        key = key.lower()
+        try:
+            return dict.__getitem__(self, key)
+        except KeyError:
+            if key not in self._pending:
+                raise
+        value = PkgRelation.parse_relations(self._pending.pop(key))
+        dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def parse_all(self):
+        """Parse all the fields that haven't been parsed yet"""
+        pending = self._pending
+        while pending:
+            key, raw = pending.popitem()
+            dict.__setitem__(self, key, PkgRelation.parse_relations(raw))
+
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if self._pending.pop(key, None) is None:
+            dict.__delitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._pending
+
+    has_key = __contains__
+
+    def __len__(self):
+        return dict.__len__(self) + len(self._pending)
+
+    def __iter__(self):
+        return itertools.chain(dict.__iter__(self), list(self._pending))
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return dict.keys(self) + self._pending.keys()
+
+    def clear(self):
+        self._pending.clear()
+        dict.clear(self)
+
+    def __eq__(self, other):
+        self.parse_all()
+        if isinstance(other, _relations_dict):
+            other.parse_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        self.parse_all()
+        return (self.__class__, (dict(self), {}))
+
+    def _parsing_all(name):
+        method = getattr(dict, name)
+        def parsing_all(self, *args, **kwargs):
+            self.parse_all()
+            return method(self, *args, **kwargs)
+        parsing_all.__name__ = name
+        parsing_all.__doc__ = method.__doc__
+        return parsing_all
+
+    __repr__ = _parsing_all('__repr__')
+    copy = _parsing_all('copy')
+    items = _parsing_all('items')
+    iteritems = _parsing_all('iteritems')
+    itervalues = _parsing_all('itervalues')
+    pop = _parsing_all('pop')
+    popitem = _parsing_all('popitem')
+    setdefault = _parsing_all('setdefault')
+    update = _parsing_all('update')
+    values = _parsing_all('values')
+    del _parsing_all
+
+
 class _PkgRelationMixin(object):
     """Package relationship mixin
 
@@ -883,8 +1804,12 @@ class _PkgRelationMixin(object):
     """
 
     def __init__(self, *args, **kwargs):
-        self.__relations = _lowercase_dict({})
-        self.__parsed_relations = False
+        # Built when the relations property is first used
+        self.__relations = None
+
+    def __make_relations(self):
+        parsed = {}
+        pending = {}
         for name in self._relationship_fields:
             # To avoid reimplementing Deb822 key lookup logic we use a really
             # simple dict subclass which just lowercase keys upon lookup. Since
@@ -895,11 +1820,13 @@ class _PkgRelationMixin(object):
             # relations property.
             keyname = name.lower()
             if self.has_key(name):
-                self.__relations[keyname] = None   # lazy value
-                    # all lazy values will be expanded before setting
-                    # __parsed_relations to True
+                # lazy value, parsed on first lookup
+                pending[keyname] = self[name]
             else:
-                self.__relations[keyname] = []
+                parsed[keyname] = []
+        # The dict doesn't refer back to self, so that paragraphs aren't
+        # kept in reference cycles
+        return _relations_dict(parsed, pending)
 
     @property
     def relations(self):
@@ -912,7 +1839,11 @@ class _PkgRelationMixin(object):
         for the comprehensive field list.
 
         Dictionary values are package relationships returned as lists of lists
-        of dictionaries (see below for some examples).
+        of dictionaries (see below for some examples).  Each field is only
+        parsed when it is first looked up, so e.g. pkg.relations['depends']
+        doesn't parse the other fields.  Copies made with dict() or
+        {}.update() only get the fields parsed so far; use the copy() method,
+        or call parse_all() first, to get all of them.
 
         The encoding of package relationships is as follows:
         - the top-level lists corresponds to the comma-separated list of
@@ -944,12 +1875,8 @@ class _PkgRelationMixin(object):
           [ [ {'name': 'tcl8.4-dev'} ],
             [ {'name': 'procps', 'arch': (false, 'hurd-i386')} ] ]
         """
-        if not self.__parsed_relations:
-            lazy_rels = filter(lambda n: self.__relations[n] is None,
-                    self.__relations.keys())
-            for n in lazy_rels:
-                self.__relations[n] = PkgRelation.parse_relations(self[n])
-            self.__parsed_relations = True
+        if self.__relations is None:
+            self.__relations = self.__make_relations()
         return self.__relations
 
 
@@ -1074,21 +2001,140 @@ class _gpg_multivalued(_multivalued):
         _multivalued.__init__(self, *args, **kwargs)
 
 
-class Dsc(_gpg_multivalued):
+class _VerifyFilesMixin(object):
+    """Checksum verification of the files listed in a paragraph
+
+    To use, subclass _VerifyFilesMixin from a class with a _checksum_fields
+    attribute: a list of (field, key, algorithm) tuples, where field is the
+    name of a multivalued field listing files, key the name of the checksum
+    in its entries, and algorithm the name of the hashlib algorithm giving
+    it.  See Dsc, Changes and Release as examples.
+
+    Unless _files_in_subdirectories is True, file names must not have a
+    directory part.
+    """
+
+    _files_in_subdirectories = False
+
+    def _file_index(self):
+        """Return the list of the names of the listed files, in the order
+        they are first listed, the dict returned by files_by_path, and a list
+        of (field, problem) pairs for the malformed checksum fields
+        """
+        fields = [field for field, key, algorithm in self._checksum_fields
+                  if self.has_key(field)]
+        # Detect changes to the fields (but not to the entries they contain)
+        signature = [(field, id(self[field]), len(self[field]))
+                     for field in fields]
+        cached = getattr(self, '_VerifyFilesMixin__index', None)
+        if cached is not None and cached[0] == signature:
+            return cached[1:]
+
+        names = []
+        by_path = {}
+        problems = []
+
+        def malformed(field):
+            # Report the field name as spelled in the paragraph
+            for k in self.keys():
+                if k.lower() == field:
+                    problems.append((str(k), 'malformed checksum field'))
+                    return
+
+        for field, key, algorithm in self._checksum_fields:
+            if field not in fields:
+                continue
+            try:
+                entries = _multivalued_entries(self[field])
+            except ValueError:
+                malformed(field)
+                continue
+            for entry in entries:
+                try:
+                    name, size, digest = (entry['name'], entry['size'],
+                                          entry[key])
+                except KeyError:
+                    # Too few columns
+                    malformed(field)
+                    continue
+                try:
+                    merged = by_path[name]
+                except KeyError:
+                    names.append(name)
+                    merged = by_path[name] = {'name': name, 'size': size}
+                merged[key] = digest
+        self.__index = (signature, names, by_path, problems)
+        return names, by_path, problems
+
+    def files_by_path(self):
+        """Return a dict mapping the name of each listed file to a dict with
+        its name, size and all its checksums, keyed like in the entries of
+        the checksum fields (e.g. 'md5sum', 'sha256')
+
+        The dict is built once and kept until a checksum field is replaced or
+        has entries added or removed; it must not be modified.  Entries with
+        missing columns are left out, and so are field values that aren't
+        entries at all (verify_files reports them).
+        """
+        return self._file_index()[1]
+
+    def _valid_name(self, name):
+        if not name or os.path.isabs(name):
+            return False
+        parts = name.split('/')
+        if not self._files_in_subdirectories and len(parts) > 1:
+            return False
+        return '..' not in parts and '' not in parts
+
+    def verify_files(self, directory, workers=None, cache=None,
+                     ignore_missing=False):
+        """Check the files listed in this paragraph against their sizes and
+        checksums
+
+        The files are looked for in directory, and hashed by workers threads
+        at once (default: verify.VERIFY_WORKERS).  Each file is read only
+        once, whatever the number of checksums it has.
+
+        :param cache: a verify.VerificationCache; files whose size and
+            modification time match the cache aren't hashed again, and the
+            checksums of the others are stored in it
+
+        :param ignore_missing: if True, files that don't exist are not
+            reported (e.g. the uncompressed indexes listed in Release files
+            aren't usually on mirrors)
+
+        Return a list of (name, problem) pairs, problem being a string
+        describing what is wrong with the file: an empty list means that all
+        the files are present and correct.  Malformed checksum fields are
+        reported first, as (field, 'malformed checksum field') pairs.
+        """
+        return _verify.verify_files(self, directory, workers, cache,
+                                    ignore_missing)
+
+
+class Dsc(_gpg_multivalued, _VerifyFilesMixin):
     _multivalued_fields = {
         "files": [ "md5sum", "size", "name" ],
         "checksums-sha1": ["sha1", "size", "name"],
         "checksums-sha256": ["sha256", "size", "name"],
     }
 
+    _checksum_fields = [
+        ("files", "md5sum", "md5"),
+        ("checksums-sha1", "sha1", "sha1"),
+        ("checksums-sha256", "sha256", "sha256"),
+    ]
 
-class Changes(_gpg_multivalued):
+
+class Changes(_gpg_multivalued, _VerifyFilesMixin):
     _multivalued_fields = {
         "files": [ "md5sum", "size", "section", "priority", "name" ],
         "checksums-sha1": ["sha1", "size", "name"],
         "checksums-sha256": ["sha256", "size", "name"],
     }
 
+    _checksum_fields = Dsc._checksum_fields
+
     def get_pool_path(self):
         """Return the path in the pool where the files would be installed"""
     
@@ -1137,7 +2183,7 @@ class PdiffIndex(_multivalued):
         return max(lengths)
 
 
-class Release(_multivalued):
+class Release(_multivalued, _VerifyFilesMixin):
     """Represents a Release file
 
     Set the size_field_behavior attribute to "dak" to make the size field
@@ -1153,6 +2199,13 @@ class Release(_multivalued):
         "sha256": [ "sha256", "size", "name" ],
     }
 
+    _checksum_fields = [
+        ("md5sum", "md5sum", "md5"),
+        ("sha1", "sha1", "sha1"),
+        ("sha256", "sha256", "sha256"),
+    ]
+    _files_in_subdirectories = True
+
     __size_field_behavior = "apt-ftparchive"
     def set_size_field_behavior(self, value):
         if value not in ["apt-ftparchive", "dak"]:
@@ -1202,6 +2255,21 @@ class Packages(Deb822, _PkgRelationMixin):
         _PkgRelationMixin.__init__(self, *args, **kwargs)
 
 
+def _multivalued_entries(value):
+    """Return the list of entries of value, the value of a multivalued field
+
+    _multivalued gives a single Deb822Dict (empty if there was no value at
+    all) instead of a list when the field has its value on the field line.
+    """
+    if isinstance(value, list):
+        return value
+    if hasattr(value, 'keys'):
+        if value:
+            return [value]
+        return []
+    raise ValueError('%r is not the value of a multivalued field' % (value,))
+
+
 class _CaseInsensitiveString(str):
     """Case insensitive string.
     """
@@ -1222,4 +2290,29 @@ class _CaseInsensitiveString(str):
         return self.str_lower
 
 
-_strI = _CaseInsensitiveString
+# Maximum number of _CaseInsensitiveString objects kept by _strI
+STRI_CACHE_SIZE = 1000
+
+_strI_cache = {}
+
+
+def _strI(str_):
+    """Return a _CaseInsensitiveString for str_
+
+    Field names repeat a lot, so the objects made for plain strings are cached
+    and shared.  The cache is keyed on the exact string, so that different
+    spellings of a key get different objects, each preserving its own case
+    (caching them by their lowercased value caused #473254).  Like the re
+    module does, the cache is simply emptied when it grows too big.
+    """
+    if type(str_) is not str:
+        if isinstance(str_, _CaseInsensitiveString):
+            return str_
+        return _CaseInsensitiveString(str_)
+    try:
+        return _strI_cache[str_]
+    except KeyError:
+        if len(_strI_cache) >= STRI_CACHE_SIZE:
+            _strI_cache.clear()
+        s = _strI_cache[str_] = _CaseInsensitiveString(str_)
+        return s
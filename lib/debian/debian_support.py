@@ -21,17 +21,28 @@
 import os
 import re
 import hashlib
+import json
+import thread
 import types
 
 from deprecation import function_deprecated_by
 
 try:
     import apt_pkg
-    apt_pkg.init()
     _have_apt_pkg = True
 except ImportError:
     _have_apt_pkg = False
 
+# apt_pkg.init() reads the whole APT configuration, so it is only called the
+# first time apt_pkg is actually used (see _init_apt_pkg).
+_apt_pkg_initialized = False
+
+def _init_apt_pkg():
+    global _apt_pkg_initialized
+    if not _apt_pkg_initialized:
+        apt_pkg.init()
+        _apt_pkg_initialized = True
+
 class ParseError(Exception):
     """An exception which is used to signal a parse failure.
 
@@ -91,18 +102,24 @@ class BaseVersion(object):
         self.full_version = version
 
     def _set_full_version(self, version):
-        m = self.re_valid_version.match(version)
+        self.__full_version = version
+        (self.__epoch, self.__upstream_version,
+         self.__debian_revision) = self._split(version)
+
+    @classmethod
+    def _split(cls, version):
+        """Return the (epoch, upstream_version, debian_revision) of version
+
+        Raises ValueError if version is invalid.
+        """
+        m = cls.re_valid_version.match(version)
         if not m:
             raise ValueError("Invalid version string %r" % version)
         # If there no epoch ("1:..."), then the upstream version can not
         # contain a :.
         if (m.group("epoch") is None and ":" in m.group("upstream_version")):
             raise ValueError("Invalid version string %r" % version)
-
-        self.__full_version = version
-        self.__epoch = m.group("epoch")
-        self.__upstream_version = m.group("upstream_version")
-        self.__debian_revision = m.group("debian_revision")
+        return m.group("epoch", "upstream_version", "debian_revision")
 
     def __setattr__(self, attr, value):
         if attr not in self.magic_attrs:
@@ -169,6 +186,7 @@ class AptPkgVersion(BaseVersion):
         if not _have_apt_pkg:
             raise NotImplementedError("apt_pkg not available; install the "
                                       "python-apt package")
+        _init_apt_pkg()
         super(AptPkgVersion, self).__init__(version)
 
     def __cmp__(self, other):
@@ -184,27 +202,102 @@ class NativeVersion(BaseVersion):
     re_digit = re.compile("\d")
     re_alpha = re.compile("[A-Za-z]")
 
+    # Maximum number of entries in _string_keys
+    string_key_cache_size = 1000
+    _string_keys = {}
+
+    def _set_full_version(self, version):
+        super(NativeVersion, self)._set_full_version(version)
+        # The sort key is computed when it is first needed
+        self.__sort_key = None
+
+    def _get_sort_key(self):
+        if self.__sort_key is None:
+            self.__sort_key = self._make_sort_key(self)
+        return self.__sort_key
+
+    sort_key = property(_get_sort_key, doc="""A key for sorting versions
+
+        Comparing the sort keys of two versions gives the same result as
+        comparing the versions (i.e. as dpkg --compare-versions), so that
+        sorted(versions, key=operator.attrgetter('sort_key')) orders them
+        without going through __cmp__.  The key is computed once, and cached
+        until the version is modified.
+        """)
+
     def __cmp__(self, other):
         # Convert other into an instance of BaseVersion if it's not already.
         # (All we need is epoch, upstream_version, and debian_revision
         # attributes, which BaseVersion gives us.) Requires other's string
         # representation to be the raw version.
+        if isinstance(other, (NativeVersion, FrozenVersion)):
+            return cmp(self.sort_key, other.sort_key)
         if not isinstance(other, BaseVersion):
             try:
                 other = BaseVersion(str(other))
             except ValueError, e:
                 raise ValueError("Couldn't convert %r to BaseVersion: %s"
                                  % (other, e))
+        return cmp(self.sort_key, self._make_sort_key(other))
+
+    @classmethod
+    def _make_sort_key(cls, version):
+        """Return the sort key of version, a BaseVersion"""
+        return cls._parts_key(version.epoch, version.upstream_version,
+                              version.debian_revision)
 
-        res = cmp(int(self.epoch or "0"), int(other.epoch or "0"))
-        if res != 0:
-            return res
-        res = self._version_cmp_part(self.upstream_version,
-                                     other.upstream_version)
-        if res != 0:
-            return res
-        return self._version_cmp_part(self.debian_revision or "0",
-                                      other.debian_revision or "0")
+    @classmethod
+    def _parts_key(cls, epoch, upstream_version, debian_revision):
+        """Return the sort key of a version, given its parts
+
+        This follows the structure of dpkg's version comparison: the epoch,
+        then the upstream version and the Debian revision, each split into
+        alternating non-digit and digit runs (see _part_key).
+        """
+        return (int(epoch or "0"),
+                cls._part_key(upstream_version),
+                cls._part_key(debian_revision or "0"))
+
+    @classmethod
+    def _part_key(cls, part):
+        """Return the sort key of an upstream version or Debian revision
+
+        The key alternates the key of each non-digit run (see _string_key)
+        with the value of the digit run following it (0 if there is none),
+        starting with a non-digit run, which is empty if part starts with a
+        digit.  It is terminated by the key of an empty run, which sorts
+        before any run starting with a letter or other character, but after
+        one starting with a tilde, just like the end of a version does.
+        """
+        key = []
+        for run in cls.re_all_digits_or_not.findall(part):
+            if run[0].isdigit():
+                if not key:
+                    key.append(cls._string_key(""))
+                key.append(int(run))
+            else:
+                key.append(cls._string_key(run))
+        if len(key) % 2:
+            key.append(0)
+        key.append(cls._string_key(""))
+        return tuple(key)
+
+    @classmethod
+    def _string_key(cls, run):
+        """Return the sort key of a run of non-digit characters
+
+        This is the tuple of the orders of its characters (see _order),
+        terminated by a 0, which sorts after a tilde but before anything
+        else, like the end of the run does.
+        """
+        try:
+            return cls._string_keys[run]
+        except KeyError:
+            if len(cls._string_keys) >= cls.string_key_cache_size:
+                cls._string_keys.clear()
+            key = tuple([cls._order(x) for x in run] + [0])
+            cls._string_keys[run] = key
+            return key
 
     @classmethod
     def _order(cls, x):
@@ -218,54 +311,258 @@ class NativeVersion(BaseVersion):
         else:
             return ord(x) + 256
 
-    @classmethod
-    def _version_cmp_string(cls, va, vb):
-        la = [cls._order(x) for x in va]
-        lb = [cls._order(x) for x in vb]
-        while la or lb:
-            a = 0
-            b = 0
-            if la:
-                a = la.pop(0)
-            if lb:
-                b = lb.pop(0)
-            res = cmp(a, b)
-            if res != 0:
-                return res
-        return 0
+class FrozenVersion(object):
+    """An immutable, lightweight Debian package version
+
+    FrozenVersion objects have the same read-only attributes as BaseVersion
+    (full_version, epoch, upstream_version, debian_revision, plus
+    debian_version and sort_key), but use __slots__ and plain attributes
+    instead of BaseVersion's __getattr__/__setattr__ machinery, so they are
+    much cheaper to create and to use as dict keys or set members.  They
+    can't be modified.
+
+    They compare like NativeVersion objects do (i.e. like dpkg), against
+    each other, strings, and any BaseVersion.  They hash by sort key, so that
+    equal versions spelled differently (e.g. "1.0" and "0:1.0") are the same
+    dict key or set member.  BaseVersion objects hash like their string
+    instead, so mixing FrozenVersion objects with strings or other version
+    classes as keys of the same dict or set is not supported.
+    """
 
-    @classmethod
-    def _version_cmp_part(cls, va, vb):
-        la = cls.re_all_digits_or_not.findall(va)
-        lb = cls.re_all_digits_or_not.findall(vb)
-        while la or lb:
-            a = "0"
-            b = "0"
-            if la:
-                a = la.pop(0)
-            if lb:
-                b = lb.pop(0)
-            if cls.re_digits.match(a) and cls.re_digits.match(b):
-                a = int(a)
-                b = int(b)
-                res = cmp(a, b)
-                if res != 0:
-                    return res
+    __slots__ = ('full_version', 'epoch', 'upstream_version',
+                 'debian_revision', '_sort_key', '_hash')
+
+    def __init__(self, version):
+        version = str(version)
+        epoch, upstream_version, debian_revision = BaseVersion._split(version)
+        set_ = object.__setattr__
+        set_(self, 'full_version', version)
+        set_(self, 'epoch', epoch)
+        set_(self, 'upstream_version', upstream_version)
+        set_(self, 'debian_revision', debian_revision)
+        set_(self, '_sort_key', None)
+        set_(self, '_hash', None)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("FrozenVersion objects can't be modified")
+
+    def __delattr__(self, attr):
+        raise AttributeError("FrozenVersion objects can't be modified")
+
+    # For compatibility with the old changelog.Version class
+    debian_version = property(lambda self: self.debian_revision)
+
+    def _get_sort_key(self):
+        if self._sort_key is None:
+            object.__setattr__(self, '_sort_key', NativeVersion._parts_key(
+                self.epoch, self.upstream_version, self.debian_revision))
+        return self._sort_key
+
+    sort_key = property(_get_sort_key,
+                        doc="A key for sorting versions, see NativeVersion")
+
+    def __cmp__(self, other):
+        if isinstance(other, (NativeVersion, FrozenVersion)):
+            return cmp(self.sort_key, other.sort_key)
+        try:
+            return cmp(self.sort_key, version_sort_key(other))
+        except ValueError, e:
+            raise ValueError("Couldn't convert %r to a version: %s"
+                             % (other, e))
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(self.sort_key))
+        return self._hash
+
+    def __str__(self):
+        return self.full_version
+
+    def __repr__(self):
+        return "%s('%s')" % (self.__class__.__name__, self)
+
+    def __reduce__(self):
+        return (self.__class__, (self.full_version,))
+
+class _LRUCache(object):
+    """A mapping keeping only its maxsize most recently used items
+
+    Lookups are counted in the hits and misses attributes.  It can be shared
+    between threads: lookups and updates hold a lock while they relink the
+    list of items.
+    """
+
+    # Indices in the links of the circular doubly linked list of items, from
+    # the least to the most recently used one
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._links = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        # threading.Lock is this very function, but importing threading
+        # would double the time it takes to import this module
+        self._lock = thread.allocate_lock()
+
+    def __len__(self):
+        return len(self._links)
+
+    def __getitem__(self, key):
+        self._lock.acquire()
+        try:
+            try:
+                link = self._links[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            self._unlink(link)
+            self._append(link)
+            return link[self.VALUE]
+        finally:
+            self._lock.release()
+
+    def __setitem__(self, key, value):
+        self._lock.acquire()
+        try:
+            if key in self._links:
+                link = self._links[key]
+                self._unlink(link)
+                link[self.VALUE] = value
             else:
-                res = cls._version_cmp_string(a, b)
-                if res != 0:
-                    return res
-        return 0
+                if len(self._links) >= self.maxsize:
+                    oldest = self._root[self.NEXT]
+                    self._unlink(oldest)
+                    del self._links[oldest[self.KEY]]
+                link = [None, None, key, value]
+                self._links[key] = link
+            self._append(link)
+        finally:
+            self._lock.release()
+
+    def _unlink(self, link):
+        prev, next = link[self.PREV], link[self.NEXT]
+        prev[self.NEXT] = next
+        next[self.PREV] = prev
+
+    def _append(self, link):
+        root = self._root
+        last = root[self.PREV]
+        link[self.PREV] = last
+        link[self.NEXT] = root
+        last[self.NEXT] = root[self.PREV] = link
+
+# Cache of version comparison results, by pair of version strings (see
+# set_version_compare_cache_size)
+_compare_cache = None
+
+def set_version_compare_cache_size(size):
+    """Cache the results of the last size version comparisons
+
+    Once enabled, version_compare and comparisons between Version objects
+    look up the pair of version strings in a process-wide LRU cache before
+    comparing them, which helps when the same pairs are compared over and
+    over (e.g. when checking the same dependencies for many packages).  A
+    size of 0 or None disables the cache, which is the default.  Setting
+    the size empties the cache and resets its counters.
+    """
+    global _compare_cache
+    if size:
+        _compare_cache = _LRUCache(size)
+    else:
+        _compare_cache = None
+
+def version_compare_cache_info():
+    """Return a dict with statistics of the version comparison cache
+
+    Its keys are hits, misses, size (the number of cached results) and
+    maxsize (0 if the cache is disabled).
+    """
+    cache = _compare_cache
+    if cache is None:
+        return {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 0}
+    return {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache),
+            'maxsize': cache.maxsize}
+
+def _cached_compare(a, b, compare):
+    """Return compare(), caching it for the version strings of a and b"""
+    cache = _compare_cache
+    if cache is None:
+        return compare()
+    key = (str(a), str(b))
+    try:
+        return cache[key]
+    except KeyError:
+        result = cache[key] = compare()
+        return result
 
 if _have_apt_pkg:
-    class Version(AptPkgVersion):
-        pass
+    _DefaultVersion = AptPkgVersion
 else:
-    class Version(NativeVersion):
-        pass
+    _DefaultVersion = NativeVersion
+
+class Version(_DefaultVersion):
+    def __cmp__(self, other):
+        # The comparison cache is disabled by default, in which case
+        # comparisons don't pay for it
+        if _compare_cache is None:
+            return _DefaultVersion.__cmp__(self, other)
+        return _cached_compare(self, other,
+                               lambda: _DefaultVersion.__cmp__(self, other))
 
 def version_compare(a, b):
-    return cmp(Version(a), Version(b))
+    if _compare_cache is None:
+        return cmp(_DefaultVersion(a), _DefaultVersion(b))
+    return _cached_compare(
+        a, b, lambda: cmp(_DefaultVersion(a), _DefaultVersion(b)))
+
+def version_sort_key(version):
+    """Return a key for sorting version, a string or a BaseVersion
+
+    Sort keys compare like the versions they are made from do (see
+    NativeVersion.sort_key), but no Version object is created.  Raises
+    ValueError if version is invalid.
+    """
+    if isinstance(version, (NativeVersion, FrozenVersion)):
+        return version.sort_key
+    return NativeVersion._parts_key(*BaseVersion._split(str(version)))
+
+def sort_versions(versions, reverse=False):
+    """Return a new list with the items of versions, sorted by version
+
+    versions may hold version strings or BaseVersion objects, which are
+    returned as is.  Each version is only parsed once, and the list is
+    sorted by sort key (see version_sort_key), whether apt_pkg is available
+    or not: sort keys order versions exactly like dpkg does.  Raises
+    ValueError if a version is invalid.
+    """
+    return sorted(versions, key=version_sort_key, reverse=reverse)
+
+def max_version(versions):
+    """Return the greatest version in versions (see sort_versions)
+
+    Raises ValueError if versions is empty, like max(), or if a version is
+    invalid.
+    """
+    return max(versions, key=version_sort_key)
+
+def group_latest(pairs):
+    """Return a dict mapping names to their greatest version
+
+    pairs is an iterable of (name, version) pairs, e.g. (package, version)
+    pairs from several suites; versions are compared as in sort_versions.
+    """
+    latest = {}
+    keys = {}
+    for name, version in pairs:
+        key = version_sort_key(version)
+        if name not in latest or key > keys[name]:
+            latest[name] = version
+            keys[name] = key
+    return latest
 
 class PackageFile:
     """A Debian package file.
@@ -454,6 +751,45 @@ def replace_file(lines, local):
 
 replaceFile = function_deprecated_by(replace_file)
 
+def _write_data_file(filename, format_version, data):
+    """Atomically replace filename with data, a dict of plain data (strings,
+    numbers, lists, tuples and dicts with string keys), as JSON
+
+    Byte strings are saved as if they were latin-1, so that they are read
+    back unchanged by _read_data_file, whatever their encoding.
+    """
+    data = dict(data)
+    data['version'] = format_version
+    replace_file([json.dumps(data, encoding='latin-1')], filename)
+
+def _read_data_file(filename, format_version):
+    """Return the dict saved to filename by _write_data_file
+
+    Tuples are read back as lists, and strings as byte strings.  IOError is
+    raised if filename can't be read, and ValueError if it doesn't hold data
+    saved with format_version.  Unlike pickles, these files only hold data,
+    so reading one written by somebody else can't run any code.
+    """
+    f = file(filename)
+    try:
+        data = json.load(f)
+    finally:
+        f.close()
+    if not isinstance(data, dict) or data.get('version') != format_version:
+        raise ValueError('%s does not hold version %s data'
+                         % (filename, format_version))
+    return _from_json(data)
+
+def _from_json(value):
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    elif isinstance(value, list):
+        return [_from_json(item) for item in value]
+    elif isinstance(value, dict):
+        return dict([(_from_json(k), _from_json(v))
+                     for k, v in value.iteritems()])
+    return value
+
 def download_gunzip_lines(remote):
     """Downloads a file from a remote location and gunzips it.
 
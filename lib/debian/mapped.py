@@ -0,0 +1,65 @@
+# mapped.py -- memory-mapped parsing of deb822 files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Memory-mapped parsing of deb822 files, for Deb822.iter_paragraphs
+
+See the use_mmap parameter of Deb822.iter_paragraphs.
+"""
+
+import array
+import mmap
+import os
+
+from deb822 import _MappedParagraph, _scan_paragraphs
+
+
+def _iter_mapped(fd, fields=None):
+    """Generator yielding a _MappedParagraph for each paragraph in fd
+
+    fd must be a file object (or anything with a fileno method) for a regular,
+    uncompressed file (see _file_compression).
+    """
+    if os.fstat(fd.fileno()).st_size == 0:
+        # Empty files can't be mapped
+        return
+    map_ = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    schemas = {}
+    for start, end, found in _scan_paragraphs(map_, fields):
+        offsets = array.array('L', [start, end])
+        positions = {}
+        for key, value_start, value_end in found:
+            try:
+                # A repeated field keeps its position, but takes the new
+                # value.
+                i = positions[key]
+            except KeyError:
+                positions[key] = len(positions)
+                offsets.append(value_start)
+                offsets.append(value_end)
+            else:
+                offsets[2*i+2] = value_start
+                offsets[2*i+3] = value_end
+        keys = tuple([key for key, value_start, value_end in found])
+        if len(positions) != len(keys):
+            keys = tuple(sorted(positions, key=positions.get))
+        # Key objects are unique per spelling (see _scan_paragraphs), so
+        # going by their ids keeps apart fields differing only in case.
+        ids = tuple(map(id, keys))
+        try:
+            schema = schemas[ids]
+        except KeyError:
+            schema = schemas[ids] = (keys, positions)
+        yield _MappedParagraph(map_, schema, offsets)
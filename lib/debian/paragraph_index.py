@@ -0,0 +1,226 @@
+# paragraph_index.py -- on-disk index of the paragraphs of deb822 files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""On-disk index of the paragraphs of deb822 files, by name
+
+See ParagraphIndex.
+"""
+
+import hashlib
+import mmap
+import os
+
+from deb822 import (Deb822, READ_BLOCK_SIZE, _file_compression, _join_value,
+                    _scan_paragraphs, _strI)
+from debian_support import _read_data_file, _write_data_file
+
+
+class ParagraphIndex(object):
+    """Index of the paragraphs of a Packages or Sources file, by name
+
+    The index maps the values of some fields (by default, Package, which is
+    the binary package name in Packages files and the source package name in
+    Sources files) to the offset and length of the paragraphs they appear in,
+    so that single paragraphs can be loaded by seeking straight to them
+    instead of going through the whole file with iter_paragraphs.  Only the
+    first word of each value is indexed, so that e.g. "Source: foo (1.0-1)"
+    is found under "foo".
+
+    Compressed files can't be indexed, since paragraphs are read by seeking
+    to their offset in the file.
+
+    The index is saved to a sidecar file (by default, the name of the indexed
+    file with ".idx" appended), together with the size, modification time and
+    SHA1 hash of the indexed file.  It is rebuilt (and saved again) whenever
+    these don't match the indexed file anymore.  The sidecar file is JSON, so
+    loading it can't run any code, whoever wrote it.
+
+    Example:
+
+        index = ParagraphIndex('/mirror/debian/.../Packages')
+        for pkg in index.get('libc6', cls=Packages):
+            print pkg['Version']
+    """
+
+    format_version = 3
+
+    def __init__(self, filename, fields=None, index_filename=None):
+        """Load the index of filename, building (and saving) it if needed
+
+        :param filename: the Packages or Sources file to index
+
+        :param fields: list of the names of the fields to index (default:
+            ['Package'])
+
+        :param index_filename: name of the sidecar file (default: filename
+            with ".idx" appended)
+        """
+        self.filename = filename
+        self.fields = list(fields or ['Package'])
+        self.index_filename = index_filename or filename + '.idx'
+        self.size = self.mtime = self.sha1 = None
+        self.entries = {}
+        self.refresh()
+
+    def _stat(self):
+        st = os.stat(self.filename)
+        return st.st_size, st.st_mtime
+
+    def is_current(self):
+        """Does the index match the size and mtime of the indexed file?"""
+        return self._stat() == (self.size, self.mtime)
+
+    def refresh(self):
+        """Make sure the index is up to date with the indexed file
+
+        If the size or mtime of the file changed, but the contents didn't, only
+        the saved metadata is updated; otherwise, the index is rebuilt.
+        """
+        if self.size is None:
+            self.load()
+            if self.size is None:
+                self.build()
+                self.save()
+                return
+
+        if self.is_current():
+            return
+
+        size, mtime = self._stat()
+        if size == self.size and self._hash_file() == self.sha1:
+            self.mtime = mtime
+        else:
+            self.build()
+        self.save()
+
+    def _hash_file(self):
+        f = open(self.filename, 'rb')
+        try:
+            sha1 = hashlib.sha1()
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), ''):
+                sha1.update(block)
+            return sha1.hexdigest()
+        finally:
+            f.close()
+
+    def build(self):
+        """(Re)build the index from the indexed file
+
+        ValueError is raised if the file is compressed.
+        """
+        size, mtime = self._stat()
+        entries = dict([(_strI(field), {}) for field in self.fields])
+        sha1 = hashlib.sha1()
+        if size:
+            f = open(self.filename, 'rb')
+            try:
+                compression = _file_compression(f)
+                if compression is not None:
+                    raise ValueError('%s is %s compressed, and can not be '
+                                     'indexed' % (self.filename, compression))
+                map_ = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                f.close()
+            try:
+                sha1.update(map_)
+                for start, end, found in _scan_paragraphs(map_, self.fields):
+                    for key, value_start, value_end in found:
+                        value = _join_value(map_[value_start:value_end])
+                        if not value:
+                            continue
+                        name = value.split()[0]
+                        entries[key].setdefault(name, []).append(
+                            (start, end - start))
+            finally:
+                map_.close()
+
+        self.size = size
+        self.mtime = mtime
+        self.sha1 = sha1.hexdigest()
+        # Keyed by lowercased field name, for case-insensitive lookups
+        self.entries = dict([(str(key).lower(), names)
+                             for key, names in entries.items()])
+
+    def load(self):
+        """Load the saved index, if there is a usable one
+
+        Return True if the index was loaded.  Note that the loaded index might
+        be out of date; see refresh.
+        """
+        try:
+            data = _read_data_file(self.index_filename, self.format_version)
+            if sorted(data['fields']) != sorted(self.fields):
+                return False
+            size, mtime, sha1 = data['size'], data['mtime'], data['sha1']
+            entries = {}
+            for field, names in data['entries'].iteritems():
+                entries[field] = dict([(name, [tuple(location)
+                                               for location in locations])
+                                       for name, locations
+                                       in names.iteritems()])
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            return False
+        self.size, self.mtime, self.sha1 = size, mtime, sha1
+        self.entries = entries
+        return True
+
+    def save(self):
+        """Save the index to the sidecar file"""
+        _write_data_file(self.index_filename, self.format_version, {
+            'fields': self.fields,
+            'size': self.size,
+            'mtime': self.mtime,
+            'sha1': self.sha1,
+            'entries': self.entries,
+        })
+
+    def lookup(self, name, field=None):
+        """Return a list of (offset, length) pairs of the paragraphs for name
+
+        The index is refreshed first if the indexed file has changed.
+
+        :param field: the indexed field to look name up in (default: the
+            first one)
+        """
+        if field is None:
+            field = self.fields[0]
+        self.refresh()
+        try:
+            names = self.entries[field.lower()]
+        except KeyError:
+            raise KeyError(field)
+        return list(names.get(name, []))
+
+    def __contains__(self, name):
+        return bool(self.lookup(name))
+
+    def get(self, name, field=None, cls=Deb822, encoding="utf-8"):
+        """Return a list of cls objects for the paragraphs for name
+
+        The index is refreshed first if the indexed file has changed.
+        """
+        locations = self.lookup(name, field)
+        if not locations:
+            return []
+        paragraphs = []
+        f = open(self.filename, 'rb')
+        try:
+            for offset, length in locations:
+                f.seek(offset)
+                paragraphs.append(cls(f.read(length), encoding=encoding))
+        finally:
+            f.close()
+        return paragraphs
@@ -0,0 +1,223 @@
+# parallel.py -- parallel parsing of deb822 files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Parsing of deb822 files in a pool of processes, and thread helpers
+
+See Deb822.parallel_iter_paragraphs.
+"""
+
+import itertools
+import mmap
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+
+from charset import EncodingDetector
+from compression import _decompress_blocks
+from deb822 import (Deb822, READ_BLOCK_SIZE, _ParsedParagraph,
+                    _file_compression, _parse_paragraphs, _strI)
+
+
+# Default amount of data handed to each worker by parallel_iter_paragraphs
+PARALLEL_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _chunk_boundaries(filename, chunk_size):
+    """Return the offsets splitting filename into chunks of whole paragraphs
+
+    Each chunk is at least chunk_size bytes long (except for the last one),
+    and ends right before a blank line.  The first offset is 0, and the last
+    one is the size of the file.
+    """
+    f = open(filename, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return [0, 0]
+        map_ = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+    boundaries = [0]
+    try:
+        while boundaries[-1] + chunk_size < size:
+            target = boundaries[-1] + chunk_size
+            found = [i for i in (map_.find('\n\n', target),
+                                 map_.find('\n\r\n', target)) if i != -1]
+            if not found:
+                break
+            boundaries.append(min(found) + 1)
+    finally:
+        map_.close()
+    boundaries.append(size)
+    return boundaries
+
+
+def _parse_chunk(args):
+    """Parse a chunk of a file, for Deb822.parallel_iter_paragraphs
+
+    This runs in a worker process, so it returns plain data: a (keys, values)
+    pair of lists for each paragraph.
+    """
+    filename, start, end, fields, encoding = args
+    f = open(filename, 'rb')
+    try:
+        f.seek(start)
+        data = f.read(end - start)
+    finally:
+        f.close()
+
+    def parse_signed(lines):
+        paragraph = _ParsedParagraph()
+        d = Deb822(lines, fields, encoding=encoding)
+        for key in d:
+            key = _strI(key)
+            paragraph.order.append(key)
+            paragraph[key] = d[key]
+        return paragraph
+
+    paragraphs = []
+    for parsed in _parse_paragraphs(iter(data.split('\n')), fields,
+                                    parse_signed):
+        keys = parsed.keys()
+        paragraphs.append(([str(key) for key in keys],
+                           [parsed[key] for key in keys]))
+    return paragraphs
+
+
+def _decompressed_copy(filename):
+    """Decompress filename to a temporary file, and return the name of the
+    temporary file, or None if filename isn't compressed
+
+    Chunks are read from given offsets, which only works on uncompressed
+    data.  The caller must remove the temporary file.
+    """
+    f = open(filename, 'rb')
+    try:
+        compression = _file_compression(f)
+        if compression is None:
+            return None
+        fd, temporary = tempfile.mkstemp(prefix='deb822-')
+        out = os.fdopen(fd, 'wb')
+        try:
+            try:
+                blocks = iter(lambda: f.read(READ_BLOCK_SIZE), '')
+                for block in _decompress_blocks(blocks, compression):
+                    out.write(block)
+            finally:
+                out.close()
+        except:
+            os.unlink(temporary)
+            raise
+        return temporary
+    finally:
+        f.close()
+
+
+def iter_paragraphs(cls, sequence, fields=None, processes=None,
+                    chunk_size=None, ordered=True, encoding="utf-8",
+                    fallback_encodings=None):
+    """Generator that yields a cls object for each paragraph in sequence,
+    parsing it in a pool of processes
+
+    See Deb822.parallel_iter_paragraphs.
+    """
+    detector = EncodingDetector(fallback_encodings)
+    if isinstance(sequence, basestring):
+        filename = sequence
+    else:
+        filename = sequence.name
+    temporary = _decompressed_copy(filename)
+    if temporary is not None:
+        filename = temporary
+    try:
+        boundaries = _chunk_boundaries(filename,
+                                       chunk_size or PARALLEL_CHUNK_SIZE)
+        tasks = [(filename, start, end, fields, encoding)
+                 for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+        if len(tasks) == 1 or processes == 1:
+            pool = None
+            chunks = itertools.imap(_parse_chunk, tasks)
+        else:
+            pool = multiprocessing.Pool(processes)
+            if ordered:
+                chunks = pool.imap(_parse_chunk, tasks)
+            else:
+                chunks = pool.imap_unordered(_parse_chunk, tasks)
+
+        try:
+            for chunk in chunks:
+                for keys, values in chunk:
+                    parsed = _ParsedParagraph()
+                    for key, value in zip(keys, values):
+                        key = _strI(key)
+                        parsed.order.append(key)
+                        parsed[key] = value
+                    yield cls(_parsed=parsed, encoding=encoding,
+                              _detector=detector)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    finally:
+        if temporary is not None:
+            os.unlink(temporary)
+
+
+def _thread_map(function, items, workers=None):
+    """Return [function(item) for item in items], with up to workers calls
+    (default: the number of CPUs) running at once in separate threads
+
+    This is only worth it for functions spending most of their time outside
+    of the interpreter (doing I/O, hashing large blocks, running commands).
+    The first exception raised by a call, if any, is raised again once all
+    the threads are done.
+    """
+    items = list(items)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1 or len(items) <= 1:
+        return map(function, items)
+
+    results = [None] * len(items)
+    errors = []
+    # list.pop is atomic, so the threads can take their work from here
+    todo = list(enumerate(items))
+    todo.reverse()
+
+    def work():
+        while not errors:
+            try:
+                i, item = todo.pop()
+            except IndexError:
+                return
+            try:
+                results[i] = function(item)
+            except:
+                errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=work)
+               for i in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
@@ -0,0 +1,662 @@
+# relations.py -- analysis of the relationships between Debian packages
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Analysis of the relationships between the packages of an archive
+
+The classes in this module work on whole sets of packages (typically, the
+paragraphs of a Packages file), using the structured relationships given by
+the relations property of deb822.Packages objects (see
+deb822.PkgRelation.parse_relations for their format).
+"""
+
+import array
+import itertools
+
+import debian_support
+from deb822 import Packages, PkgRelation
+
+
+# The results of comparing (with cmp) the version of a candidate with the one
+# in a relation that satisfy each version relation operator.  '<' and '>' are
+# obsolete spellings of '<=' and '>='.
+_RELOPS = {
+    '<<': (-1,),
+    '<=': (-1, 0),
+    '<': (-1, 0),
+    '=': (0,),
+    '>=': (0, 1),
+    '>': (0, 1),
+    '>>': (1,),
+}
+
+
+# CPUs standing for the CPU part of architecture names that aren't CPUs
+# themselves, as in dpkg's cputable and tupletable (e.g. "any-arm" matches
+# armel and armhf)
+_ARCH_CPUS = {
+    'armel': 'arm',
+    'armhf': 'arm',
+    'lpia': 'i386',
+    'powerpcspe': 'powerpc',
+    'x32': 'amd64',
+}
+
+# (architecture, restriction) -> whether the restriction matches it
+_arch_matches_cache = {}
+
+
+def _arch_matches(architecture, restriction):
+    """Tell whether the architecture name in a restriction (like "i386",
+    "hurd-i386", or a wildcard like "linux-any", "any-amd64" or "any")
+    matches architecture, a Debian architecture name
+
+    Like with dpkg-architecture, names are split into an operating system and
+    a CPU, a name without an operating system being a Linux one (so that
+    "amd64" is "linux-amd64"), and "any" matches any operating system or CPU.
+    """
+    key = (architecture, restriction)
+    try:
+        return _arch_matches_cache[key]
+    except KeyError:
+        pass
+    if restriction == 'any':
+        result = True
+    else:
+        names = []
+        for name in (architecture, restriction):
+            if '-' in name:
+                names.append(name.split('-', 1))
+            else:
+                names.append(['linux', name])
+        (os_, cpu), (wanted_os, wanted_cpu) = names
+        if wanted_os not in ('any', os_):
+            result = False
+        elif wanted_cpu in ('any', cpu):
+            result = True
+        else:
+            # "any-arm" matches armel, but "linux-arm" is an architecture
+            # of its own
+            result = wanted_os == 'any' and wanted_cpu == _ARCH_CPUS.get(cpu)
+    _arch_matches_cache[key] = result
+    return result
+
+
+def _relations_of(paragraph, field):
+    """Return the relationships in field of paragraph, a Deb822 object
+
+    The relations property is used when paragraph has one (e.g. Packages
+    objects), so that they are only parsed once.
+    """
+    relations = getattr(paragraph, 'relations', None)
+    if relations is not None:
+        try:
+            return relations[field]
+        except KeyError:
+            pass
+    if not paragraph.has_key(field):
+        return []
+    return PkgRelation.parse_relations(paragraph[field])
+
+
+class ArchitectureFilter(object):
+    """Evaluate architecture restrictions for a list of architectures
+
+    Architecture restrictions ("foo [i386 amd64]", "bar [!hurd-i386]", and
+    wildcards like "baz [linux-any]" or "qux [any-amd64]") are turned into
+    bitmasks having a bit set for each of the architectures they apply to, in
+    the order of the list.  Each distinct restriction is only
+    evaluated once, however many relationships it appears in, and the
+    relationships of a package can then be reduced to all the architectures
+    at once.
+
+    Example, reducing Build-Depends for all the release architectures:
+
+        arch_filter = ArchitectureFilter(['amd64', 'armel', 'i386', ...])
+        for arch, relations in arch_filter.reduce_all(
+                src.relations['build-depends']).iteritems():
+            print arch, PkgRelation.str(relations)
+    """
+
+    def __init__(self, architectures):
+        self.architectures = list(architectures)
+        self._bits = dict([(arch, 1 << i)
+                           for i, arch in enumerate(self.architectures)])
+        # the mask of unrestricted relationships
+        self.all = (1 << len(self.architectures)) - 1
+        # tuple of (polarity, architecture) pairs -> mask
+        self._masks = {}
+
+    def mask(self, relation):
+        """Return the mask of the architectures relation (a dict, see
+        PkgRelation) applies to
+        """
+        archs = relation.get('arch')
+        if archs is None:
+            return self.all
+        key = tuple(archs)
+        try:
+            return self._masks[key]
+        except KeyError:
+            pass
+        wanted = unwanted = 0
+        positive = False
+        for polarity, arch in archs:
+            matching = 0
+            for name in self.architectures:
+                if _arch_matches(name, arch):
+                    matching |= self._bits[name]
+            if polarity:
+                positive = True
+                wanted |= matching
+            else:
+                unwanted |= matching
+        if positive:
+            mask = wanted
+        else:
+            mask = self.all & ~unwanted
+        self._masks[key] = mask
+        return mask
+
+    def applies(self, relation, architecture):
+        """Tell whether relation applies to architecture, one of the
+        architectures of the filter
+        """
+        return bool(self.mask(relation) & self._bits[architecture])
+
+    def reduce(self, relations, architecture):
+        """Return relations (in the format returned by
+        PkgRelation.parse_relations), without the relationships that don't
+        apply to architecture, nor the alternatives left empty
+        """
+        bit = self._bits[architecture]
+        reduced = []
+        for alternatives in relations:
+            kept = [rel for rel in alternatives if self.mask(rel) & bit]
+            if kept:
+                reduced.append(kept)
+        return reduced
+
+    def reduce_all(self, relations):
+        """Return a dict mapping each architecture of the filter to
+        relations, reduced to that architecture (see reduce)
+        """
+        reduced = dict([(arch, []) for arch in self.architectures])
+        targets = [(self._bits[arch], reduced[arch])
+                   for arch in self.architectures]
+        everywhere = self.all
+        for alternatives in relations:
+            masks = [self.mask(rel) for rel in alternatives]
+            if masks and min(masks) == everywhere:
+                # The common case: nothing to leave out anywhere
+                for bit, target in targets:
+                    target.append(list(alternatives))
+                continue
+            combined = 0
+            for mask in masks:
+                combined |= mask
+            for bit, target in targets:
+                if combined & bit:
+                    target.append([rel for rel, mask
+                                   in zip(alternatives, masks)
+                                   if mask & bit])
+        return reduced
+
+
+class DependencyChecker(object):
+    """Check whether relationships are satisfied by a set of packages
+
+    The packages (the "universe") are given as Deb822 objects, normally
+    Packages objects from Packages.iter_paragraphs.  They are indexed once by
+    name, along with the virtual packages they provide, so that each
+    relationship can be checked against the few candidates that may satisfy
+    it.  Results are cached for every distinct relationship, since the same
+    ones (like "libc6 (>= 2.7)") appear in thousands of packages.
+
+    A relationship is satisfied by a package with that name whose version
+    matches the version restriction, if any, or by a package providing that
+    name: unversioned Provides only satisfy unversioned relationships, and
+    versioned ones ("foo (= 1.0)") satisfy relationships with a matching
+    version.
+
+    If an architecture is given, architecture restrictions ("[i386]",
+    "[!hurd-i386]", "[linux-any]") are honoured: a relationship restricted to
+    other architectures is ignored, and an alternative ("|") made only of
+    ignored relationships is satisfied.  Otherwise, restrictions are not
+    looked at.
+
+    Paragraphs without a Package field can't be part of the universe: they
+    are left out, and kept in the skipped list instead.  A package without a
+    (valid) Version field only satisfies unversioned relationships.
+
+    Example, listing the broken dependencies of a Packages file:
+
+        packages = Packages.iter_paragraphs(file('Packages'))
+        checker = DependencyChecker(packages, architecture='i386')
+        for package, field, alternatives in checker.check_all():
+            print package['Package'], field, PkgRelation.str([alternatives])
+    """
+
+    def __init__(self, packages, architecture=None):
+        self.architecture = architecture
+        self.packages = []
+        # paragraphs left out of the universe, for lack of a Package field
+        self.skipped = []
+        # name -> list of the sort keys of the versions available under that
+        # name (None for unversioned virtual packages)
+        self._candidates = {}
+        # version string -> sort key (None for invalid versions)
+        self._version_keys = {}
+        # (name, version) of a relationship -> whether it's satisfied
+        self._results = {}
+        for package in packages:
+            self.add(package)
+
+    def add(self, package):
+        """Add package, a Deb822 object, to the universe
+
+        package is added to skipped instead if it has no Package field.
+        """
+        if not package.has_key('Package'):
+            self.skipped.append(package)
+            return
+        self.packages.append(package)
+        version = package.get('Version')
+        if version is None:
+            key = None
+        else:
+            key = self._version_key(version)
+        self._candidates.setdefault(package['Package'], []).append(key)
+        for alternatives in _relations_of(package, 'provides'):
+            for provided in alternatives:
+                version = provided.get('version')
+                if version is not None and version[0] == '=':
+                    key = self._version_key(version[1])
+                else:
+                    key = None
+                self._candidates.setdefault(provided['name'], []).append(key)
+        self._results.clear()
+
+    def _version_key(self, version):
+        try:
+            return self._version_keys[version]
+        except KeyError:
+            try:
+                key = debian_support.version_sort_key(version)
+            except ValueError:
+                key = None
+            self._version_keys[version] = key
+            return key
+
+    def applies(self, relation):
+        """Tell whether relation (a dict, see PkgRelation) applies to the
+        architecture of the checker
+        """
+        archs = relation.get('arch')
+        if archs is None or self.architecture is None:
+            return True
+        architecture = self.architecture
+        wanted = [arch for polarity, arch in archs if polarity]
+        if wanted:
+            for arch in wanted:
+                if _arch_matches(architecture, arch):
+                    return True
+            return False
+        for polarity, arch in archs:
+            if _arch_matches(architecture, arch):
+                return False
+        return True
+
+    def satisfied(self, relation):
+        """Tell whether relation (a dict, see PkgRelation) is satisfied by
+        some package of the universe
+
+        Architecture restrictions are not looked at (see applies).
+        """
+        version = relation.get('version')
+        cache_key = (relation['name'], version)
+        try:
+            return self._results[cache_key]
+        except KeyError:
+            pass
+
+        candidates = self._candidates.get(relation['name'], ())
+        if version is None:
+            result = bool(candidates)
+        else:
+            relop, wanted = version
+            wanted = self._version_key(wanted)
+            accepted = _RELOPS.get(relop, ())
+            result = False
+            if wanted is not None:
+                for key in candidates:
+                    if key is not None and cmp(key, wanted) in accepted:
+                        result = True
+                        break
+        self._results[cache_key] = result
+        return result
+
+    def unsatisfied(self, relations):
+        """Return the alternatives of relations that aren't satisfied
+
+        relations is in the format returned by PkgRelation.parse_relations,
+        i.e. a list of alternatives, each a list of relationships of which
+        at least one must be satisfied.
+        """
+        unsatisfied = []
+        for alternatives in relations:
+            applicable = [rel for rel in alternatives if self.applies(rel)]
+            if not applicable:
+                continue
+            for rel in applicable:
+                if self.satisfied(rel):
+                    break
+            else:
+                unsatisfied.append(alternatives)
+        return unsatisfied
+
+    def check(self, package, fields=('pre-depends', 'depends')):
+        """Return a list of (field, alternatives) pairs for the unsatisfied
+        alternatives in the given relationship fields of package
+        """
+        problems = []
+        for field in fields:
+            for alternatives in self.unsatisfied(_relations_of(package,
+                                                               field)):
+                problems.append((field, alternatives))
+        return problems
+
+    def check_all(self, fields=('pre-depends', 'depends')):
+        """Generator yielding a (package, field, alternatives) tuple for each
+        unsatisfied alternative in the given fields of the packages of the
+        universe
+        """
+        for package in self.packages:
+            for field, alternatives in self.check(package, fields):
+                yield package, field, alternatives
+
+
+def _compressed_rows(count, sources, targets):
+    """Group the (source, target) pairs given by the sources and targets
+    arrays by source
+
+    Return an (offsets, targets) pair of arrays, such that the targets of
+    source i are targets[offsets[i]:offsets[i + 1]], in the order they were
+    given.  Sources must be smaller than count.
+    """
+    offsets = array.array('l', [0] * (count + 1))
+    for source in sources:
+        offsets[source + 1] += 1
+    for i in xrange(count):
+        offsets[i + 1] += offsets[i]
+    positions = offsets[:-1]
+    grouped = array.array('l', [0] * len(targets))
+    for source, target in itertools.izip(sources, targets):
+        grouped[positions[source]] = target
+        positions[source] += 1
+    return offsets, grouped
+
+
+class ReverseDependencyIndex(object):
+    """Graph of the relationships between the packages of a Packages file
+
+    Every package name (be it of a real package, a virtual one, or one that
+    is only mentioned in relationships) is given an integer id, and for each
+    relationship field of Packages objects (see Packages._relationship_fields)
+    the index keeps which names each package refers to, and which packages
+    refer to each name, as compact arrays of ids.  Packages are read once, so
+    that queries like "who depends on X" only take a lookup afterwards.
+
+    Both alternatives of "a | b" are recorded, and version restrictions are
+    ignored, so "depends on" should be read as "may depend on".  Architecture
+    restrictions are ignored too, unless an architecture is given: the
+    relationships that don't apply to it are left out.  per_architecture
+    builds the indexes of several architectures in a single pass.  Paragraphs
+    without a Package field are skipped.
+
+    Indexes can be pickled (e.g. to be passed to other processes), or saved
+    to and loaded from a (JSON) file with save and load.
+
+    Example:
+
+        index = ReverseDependencyIndex.from_file(file('Packages'))
+        print index.rdepends('libc6')
+        print index.transitive_rdepends('libc6', provides=True)
+    """
+
+    format_version = 2
+
+    def __init__(self, packages=(), architecture=None):
+        """Index packages, an iterable of Packages objects
+
+        :param architecture: if given, only index the relationships applying
+            to this architecture
+        """
+        self._fill([self], packages, [architecture])
+
+    @classmethod
+    def per_architecture(cls, packages, architectures):
+        """Return a dict mapping each of architectures to the index of
+        packages for that architecture
+
+        packages is only iterated over once, and each distinct architecture
+        restriction is only evaluated once (see ArchitectureFilter).
+        """
+        indexes = [cls.__new__(cls) for arch in architectures]
+        cls._fill(indexes, packages, architectures)
+        return dict(zip(architectures, indexes))
+
+    @staticmethod
+    def _fill(indexes, packages, architectures):
+        """Index packages in each of indexes, for the architecture at the
+        same position in architectures (None for all architectures)
+        """
+        fields = list(Packages._relationship_fields)
+        names = []
+        ids = {}
+        # ids of the names of the indexed packages themselves
+        package_ids = set()
+
+        def id_of(name):
+            try:
+                return ids[name]
+            except KeyError:
+                id_ = ids[name] = len(names)
+                names.append(name)
+                return id_
+
+        if architectures == [None]:
+            arch_filter = None
+        else:
+            arch_filter = ArchitectureFilter(architectures)
+        # field -> a (sources, targets) pair of arrays for each architecture
+        edges = dict([(field, [(array.array('l'), array.array('l'))
+                               for arch in architectures])
+                      for field in fields])
+        for package in packages:
+            if not package.has_key('Package'):
+                continue
+            source = id_of(package['Package'])
+            package_ids.add(source)
+            for field in fields:
+                field_edges = edges[field]
+                for alternatives in _relations_of(package, field):
+                    for relation in alternatives:
+                        target = id_of(relation['name'])
+                        if arch_filter is None:
+                            mask = 1
+                        else:
+                            mask = arch_filter.mask(relation)
+                        for sources, targets in field_edges:
+                            if mask & 1:
+                                sources.append(source)
+                                targets.append(target)
+                            mask >>= 1
+
+        count = len(names)
+        for i, index in enumerate(indexes):
+            index.architecture = architectures[i]
+            index.fields = fields
+            index.names = names
+            index._ids = ids
+            index._packages = package_ids
+            index._forward = {}
+            index._reverse = {}
+            for field in fields:
+                sources, targets = edges[field][i]
+                index._forward[field] = _compressed_rows(count, sources,
+                                                         targets)
+                index._reverse[field] = _compressed_rows(count, targets,
+                                                         sources)
+
+    @classmethod
+    def from_file(cls, sequence, architecture=None, **kwargs):
+        """Build the index of the paragraphs of sequence
+
+        :param architecture: same as in __init__
+
+        Other keyword arguments are passed to Packages.iter_paragraphs.
+        """
+        fields = ['Package'] + ['-'.join([word.capitalize()
+                                          for word in field.split('-')])
+                                for field in Packages._relationship_fields]
+        kwargs.setdefault('fields', fields)
+        return cls(Packages.iter_paragraphs(sequence, **kwargs), architecture)
+
+    def __len__(self):
+        """Number of indexed packages"""
+        return len(self._packages)
+
+    def __contains__(self, name):
+        """Is name the name of an indexed package?"""
+        return self._ids.get(name) in self._packages
+
+    def _fields(self, fields):
+        if isinstance(fields, basestring):
+            fields = [fields]
+        for field in fields:
+            if field.lower() not in self._forward:
+                raise KeyError(field)
+        return [field.lower() for field in fields]
+
+    @staticmethod
+    def _neighbours(rows, fields, id_):
+        found = set()
+        for field in fields:
+            offsets, targets = rows[field]
+            found.update(targets[offsets[id_]:offsets[id_ + 1]])
+        return found
+
+    def _lookup(self, rows, name, fields):
+        fields = self._fields(fields)
+        id_ = self._ids.get(name)
+        if id_ is None:
+            return []
+        return sorted([self.names[i]
+                       for i in self._neighbours(rows, fields, id_)])
+
+    def depends(self, name, fields=('pre-depends', 'depends')):
+        """Return the sorted list of the names that the packages called name
+        refer to in the given fields
+        """
+        return self._lookup(self._forward, name, fields)
+
+    def rdepends(self, name, fields=('pre-depends', 'depends')):
+        """Return the sorted list of the packages referring to name in the
+        given fields
+        """
+        return self._lookup(self._reverse, name, fields)
+
+    def transitive_rdepends(self, name, fields=('pre-depends', 'depends'),
+                            provides=False):
+        """Return the sorted list of the packages that depend on name, either
+        directly or through other packages, in the given fields
+
+        :param provides: if True, packages depending on a virtual package
+            provided by a package in the result are also included
+        """
+        fields = self._fields(fields)
+        start = self._ids.get(name)
+        if start is None:
+            return []
+        seen = set([start])
+        todo = [start]
+        while todo:
+            id_ = todo.pop()
+            found = self._neighbours(self._reverse, fields, id_)
+            if provides:
+                found.update(self._neighbours(self._forward, ['provides'],
+                                              id_))
+            for other in found:
+                if other not in seen:
+                    seen.add(other)
+                    todo.append(other)
+        seen.discard(start)
+        return sorted([self.names[i] for i in seen if i in self._packages])
+
+    def _state(self, dump_array):
+        def rows(graph):
+            return dict([(field, (dump_array(offsets), dump_array(targets)))
+                         for field, (offsets, targets) in graph.iteritems()])
+        return {
+            'version': self.format_version,
+            'architecture': self.architecture,
+            'fields': self.fields,
+            'names': self.names,
+            'packages': sorted(self._packages),
+            'forward': rows(self._forward),
+            'reverse': rows(self._reverse),
+        }
+
+    def __getstate__(self):
+        # Arrays are pickled as lists of ints otherwise, which is both bigger
+        # and slower.
+        return self._state(array.array.tostring)
+
+    def __setstate__(self, state):
+        if state.get('version') != self.format_version:
+            raise ValueError('unsupported index format: %r'
+                             % state.get('version'))
+        def rows(graph):
+            return dict([(field, (array.array('l', offsets),
+                                  array.array('l', targets)))
+                         for field, (offsets, targets) in graph.iteritems()])
+        self.architecture = state.get('architecture')
+        self.fields = state['fields']
+        self.names = state['names']
+        self._ids = dict([(name, i) for i, name in enumerate(self.names)])
+        self._packages = set(state['packages'])
+        self._forward = rows(state['forward'])
+        self._reverse = rows(state['reverse'])
+
+    def save(self, filename):
+        """Save the index to filename"""
+        debian_support._write_data_file(filename, self.format_version,
+                                        self._state(array.array.tolist))
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index saved with save
+
+        Raises ValueError if filename doesn't hold an index of this version.
+        """
+        state = debian_support._read_data_file(filename, cls.format_version)
+        index = cls.__new__(cls)
+        try:
+            index.__setstate__(state)
+        except (KeyError, TypeError, AttributeError), e:
+            raise ValueError('%s does not contain a %s: %s'
+                             % (filename, cls.__name__, e))
+        return index
@@ -0,0 +1,178 @@
+# verify.py -- checksum verification of the files listed in deb822 paragraphs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Checksum verification of the files listed in deb822 paragraphs
+
+This is where the verify_files method of Dsc, Changes and Release objects
+does its work; see VerificationCache to avoid hashing unchanged files again.
+"""
+
+import errno
+import hashlib
+import os
+
+from deb822 import READ_BLOCK_SIZE
+from debian_support import _read_data_file, _write_data_file
+from parallel import _thread_map
+
+
+# Default number of threads hashing files at once in verify_files
+VERIFY_WORKERS = 4
+
+
+def _hash_file(filename, algorithms, block_size=None):
+    """Return the size of filename, and a dict mapping each of algorithms
+    (hashlib names) to the hex digest of its contents
+
+    The file is read once, in blocks big enough for hashlib to release the
+    GIL while hashing them.
+    """
+    hashes = [(algorithm, hashlib.new(algorithm)) for algorithm in algorithms]
+    size = 0
+    f = open(filename, 'rb')
+    try:
+        for block in iter(lambda: f.read(block_size or READ_BLOCK_SIZE), ''):
+            size += len(block)
+            for algorithm, hash_ in hashes:
+                hash_.update(block)
+    finally:
+        f.close()
+    return size, dict([(algorithm, hash_.hexdigest())
+                       for algorithm, hash_ in hashes])
+
+
+class VerificationCache(object):
+    """Sizes, modification times and checksums of files verified earlier
+
+    verify_files methods given a VerificationCache skip hashing the files
+    whose size and modification time haven't changed since they were last
+    hashed, and take their checksums from the cache instead.  Like a
+    ParagraphIndex, the cache can be saved to a (JSON) file, to be reused by
+    later runs:
+
+        cache = VerificationCache('/srv/mirror/.verified')
+        problems = release.verify_files('/srv/mirror/dists/sid', cache=cache)
+        cache.save()
+    """
+
+    format_version = 2
+
+    def __init__(self, filename=None):
+        """Create a cache, loading it from filename if given and readable"""
+        self.filename = filename
+        # absolute path -> (size, mtime, {algorithm: hex digest})
+        self.entries = {}
+        if filename is not None:
+            self.load()
+
+    def lookup(self, path, size, mtime, algorithms):
+        """Return the cached checksums of path, a dict mapping each of
+        algorithms to the hex digest, if path was hashed when it had this
+        size and modification time; otherwise, return None
+        """
+        try:
+            cached_size, cached_mtime, digests = \
+                    self.entries[os.path.abspath(path)]
+        except KeyError:
+            return None
+        if (cached_size, cached_mtime) != (size, mtime):
+            return None
+        for algorithm in algorithms:
+            if algorithm not in digests:
+                return None
+        return digests
+
+    def store(self, path, size, mtime, digests):
+        """Remember the checksums of path, with its size and mtime"""
+        self.entries[os.path.abspath(path)] = (size, mtime, dict(digests))
+
+    def load(self):
+        """Load the saved cache, if there is a usable one
+
+        Return True if the cache was loaded.
+        """
+        try:
+            data = _read_data_file(self.filename, self.format_version)
+            entries = {}
+            for path, (size, mtime, digests) in data['entries'].iteritems():
+                entries[path] = (size, mtime, dict(digests))
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            return False
+        self.entries = entries
+        return True
+
+    def save(self, filename=None):
+        """Save the cache to filename (default: the one it was loaded from)"""
+        _write_data_file(filename or self.filename, self.format_version,
+                         {'entries': self.entries})
+
+
+def verify_files(paragraph, directory, workers=None, cache=None,
+                 ignore_missing=False):
+    """Check the files listed in paragraph, a _VerifyFilesMixin object
+
+    See _VerifyFilesMixin.verify_files.
+    """
+    names, by_path, field_problems = paragraph._file_index()
+    algorithms = [(key, algorithm)
+                  for field, key, algorithm in paragraph._checksum_fields]
+
+    def check(name):
+        if not paragraph._valid_name(name):
+            # Don't let e.g. "../../etc/passwd" escape directory
+            return [(name, 'invalid file name')]
+        entry = by_path[name]
+        digests = dict([(algorithm, entry[key])
+                        for key, algorithm in algorithms
+                        if key in entry])
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+            actual = None
+            if cache is not None:
+                actual = cache.lookup(path, st.st_size, st.st_mtime,
+                                      digests)
+            if actual is None:
+                size, actual = _hash_file(path, digests.keys())
+                # Don't cache the checksums of a file modified while
+                # it was being hashed
+                after = os.stat(path)
+                if (cache is not None and size == st.st_size and
+                        (after.st_size, after.st_mtime) ==
+                        (st.st_size, st.st_mtime)):
+                    cache.store(path, size, st.st_mtime, actual)
+            else:
+                size = st.st_size
+        except (IOError, OSError), e:
+            if ignore_missing and e.errno == errno.ENOENT:
+                return []
+            return [(name, 'cannot read file: %s' % e.strerror)]
+        problems = []
+        if str(entry['size']) != str(size):
+            problems.append((name, 'size is %d instead of %s'
+                                   % (size, entry['size'])))
+        for algorithm in sorted(digests):
+            if digests[algorithm].lower() != actual[algorithm]:
+                problems.append((name, '%s checksum mismatch'
+                                       % algorithm))
+        return problems
+
+    if workers is None:
+        workers = VERIFY_WORKERS
+    problems = list(field_problems)
+    for file_problems in _thread_map(check, names, workers):
+        problems.extend(file_problems)
+    return problems
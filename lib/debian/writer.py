@@ -0,0 +1,235 @@
+# writer.py -- buffered writing of deb822 files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Buffered writing of deb822 files, with compression and checksums
+
+See Deb822Writer.
+"""
+
+import hashlib
+
+from compression import _new_compressor
+from deb822 import READ_BLOCK_SIZE, _format_paragraph, _multivalued_entries
+
+
+# Release fields holding checksums, with the hashlib algorithms for them
+_RELEASE_CHECKSUMS = [
+    ('MD5Sum', 'md5'),
+    ('SHA1', 'sha1'),
+    ('SHA256', 'sha256'),
+]
+
+
+class _WriterOutput(object):
+    """One of the files a Deb822Writer writes to"""
+
+    def __init__(self, fd, compression, checksums, name):
+        self.fd = fd
+        self.compression = compression
+        if compression is None:
+            self._compressor = None
+        else:
+            self._compressor = _new_compressor(compression)
+        self._hashes = [(algorithm, hashlib.new(algorithm))
+                        for algorithm in checksums]
+        self.name = name
+        self.size = 0
+        self.checksums = None
+
+    def write(self, data):
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._write(data)
+
+    def _write(self, data):
+        if not data:
+            return
+        for algorithm, hash_ in self._hashes:
+            hash_.update(data)
+        self.fd.write(data)
+        self.size += len(data)
+
+    def close(self):
+        if self._compressor is not None:
+            self._write(self._compressor.flush())
+        self.checksums = dict([(algorithm, hash_.hexdigest())
+                               for algorithm, hash_ in self._hashes])
+
+
+class Deb822Writer(object):
+    """Write many paragraphs to one or several files, through a large buffer
+
+    Paragraphs are formatted like Deb822.dump does, separated by blank lines,
+    and collected until about buffer_size characters are pending; these are
+    then encoded at once, and written to each of the outputs of the writer.
+    Each output can be compressed on the fly (with gzip, bzip2 or xz; xz
+    needs the lzma module), and checksums of the bytes written to it are
+    computed along the way.  An index can thus be written out in all its
+    compressed and uncompressed variants, and described in a Release file,
+    in a single pass.
+
+    Example, writing a compressed Packages file:
+
+        out = open('Packages.gz', 'wb')
+        writer = Deb822Writer(out, compression='gzip')
+        writer.write_all(Packages.iter_paragraphs(file('Packages')))
+        writer.close()
+        out.close()
+        print writer.size, writer.checksums['sha256']
+
+    Example, writing several variants and adding them to a Release file:
+
+        writer = Deb822Writer(open('Packages', 'wb'),
+                              name='main/binary-i386/Packages')
+        writer.add_output(open('Packages.gz', 'wb'), 'gzip',
+                          name='main/binary-i386/Packages.gz')
+        writer.write_all(paragraphs)
+        writer.close()
+        writer.add_to_release(release)
+    """
+
+    def __init__(self, fd=None, encoding="utf-8", compression=None,
+                 checksums=('md5', 'sha1', 'sha256'), buffer_size=None,
+                 name=None):
+        """
+        :param fd: the file-like object to write to; it is not closed by
+            close().  If None, outputs must be added with add_output.
+
+        :param encoding: the encoding of the output
+
+        :param compression: None, 'gzip', 'bzip2' or 'xz'
+
+        :param checksums: names of the hashlib algorithms to compute the
+            checksums of the output with
+
+        :param buffer_size: the number of characters to buffer before
+            writing (default: READ_BLOCK_SIZE)
+
+        :param name: the name of the output in Release files (default: the
+            name attribute of fd, if any)
+        """
+        self.encoding = encoding
+        self.compression = compression
+        self.checksum_algorithms = list(checksums)
+        self.buffer_size = buffer_size or READ_BLOCK_SIZE
+        self.outputs = []
+        self._buffer = []
+        self._buffered = 0
+        self.closed = False
+        # The number of paragraphs written so far
+        self.count = 0
+        if fd is not None:
+            self.add_output(fd, compression, name)
+
+    def add_output(self, fd, compression=None, name=None):
+        """Also write to fd, compressed with compression
+
+        :param name: same as in __init__
+
+        Outputs can only be added before anything is written.
+        """
+        if self.count:
+            raise ValueError('outputs must be added before writing')
+        if name is None:
+            name = getattr(fd, 'name', None)
+        self.outputs.append(_WriterOutput(fd, compression,
+                                          self.checksum_algorithms, name))
+
+    def _first_output(self):
+        if not self.outputs:
+            raise ValueError('the Deb822Writer has no outputs')
+        return self.outputs[0]
+
+    # The size (in bytes) and checksums (a dict mapping each of the checksum
+    # algorithms to its hex digest, once closed) of the first output
+    size = property(lambda self: self._first_output().size)
+    checksums = property(lambda self: self._first_output().checksums)
+
+    def write(self, paragraph):
+        """Write paragraph, a Deb822 or CompactDeb822 object"""
+        if self.closed:
+            raise ValueError('write to a closed Deb822Writer')
+        text = _format_paragraph(paragraph)
+        if self.count:
+            self._buffer.append('\n')
+            self._buffered += 1
+        self._buffer.append(text)
+        self._buffered += len(text)
+        self.count += 1
+        if self._buffered >= self.buffer_size:
+            self._flush_buffer()
+
+    def write_all(self, paragraphs):
+        """Write each paragraph of the iterable paragraphs"""
+        for paragraph in paragraphs:
+            self.write(paragraph)
+
+    def _flush_buffer(self):
+        data = ''.join(self._buffer).encode(self.encoding)
+        self._buffer = []
+        self._buffered = 0
+        for output in self.outputs:
+            output.write(data)
+
+    def close(self):
+        """Write what is still buffered, end the compressed streams if any,
+        and compute the checksums
+
+        The underlying files are not closed.
+        """
+        if self.closed:
+            return
+        self._flush_buffer()
+        for output in self.outputs:
+            output.close()
+        self.closed = True
+
+    def release_entries(self):
+        """Return the entries describing the outputs in a Release file
+
+        The result maps MD5Sum, SHA1 and SHA256 (those for which the checksum
+        was computed) to lists of dicts, like the values of these fields in
+        Release objects.  Outputs must have a name, and the writer must be
+        closed.
+        """
+        if not self.closed:
+            raise ValueError('the writer must be closed first')
+        entries = {}
+        for field, algorithm in _RELEASE_CHECKSUMS:
+            if algorithm not in self.checksum_algorithms:
+                continue
+            entries[field] = []
+            for output in self.outputs:
+                if output.name is None:
+                    raise ValueError('outputs need a name to be described '
+                                     'in a Release file')
+                entries[field].append({
+                    field.lower(): output.checksums[algorithm],
+                    'size': str(output.size),
+                    'name': output.name,
+                })
+        return entries
+
+    def add_to_release(self, release):
+        """Add the entries describing the outputs to release, a Release
+        object (see release_entries)
+        """
+        for field, entries in self.release_entries().iteritems():
+            if release.has_key(field):
+                release[field] = (_multivalued_entries(release[field]) +
+                                  entries)
+            else:
+                release[field] = entries
@@ -0,0 +1,91 @@
+#! /usr/bin/python
+
+# Measure how long it takes to start python and import some modules
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Startup time benchmark
+
+Runs 'python -c "import debian.deb822"' (or the given modules) a number of
+times, and prints the best and median wall time, along with a baseline for
+bare 'python -c pass'.  With --record, the results are appended to a file,
+one line per run, so that regressions can be spotted over time; with
+--max-ms, the exit status is 1 if the best import overhead exceeds the
+given number of milliseconds.
+
+Run it from the tests directory, so that ../lib is used.
+"""
+
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+
+def time_command(args, runs, env):
+    times = []
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call(args, env=env)
+        times.append(time.time() - start)
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [options] [module ...]',
+        description='Measure the time taken by "python -c \'import '
+                    'module\'" (default module: debian.deb822).')
+    parser.add_option('-n', '--runs', type='int', default=20,
+                      help='number of runs (default: %default)')
+    parser.add_option('--record', metavar='FILE',
+                      help='append the results to FILE')
+    parser.add_option('--max-ms', type='float',
+                      help='fail if importing takes longer than this')
+    options, modules = parser.parse_args()
+    modules = modules or ['debian.deb822']
+
+    env = dict(os.environ)
+    lib = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lib'))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [lib] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    base_best, base_median = time_command([sys.executable, '-c', 'pass'],
+                                          options.runs, env)
+    code = '; '.join(['import %s' % m for m in modules])
+    best, median = time_command([sys.executable, '-c', code], options.runs,
+                                env)
+    overhead = (best - base_best) * 1000
+
+    result = ('%s %s: best %.1fms, median %.1fms (import overhead %.1fms)'
+              % (time.strftime('%Y-%m-%d %H:%M:%S'), ', '.join(modules),
+                 best * 1000, median * 1000, overhead))
+    print result
+    if options.record:
+        f = open(options.record, 'a')
+        f.write(result + '\n')
+        f.close()
+
+    if options.max_ms is not None and overhead > options.max_ms:
+        print >> sys.stderr, ('import overhead %.1fms exceeds %.1fms'
+                              % (overhead, options.max_ms))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#! /usr/bin/python
+
+# Tests for columns.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import array
+import sys
+import unittest
+
+sys.path.insert(0, '../lib/debian/')
+
+import columns
+import deb822
+from test_deb822 import GPG_SIGNED
+
+
+class TestColumnTable(unittest.TestCase):
+
+    fields = ['Package', 'Section', 'Priority', 'Installed-Size', 'Essential']
+
+    def _test_table(self, use_numpy):
+        table = columns.ColumnTable.from_file(open('test_Packages'),
+                                             self.fields, use_numpy=use_numpy)
+        paragraphs = list(deb822.Packages.iter_paragraphs(
+            open('test_Packages')))
+        self.assertEqual(len(table), len(paragraphs))
+        for i, p in enumerate(paragraphs):
+            row = table.row(i)
+            self.assertEqual(row['Package'], p['Package'])
+            self.assertEqual(row['Section'], p['Section'])
+            self.assertEqual(row['Installed-Size'], int(p['Installed-Size']))
+            self.assertEqual(row['Essential'], p.get('Essential'))
+
+        self.assert_(isinstance(table['section'], columns.CategoricalColumn))
+        self.assert_(isinstance(table['Package'], list))
+        self.assertEqual(list(table['Priority']),
+                         [p['Priority'] for p in paragraphs])
+        self.assertEqual(table['Essential'].categories, [])
+        self.assertEqual(list(table['Essential'].codes),
+                         [columns.MISSING] * len(paragraphs))
+
+        sums = {}
+        for p in paragraphs:
+            sums[p['Section']] = (sums.get(p['Section'], 0) +
+                                  int(p['Installed-Size']))
+        self.assertEqual(table.sum_by('Section', 'Installed-Size'), sums)
+
+        section = paragraphs[0]['Section']
+        self.assertEqual(list(table.where('Section', section)),
+                         [i for i, p in enumerate(paragraphs)
+                          if p['Section'] == section])
+        self.assertEqual(list(table.where('Section', 'no-such-section')), [])
+        self.assertEqual(list(table.where('Package', 'a2ps')), [0])
+        return table
+
+    def test_table(self):
+        table = self._test_table(False)
+        self.assert_(isinstance(table['Installed-Size'], array.array))
+
+    def test_table_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            return
+        table = self._test_table(True)
+        self.assert_(isinstance(table['Installed-Size'], numpy.ndarray))
+
+    def test_missing_numbers(self):
+        for use_numpy in (False, None):
+            table = columns.ColumnTable.from_file(
+                'Size: 12\n\nPackage: foo\n\nSize: junk\n\nSize: -1\n\n'
+                'Size: 0\n', ['Package', 'Size'], use_numpy=use_numpy)
+            self.assertEqual(list(table['Size']), [12, 0, 0, -1, 0])
+            self.assertEqual(list(table.present('Size')),
+                             [True, False, False, True, True])
+            self.assertEqual([table.row(i)['Size'] for i in range(5)],
+                             [12, None, None, -1, 0])
+            self.assertEqual(list(table.where('Size', 0)), [4])
+            self.assertEqual(list(table.where('Size', -1)), [3])
+            self.assertEqual(list(table.present('Package')),
+                             [False, True, False, False, False])
+
+    def test_numbers_out_of_range(self):
+        self.assertRaises(ValueError, columns.ColumnTable.from_file,
+                          'Size: %d\n' % (sys.maxint + 1), ['Size'])
+
+    def test_categories_unicode(self):
+        # The first paragraph goes through the signed-file path, which gives
+        # unicode values; the second one doesn't
+        text = (GPG_SIGNED[0] % 'Package: foo\nSection: caf\xc3\xa9\n' +
+                '\nPackage: bar\nSection: caf\xc3\xa9\nSize: 3\n')
+        for use_numpy in (False, None):
+            table = columns.ColumnTable.from_file(
+                text, ['Package', 'Section', 'Size'], use_numpy=use_numpy)
+            self.assertEqual(table['Section'].categories, [u'caf\xe9'])
+            self.assertEqual(list(table['Section'].codes), [0, 0])
+            self.assertEqual(table.sum_by('Section', 'Size'), {u'caf\xe9': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,17 +17,26 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import cPickle
+import hashlib
 import os
 import re
+import shutil
+import subprocess
 import sys
 import tempfile
+import time
 import unittest
 import warnings
 from StringIO import StringIO
 
 sys.path.insert(0, '../lib/debian/')
 
+import charset
+import compact
 import deb822
+import parallel
+import verify
 
 # Keep the test suite compatible with python2.3 for now
 try:
@@ -438,6 +447,88 @@ class TestDeb822(unittest.TestCase):
                 self.assertWellParsed(d, PARSED_PACKAGE)
             self.assertEqual(count, 2)
 
+    def test_iter_paragraphs_file_with_gpg(self):
+        for string in GPG_SIGNED:
+            string = string % UNPARSED_PACKAGE
+            text = StringIO(string + '\n\n\n' + string)
+
+            count = 0
+            for d in deb822.Deb822.iter_paragraphs(text, use_apt_pkg=False):
+                count += 1
+                self.assertWellParsed(d, PARSED_PACKAGE)
+            self.assertEqual(count, 2)
+
+    def test_iter_paragraphs_native_matches_internal_parser(self):
+        """The native iter_paragraphs parser agrees with _internal_parser"""
+
+        for filename in ('test_Packages', 'test_Sources'):
+            for fields in (None, ['Package', 'Version', 'Depends']):
+                f = open(filename)
+                lines = iter(f.readlines())
+                f.close()
+                expected = []
+                while True:
+                    d = deb822.Deb822(lines, fields)
+                    if not d:
+                        break
+                    expected.append(d)
+
+                f = open(filename)
+                paragraphs = list(deb822.Deb822.iter_paragraphs(
+                    f, fields, use_apt_pkg=False))
+                f.close()
+                self.assertEqual(len(expected), len(paragraphs))
+                for d, p in zip(expected, paragraphs):
+                    self.assertWellParsed(p, d)
+
+    def test_parser_skips_unwanted_fields(self):
+        text = ('Package: foo\nDescription: bar\n baz\nBad Key: x\n'
+                ' more\nVersion : 1.0\n')
+        d = deb822.Deb822(text, ['Package', 'Version'])
+        self.assertEqual(d.items(), [('Package', 'foo'), ('Version', '1.0')])
+        d = deb822.Deb822(text, ['Description'])
+        self.assertEqual(d.items(), [('Description', 'bar\n baz\n more')])
+
+    def test_project_section(self):
+        class Section(object):
+            # Like apt_pkg.TagSection, for what TagSectionWrapper needs
+            def __init__(self, text):
+                self.paragraph = deb822.Deb822(text)
+            def find_raw(self, key):
+                if key not in self.paragraph:
+                    return None
+                return '%s: %s\n' % (key, self.paragraph[key])
+        section = Section(UNPARSED_PACKAGE)
+        parsed = deb822.TagSectionWrapper.project(
+            section, ['Version', 'package', 'Foo', 'Version'])
+        self.assertEqual(parsed.keys(), ['Version', 'package'])
+        d = deb822.Deb822(_parsed=parsed)
+        self.assertEqual(d.items(), [('Version', '1.5.12-1'),
+                                     ('package', 'mutt')])
+        self.failIf(deb822.TagSectionWrapper.project(section, ['Foo']))
+
+    def test_iter_paragraphs_native_crlf(self):
+        text = '\r\n'.join(UNPARSED_PACKAGE.splitlines() + [''] * 2) * 2
+        paragraphs = list(deb822.Deb822.iter_paragraphs(StringIO(text),
+                                                        use_apt_pkg=False))
+        self.assertEqual(len(paragraphs), 2)
+        for d in paragraphs:
+            self.assertWellParsed(d, PARSED_PACKAGE)
+
+    def test_iter_paragraphs_native_skips_empty_paragraphs(self):
+        text = 'Package: foo\n\nSource: bar\n\nPackage: baz\n'
+        paragraphs = list(deb822.Deb822.iter_paragraphs(
+            text, ['Package'], use_apt_pkg=False))
+        self.assertEqual([p['Package'] for p in paragraphs], ['foo', 'baz'])
+
+    def test_read_blocks(self):
+        text = UNPARSED_PACKAGE + '\n\n' + UNPARSED_PACKAGE
+        for block_size in (1, 7, 4096):
+            lines = []
+            for block in deb822._read_blocks(StringIO(text), block_size):
+                lines.extend(block)
+            self.assertEqual(lines, text.splitlines())
+
     def _test_iter_paragraphs(self, filename, cls, **kwargs):
         """Ensure iter_paragraphs consistency"""
         
@@ -487,6 +578,232 @@ class TestDeb822(unittest.TestCase):
         self._test_iter_paragraphs("test_Sources", deb822.Sources,
                                    use_apt_pkg=False, shared_storage=False)
 
+    def test_iter_paragraphs_mmap_packages(self):
+        self._test_iter_paragraphs("test_Packages", deb822.Packages,
+                                   use_mmap=True, shared_storage=False)
+
+    def test_iter_paragraphs_mmap_sources(self):
+        self._test_iter_paragraphs("test_Sources", deb822.Sources,
+                                   use_mmap=True, shared_storage=False)
+
+    def test_iter_paragraphs_mmap_matches_native(self):
+        text = (UNPARSED_PARAGRAPHS_WITH_COMMENTS + '\n' +
+                UNPARSED_PACKAGE.replace('\n', '\r\n') + '\n' +
+                GPG_SIGNED[0] % UNPARSED_PACKAGE)
+        fd, filename = tempfile.mkstemp()
+        fp = os.fdopen(fd, 'w')
+        fp.write(text)
+        fp.close()
+
+        try:
+            for fields in (None, ['Package', 'Description']):
+                f = open(filename)
+                mapped = list(deb822.Deb822.iter_paragraphs(f, fields,
+                                                            use_mmap=True))
+                f.close()
+                native = list(deb822.Deb822.iter_paragraphs(
+                    StringIO(text), fields, use_apt_pkg=False))
+                self.assertEqual(len(mapped), len(native))
+                for m, n in zip(mapped, native):
+                    self.assertWellParsed(m, n)
+        finally:
+            os.remove(filename)
+
+    def test_iter_paragraphs_mmap_shared_keys(self):
+        f = open('test_Packages')
+        try:
+            first, second = list(deb822.Packages.iter_paragraphs(
+                f, ['Package', 'Version'], use_mmap=True))[:2]
+        finally:
+            f.close()
+        # No per-paragraph key storage until a paragraph is modified
+        self.assertEqual(first._Deb822Dict__keys, None)
+        self.assertEqual(first._Deb822Dict__dict, None)
+        self.assert_(first._Deb822Dict__parsed.schema is
+                     second._Deb822Dict__parsed.schema)
+        self.assertEqual(first.keys(), ['Package', 'Version'])
+        self.assert_('version' in first)
+        self.failIf('Description' in first)
+        self.assertRaises(KeyError, first.__getitem__, 'Description')
+
+        version = second['Version']
+        first['Description'] = 'foo'
+        del first['Package']
+        self.assertEqual(first.keys(), ['Version', 'Description'])
+        self.assertEqual(first['description'], 'foo')
+        self.assertEqual(second.keys(), ['Package', 'Version'])
+        self.assertEqual(second['Version'], version)
+        del second['Version']
+        self.assertEqual(second.keys(), ['Package'])
+        self.assertRaises(KeyError, second.__getitem__, 'Version')
+
+    def test_iter_paragraphs_mmap_empty_file(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            f = open(filename)
+            self.assertEqual([], list(deb822.Deb822.iter_paragraphs(
+                f, use_mmap=True)))
+            f.close()
+        finally:
+            os.remove(filename)
+
+    def _test_iter_paragraphs_compressed(self, compress):
+        text = open('test_Packages').read()
+        expected = [p.dump() for p in
+                    deb822.Packages.iter_paragraphs(StringIO(text))]
+        data = compress(text)
+
+        fd, filename = tempfile.mkstemp()
+        fp = os.fdopen(fd, 'w')
+        fp.write(data)
+        fp.close()
+        try:
+            # Compressed files can't be mapped, but are still read with
+            # use_mmap=True
+            for use_mmap in (False, True):
+                f = open(filename)
+                self.assertEqual(expected, [p.dump() for p in
+                                 deb822.Packages.iter_paragraphs(
+                                     f, use_mmap=use_mmap)])
+                f.close()
+        finally:
+            os.remove(filename)
+
+        self.assertEqual(expected, [p.dump() for p in
+                         deb822.Packages.iter_paragraphs(StringIO(data))])
+        self.assertEqual(expected, [p.dump() for p in
+                         deb822.Packages.iter_paragraphs(data)])
+
+    def test_iter_paragraphs_gzip(self):
+        import gzip
+        def compress(text):
+            out = StringIO()
+            gz = gzip.GzipFile(fileobj=out, mode='w')
+            gz.write(text)
+            gz.close()
+            return out.getvalue()
+        self._test_iter_paragraphs_compressed(compress)
+        # Concatenated gzip streams are read as one
+        def compress_in_two(text):
+            middle = text.index('\n\n') + 2
+            return compress(text[:middle]) + compress(text[middle:])
+        self._test_iter_paragraphs_compressed(compress_in_two)
+
+    def test_iter_paragraphs_bzip2(self):
+        import bz2
+        self._test_iter_paragraphs_compressed(bz2.compress)
+
+    def test_iter_paragraphs_xz(self):
+        try:
+            import lzma
+        except ImportError:
+            return
+        self._test_iter_paragraphs_compressed(lzma.compress)
+
+    def test_iter_paragraphs_compact(self):
+        text = (open('test_Packages').read() + '\n' +
+                GPG_SIGNED[0] % UNPARSED_PACKAGE)
+        for fields in (None, ['Package', 'Version', 'Description']):
+            expected = list(deb822.Packages.iter_paragraphs(StringIO(text),
+                                                            fields))
+            found = list(deb822.Packages.iter_paragraphs(StringIO(text),
+                                                         fields,
+                                                         compact=True))
+            self.assertEqual(len(expected), len(found))
+            for e, c in zip(expected, found):
+                self.assert_(isinstance(c, compact.CompactDeb822))
+                self.assertEqual([k.lower() for k in e.keys()],
+                                 [k.lower() for k in c.keys()])
+                self.assertEqual(e.values(), c.values())
+                self.assertEqual(e, c)
+                self.assertEqual(e.dump(), c.dump())
+                self.assertEqual(e['Package'], c['PACKAGE'])
+        # Paragraphs with the same fields share their schema
+        self.assert_(found[0]._schema is found[2]._schema)
+
+    def test_compact_read_only(self):
+        p = compact.CompactDeb822(deb822.Deb822(UNPARSED_PACKAGE))
+        self.assertEqual(p, PARSED_PACKAGE)
+        self.assertRaises(TypeError, p.__setitem__, 'Package', 'foo')
+        self.assertRaises(TypeError, p.__delitem__, 'Package')
+        self.assertRaises(AttributeError, setattr, p, 'foo', 'bar')
+        self.assertRaises(KeyError, p.__getitem__, 'Foo')
+        self.assertEqual(p.get('foo'), None)
+        self.assert_('package' in p)
+
+        d = p.to_deb822(deb822.Packages)
+        self.assert_(isinstance(d, deb822.Packages))
+        self.assertEqual(d, p)
+        self.assertEqual(d.keys(), p.keys())
+        d['Package'] = 'foo'
+        self.assertEqual(p['Package'], 'mutt')
+
+    def test_compact_schema_cache(self):
+        p = compact.CompactDeb822(deb822.Deb822(UNPARSED_PACKAGE))
+        for i in range(compact.COMPACT_SCHEMA_CACHE_SIZE + 1):
+            compact.CompactDeb822(deb822.Deb822('Field-%d: foo\n' % i))
+        self.assert_(len(compact._compact_schemas)
+                     <= compact.COMPACT_SCHEMA_CACHE_SIZE)
+        self.assertEqual(p['Package'], 'mutt')
+        self.assertEqual(p, PARSED_PACKAGE)
+
+    def test_parallel_iter_paragraphs(self):
+        for filename, cls in (('test_Packages', deb822.Packages),
+                              ('test_Sources', deb822.Sources)):
+            expected = [p.dump() for p in cls.iter_paragraphs(file(filename))]
+            paragraphs = [p.dump() for p in cls.parallel_iter_paragraphs(
+                filename, processes=2, chunk_size=1000)]
+            self.assertEqual(expected, paragraphs)
+
+            paragraphs = [p.dump() for p in cls.parallel_iter_paragraphs(
+                file(filename), processes=2, chunk_size=1000, ordered=False)]
+            self.assertEqual(sorted(expected), sorted(paragraphs))
+
+    def test_parallel_iter_paragraphs_gzip(self):
+        import gzip
+        expected = [p.dump() for p in
+                    deb822.Packages.iter_paragraphs(file('test_Packages'))]
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'Packages.gz')
+            gz = gzip.GzipFile(filename, 'wb')
+            gz.write(open('test_Packages').read())
+            gz.close()
+            for processes in (1, 2):
+                paragraphs = [p.dump() for p in
+                              deb822.Packages.parallel_iter_paragraphs(
+                                  filename, processes=processes,
+                                  chunk_size=1000)]
+                self.assertEqual(expected, paragraphs)
+            # The decompressed copy is gone once iteration is over
+            self.assertEqual(os.listdir(tmpdir), ['Packages.gz'])
+            tempdir = tempfile.gettempdir()
+            before = set(os.listdir(tempdir))
+            paragraphs = deb822.Packages.parallel_iter_paragraphs(filename)
+            paragraphs.next()
+            paragraphs.close()
+            self.assertEqual(set(os.listdir(tempdir)) - before, set())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parallel_iter_paragraphs_limit_fields(self):
+        paragraphs = list(deb822.Deb822.parallel_iter_paragraphs(
+            'test_Packages', ['Package', 'Version'], processes=1))
+        self.assertEqual(len(paragraphs), 3)
+        for p in paragraphs:
+            self.assertEqual(p.keys(), ['Package', 'Version'])
+
+    def test_chunk_boundaries(self):
+        text = open('test_Packages').read()
+        boundaries = parallel._chunk_boundaries('test_Packages', 100)
+        self.assertEqual(boundaries[0], 0)
+        self.assertEqual(boundaries[-1], len(text))
+        # All three paragraphs are longer than 100 bytes
+        self.assert_(len(boundaries) >= 4)
+        for offset in boundaries[1:-1]:
+            self.assertEqual(text[offset-1:offset+1], '\n\n')
+
     def test_parser_empty_input(self):
         self.assertEqual({}, deb822.Deb822([]))
 
@@ -684,6 +1001,19 @@ Description: python modules to work with Debian-related data formats
             d3['Some-Test-Key'] = 'some value'
         self.assertEqual(d3.dump(), "Some-Test-Key: some value\n")
 
+    def test_strI_cache(self):
+        self.assert_(deb822._strI('Package') is deb822._strI('Package'))
+        self.assert_(deb822._strI('Package') is not deb822._strI('package'))
+        self.assertEqual(str(deb822._strI('package')), 'package')
+        key = deb822._strI('Foo')
+        self.assert_(deb822._strI(key) is key)
+        self.assertEqual(deb822._strI(u'Foo'), 'foo')
+
+        for i in range(deb822.STRI_CACHE_SIZE + 1):
+            deb822._strI('Field-%d' % i)
+        self.assert_(len(deb822._strI_cache) <= deb822.STRI_CACHE_SIZE)
+        self.assertEqual(str(deb822._strI('Package')), 'Package')
+
     def test_unicode_values(self):
         """Deb822 objects should contain only unicode values
 
@@ -770,6 +1100,64 @@ Description: python modules to work with Debian-related data formats
             self.assertEqual(p2['uploaders'],
                              u'Frank Küster <frank@debian.org>')
 
+    def test_mixed_encodings_fallback(self):
+        filename = 'test_Sources.mixed_encoding'
+        paragraphs = list(deb822.Sources.iter_paragraphs(
+            file(filename), use_apt_pkg=False, fallback_encodings=['latin-1']))
+        self.assertEqual(paragraphs[0]['maintainer'],
+                         u'Adeodato Simó <dato@net.com.org.es>')
+        self.assertEqual(paragraphs[1]['uploaders'],
+                         u'Frank Küster <frank@debian.org>')
+
+    def test_encoding_detector(self):
+        warnings.filterwarnings(action='ignore', category=UnicodeWarning)
+        calls = []
+        detect = charset.chardet.detect
+        def counting_detect(value):
+            calls.append(value)
+            return detect(value)
+        charset.chardet.detect = counting_detect
+        try:
+            detector = charset.EncodingDetector()
+            latin1 = u'Adeodato Simó'.encode('latin-1')
+            for i in range(3):
+                self.assertEqual(detector.decode(latin1, 'utf-8')[0],
+                                 u'Adeodato Simó')
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(sum(detector.stats.values()), 3)
+            self.assertEqual(detector.decode('plain', 'utf-8'),
+                             (u'plain', 'utf-8'))
+        finally:
+            charset.chardet.detect = detect
+
+        detector = charset.EncodingDetector(['ascii', 'latin-1'])
+        self.assertEqual(detector.decode(latin1, 'utf-8'),
+                         (u'Adeodato Simó', 'latin-1'))
+        self.assertEqual(detector.stats, {'latin-1': 1})
+        detector = charset.EncodingDetector(['ascii'])
+        self.assertRaises(UnicodeDecodeError, detector.decode, latin1, 'utf-8')
+
+    def test_chardet_imported_lazily(self):
+        """chardet is slow to import, and only needed for undecodable values
+
+        The same goes for the modules of optional features, and for the
+        modules they use.
+        """
+        code = ("import sys; sys.path.insert(0, '../lib/debian'); "
+                "import deb822; "
+                "deb822.Deb822('Foo: bar')['Foo']; "
+                "sys.stdout.write(' '.join(sorted(set(sys.modules) & "
+                "set(['array', 'chardet', 'columns', 'compact', "
+                "'compression', 'cPickle', 'hashlib', 'mapped', 'mmap', "
+                "'multiprocessing', 'paragraph_index', 'parallel', "
+                "'subprocess', 'threading', 'verify', 'writer', "
+                "'zlib'])))); "
+                "deb822.chardet.detect")
+        p = subprocess.Popen([sys.executable, '-c', code],
+                             stdout=subprocess.PIPE)
+        self.assertEqual(p.communicate()[0], '')
+        self.assertEqual(p.returncode, 0)
+
     def test_bug597249_colon_as_first_value_character(self):
         """Colon should be allowed as the first value character. See #597249.
         """
@@ -822,6 +1210,229 @@ Description: python modules to work with Debian-related data formats
         self._test_iter_paragraphs_comments(paragraphs)
 
 
+class TestVerifyFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.contents = {
+            'foo_1.0.orig.tar.gz': 'x' * 3000000,
+            'foo_1.0-1.diff.gz': 'some diff',
+            'foo_1.0-1.dsc': '',
+        }
+        lines = {'Files': [], 'Checksums-Sha1': [], 'Checksums-Sha256': []}
+        for name, data in sorted(self.contents.items()):
+            f = open(os.path.join(self.directory, name), 'wb')
+            f.write(data)
+            f.close()
+            for field, hash_ in [('Files', hashlib.md5),
+                                 ('Checksums-Sha1', hashlib.sha1),
+                                 ('Checksums-Sha256', hashlib.sha256)]:
+                lines[field].append(' %s %d %s' % (hash_(data).hexdigest(),
+                                                   len(data), name))
+        self.text = 'Source: foo\nVersion: 1.0-1\n' + ''.join(
+            ['%s:\n%s\n' % (field, '\n'.join(lines[field]))
+             for field in ['Files', 'Checksums-Sha1', 'Checksums-Sha256']])
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_verify_files(self):
+        dsc = deb822.Dsc(self.text)
+        for workers in (None, 1, 2, 10):
+            self.assertEqual(dsc.verify_files(self.directory, workers), [])
+        # .changes files have the section and priority in Files
+        text = re.sub(r'(?m)^( [0-9a-f]{32} \d+) ', r'\1 devel optional ',
+                      self.text)
+        changes = deb822.Changes(text)
+        self.assertEqual(changes['Files'][0]['section'], 'devel')
+        self.assertEqual(changes.verify_files(self.directory), [])
+
+    def test_problems(self):
+        dsc = deb822.Dsc(self.text)
+        os.remove(os.path.join(self.directory, 'foo_1.0-1.diff.gz'))
+        f = open(os.path.join(self.directory, 'foo_1.0.orig.tar.gz'), 'r+b')
+        f.seek(1000)
+        f.write('y')
+        f.close()
+        f = open(os.path.join(self.directory, 'foo_1.0-1.dsc'), 'wb')
+        f.write('z')
+        f.close()
+        problems = dsc.verify_files(self.directory, workers=3)
+        self.assertEqual([name for name, problem in problems],
+                         ['foo_1.0-1.diff.gz'] + ['foo_1.0-1.dsc'] * 4 +
+                         ['foo_1.0.orig.tar.gz'] * 3)
+        self.assert_(problems[0][1].startswith('cannot read file'))
+        self.assertEqual(problems[1][1], 'size is 1 instead of 0')
+        self.assertEqual(problems[2][1], 'md5 checksum mismatch')
+        self.assertEqual(problems[5][1], 'md5 checksum mismatch')
+
+    def test_only_some_checksums(self):
+        dsc = deb822.Dsc(self.text)
+        del dsc['Checksums-Sha1']
+        del dsc['Checksums-Sha256']
+        self.assertEqual(dsc.verify_files(self.directory), [])
+        dsc = deb822.Dsc('Files:\n'
+                         ' d41d8cd98f00b204e9800998ecf8427e 0 ../foo\n')
+        self.assertEqual(dsc.verify_files(self.directory),
+                         [('../foo', 'invalid file name')])
+
+
+class TestVerifyRelease(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'main', 'binary-i386'))
+        self.contents = {
+            'main/binary-i386/Packages.gz': 'packages' * 1000,
+            'main/binary-i386/Release': 'Archive: unstable\n',
+        }
+        lines = {'MD5Sum': [], 'SHA1': [], 'SHA256': []}
+        for name, data in sorted(self.contents.items()):
+            f = open(os.path.join(self.directory, name), 'wb')
+            f.write(data)
+            f.close()
+            for field, hash_ in [('MD5Sum', hashlib.md5),
+                                 ('SHA1', hashlib.sha1),
+                                 ('SHA256', hashlib.sha256)]:
+                lines[field].append(' %s %d %s' % (hash_(data).hexdigest(),
+                                                   len(data), name))
+        # Mirrors don't usually have the uncompressed indexes
+        lines['MD5Sum'].append(' %s 8000 main/binary-i386/Packages'
+                               % hashlib.md5('packages' * 1000).hexdigest())
+        self.release = deb822.Release(
+            'Origin: Debian\nSuite: unstable\n' +
+            ''.join(['%s:\n%s\n' % (field, '\n'.join(lines[field]))
+                     for field in ['MD5Sum', 'SHA1', 'SHA256']]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_files_by_path(self):
+        files = self.release.files_by_path()
+        self.assertEqual(sorted(files), ['main/binary-i386/Packages',
+                                         'main/binary-i386/Packages.gz',
+                                         'main/binary-i386/Release'])
+        entry = files['main/binary-i386/Packages.gz']
+        self.assertEqual(entry['size'], '8000')
+        data = self.contents['main/binary-i386/Packages.gz']
+        self.assertEqual(entry['md5sum'], hashlib.md5(data).hexdigest())
+        self.assertEqual(entry['sha256'], hashlib.sha256(data).hexdigest())
+        self.failIf('sha1' in files['main/binary-i386/Packages'])
+        self.assert_(self.release.files_by_path() is files)
+        # Replacing a field rebuilds the index
+        del self.release['SHA256']
+        files = self.release.files_by_path()
+        self.failIf('sha256' in files['main/binary-i386/Packages.gz'])
+
+    def test_verify_files(self):
+        problems = self.release.verify_files(self.directory)
+        self.assertEqual(problems[0][0], 'main/binary-i386/Packages')
+        self.assert_(problems[0][1].startswith('cannot read file'))
+        self.assertEqual(self.release.verify_files(self.directory,
+                                                   ignore_missing=True), [])
+        self.release['SHA1'].append({'sha1': '0' * 40, 'size': '0',
+                                     'name': '../../etc/passwd'})
+        self.assertEqual(self.release.verify_files(self.directory,
+                                                   ignore_missing=True),
+                         [('../../etc/passwd', 'invalid file name')])
+
+    def test_malformed_fields(self):
+        data = self.contents['main/binary-i386/Release']
+        release = deb822.Release(
+            'MD5Sum: %s %d main/binary-i386/Release\n'
+            'SHA1:\n %s %d\n'
+            'SHA256:\n' % (hashlib.md5(data).hexdigest(), len(data),
+                           hashlib.sha1(data).hexdigest(), len(data)))
+        self.assertEqual(release.files_by_path().keys(),
+                         ['main/binary-i386/Release'])
+        self.assertEqual(release.verify_files(self.directory),
+                         [('SHA1', 'malformed checksum field')])
+        release['SHA256'] = 'junk'
+        self.assertEqual(release.verify_files(self.directory),
+                         [('SHA1', 'malformed checksum field'),
+                          ('SHA256', 'malformed checksum field')])
+
+    def test_cache(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(filename)
+        hashed = []
+        hash_file = verify._hash_file
+        def counting_hash_file(path, algorithms, block_size=None):
+            hashed.append(os.path.basename(path))
+            return hash_file(path, algorithms, block_size)
+        verify._hash_file = counting_hash_file
+        try:
+            cache = verify.VerificationCache(filename)
+            self.assertEqual(cache.entries, {})
+            self.assertEqual(self.release.verify_files(
+                self.directory, cache=cache, ignore_missing=True), [])
+            self.assertEqual(sorted(hashed), ['Packages.gz', 'Release'])
+            cache.save()
+
+            # Unchanged files are not read again
+            del hashed[:]
+            cache = verify.VerificationCache(filename)
+            self.assertEqual(self.release.verify_files(
+                self.directory, cache=cache, ignore_missing=True), [])
+            self.assertEqual(hashed, [])
+
+            # Modified files are
+            path = os.path.join(self.directory, 'main/binary-i386/Release')
+            f = open(path, 'wb')
+            f.write('Archive: unstablE\n')
+            f.close()
+            st = os.stat(path)
+            os.utime(path, (st.st_atime, st.st_mtime + 10))
+            problems = self.release.verify_files(
+                self.directory, cache=cache, ignore_missing=True)
+            self.assertEqual(hashed, ['Release'])
+            self.assertEqual([problem for name, problem in problems],
+                             ['md5 checksum mismatch',
+                              'sha1 checksum mismatch',
+                              'sha256 checksum mismatch'])
+
+            # So are files for which another checksum is needed
+            del hashed[:]
+            class Release512(deb822.Release):
+                _multivalued_fields = {'sha512': ['sha512', 'size', 'name']}
+                _checksum_fields = [('sha512', 'sha512', 'sha512')]
+            release = Release512('SHA512:\n %s 8000 %s\n' % (
+                hashlib.sha512('packages' * 1000).hexdigest(),
+                'main/binary-i386/Packages.gz'))
+            self.assertEqual(release.verify_files(self.directory,
+                                                  cache=cache), [])
+            self.assertEqual(hashed, ['Packages.gz'])
+        finally:
+            verify._hash_file = hash_file
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+    def test_cache_load(self):
+        fd, filename = tempfile.mkstemp()
+        try:
+            os.write(fd, 'not json')
+            os.close(fd)
+            cache = verify.VerificationCache(filename)
+            self.assertEqual(cache.entries, {})
+            self.failIf(cache.load())
+
+            # Nor pickles, which could run code
+            cPickle.dump({'version': cache.format_version, 'entries': {}},
+                         open(filename, 'wb'))
+            self.failIf(cache.load())
+
+            cache.store('Release', 10, 1.5, {'md5': 'abc'})
+            cache.save()
+            cache = verify.VerificationCache(filename)
+            self.assertEqual(cache.lookup('Release', 10, 1.5, ['md5']),
+                             {'md5': 'abc'})
+        finally:
+            os.unlink(filename)
+
+
 class TestPkgRelations(unittest.TestCase):
 
     def test_packages(self):
@@ -940,6 +1551,147 @@ class TestPkgRelations(unittest.TestCase):
                     [{'name': 'binutils-source', 'version': None, 'arch': None}]]}
         self.assertEqual(rel2, pkg2.relations)
 
+    def test_relations_lazy(self):
+        pkg = deb822.Packages(UNPARSED_PACKAGE)
+        rels = pkg.relations
+        self.failIf(dict.__contains__(rels, 'depends'))
+        self.assert_('depends' in rels)
+        self.assertEqual(len(rels), 9)
+        self.assertEqual(sorted(rels.keys()), sorted(list(rels)))
+        self.assertEqual(rels['Depends'][0][0]['name'], 'libc6')
+        self.assert_(dict.__contains__(rels, 'depends'))
+        self.failIf(dict.__contains__(rels, 'suggests'))
+        self.assertEqual(rels['breaks'], [])
+        self.assertEqual(rels.get('enhances'), [])
+        self.assertEqual(rels.get('foo', 42), 42)
+        self.assertRaises(KeyError, rels.__getitem__, 'foo')
+
+        # Whole-dict operations see every field parsed
+        repr(rels)
+        self.assertEqual(dict.get(rels, 'suggests')[0][0]['name'], 'urlview')
+        self.assertEqual(deb822.Packages(UNPARSED_PACKAGE).relations, rels)
+        self.assertEqual(dict(rels.items()), rels)
+        rels = deb822.Packages(UNPARSED_PACKAGE).relations
+        self.failIf(None in rels.values())
+        self.assertEqual(len(rels.copy()), 9)
+
+    def test_relations_dict_copies(self):
+        """Copying with the dict C API never gives unparsed placeholders"""
+        for copy in (dict, lambda rels: dict(**rels), self._update_copy):
+            rels = deb822.Packages(UNPARSED_PACKAGE).relations
+            copied = copy(rels)
+            self.failIf(None in copied.values())
+            self.assertEqual(copied['breaks'], [])
+            rels['depends']
+            copied = copy(rels)
+            self.failIf(None in copied.values())
+            self.assertEqual(copied['depends'][0][0]['name'], 'libc6')
+            rels.parse_all()
+            self.assertEqual(copy(rels), rels)
+            self.assertEqual(len(copy(rels)), 9)
+
+    def _update_copy(self, rels):
+        copied = {}
+        copied.update(rels)
+        return copied
+
+    def test_relations_no_cycle(self):
+        import gc
+        import weakref
+        pkg = deb822.Packages(UNPARSED_PACKAGE)
+        rels = pkg.relations
+        ref = weakref.ref(pkg)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            del pkg
+            self.assertEqual(ref(), None)
+        finally:
+            if enabled:
+                gc.enable()
+        # The relations outlive the paragraph
+        self.assertEqual(rels['depends'][0][0]['name'], 'libc6')
+
+    def test_relations_modified(self):
+        rels = deb822.Packages(UNPARSED_PACKAGE).relations
+        rels['depends'] = []
+        self.assertEqual(rels['depends'], [])
+        del rels['suggests']
+        self.failIf('suggests' in rels)
+        self.assertRaises(KeyError, rels.__delitem__, 'suggests')
+        rels.parse_all()
+        self.assertEqual(rels['depends'], [])
+        self.assertEqual(len(rels), 8)
+        copied = cPickle.loads(cPickle.dumps(
+            deb822.Packages(UNPARSED_PACKAGE).relations, 2))
+        self.assertEqual(copied['depends'][0][0]['name'], 'libc6')
+
+    def test_iter_paragraphs_relations(self):
+        pkgs = list(deb822.Packages.iter_paragraphs(
+            StringIO(UNPARSED_PACKAGE), relations=['Depends', 'pre-depends']))
+        rels = pkgs[0].relations
+        self.assertEqual(dict.get(rels, 'depends')[0][0]['name'], 'libc6')
+        self.failIf(dict.__contains__(rels, 'suggests'))
+        self.assertRaises(ValueError, list, deb822.Packages.iter_paragraphs(
+            StringIO(UNPARSED_PACKAGE), relations=['build-depends']))
+        self.assertRaises(ValueError, list, deb822.Deb822.iter_paragraphs(
+            StringIO(UNPARSED_PACKAGE), relations=['depends']))
+        self.assertRaises(ValueError, list, deb822.Packages.iter_paragraphs(
+            StringIO(UNPARSED_PACKAGE), relations=['depends'], compact=True))
+
+    def test_parse_relations_shared(self):
+        parse = deb822.PkgRelation.parse_relations
+        rels1 = parse('libc6 (>= 2.7), foo [!i386] | bar')
+        rels2 = parse('libc6 (>= 2.7), foo [!i386] | bar')
+        rels3 = parse('baz, foo [!i386]')
+        self.assertEqual(rels1, rels2)
+        self.failIf(rels1 is rels2)
+        self.failIf(rels1[0] is rels2[0])
+        self.assert_(rels1[0][0] is rels2[0][0])
+        self.assert_(rels1[1][0] is rels3[1][0])
+        self.assertEqual(rels3[1][0]['arch'], [(False, 'i386')])
+
+        # The lists can be modified, but not what they contain
+        rels1.append([])
+        rels1[0].append({'name': 'baz', 'version': None, 'arch': None})
+        self.assertEqual(len(parse('libc6 (>= 2.7), foo [!i386] | bar')), 2)
+        self.assertRaises(TypeError, rels2[0][0].__setitem__, 'name', 'x')
+        self.assertRaises(TypeError, rels2[0][0].update, {})
+        self.assertRaises(TypeError, rels2[1][0]['arch'].append,
+                          (True, 'amd64'))
+        copied = cPickle.loads(cPickle.dumps(rels2, 2))
+        self.assertEqual(copied, rels2)
+
+    def test_parse_relations_unusual(self):
+        parse = deb822.PkgRelation.parse_relations
+        self.assertEqual(parse(u'foo(>=1.0)[ i386 ]'),
+                         [[{'name': u'foo', 'version': (u'>=', u'1.0'),
+                            'arch': [(True, u'i386')]}]])
+        self.assert_(isinstance(parse(u'libc6')[0][0]['name'], unicode))
+        self.assert_(isinstance(parse('libc6')[0][0]['name'], str))
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            rels = parse('foo (>= 1.0) bar, baz')
+            rels = parse('foo (>= 1.0) bar, baz')
+            warnings = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(warnings.count('WARNING'), 2)
+        self.assertEqual(rels, [[{'name': 'foo (>= 1.0) bar', 'version': None,
+                                  'arch': None}],
+                                [{'name': 'baz', 'version': None,
+                                  'arch': None}]])
+        # Relationships are read-only whichever way they were parsed
+        for rel in (rels[0][0], rels[1][0], parse('foo [i386]')[0][0]):
+            self.assertRaises(TypeError, rel.__setitem__, 'version', None)
+        self.assertRaises(TypeError,
+                          parse('foo [i386]')[0][0]['arch'].append,
+                          (True, 'amd64'))
+        self.assertEqual(dict(rels[1][0], version=('>=', '1')),
+                         {'name': 'baz', 'version': ('>=', '1'),
+                          'arch': None})
+
 
 class TestGpgInfo(unittest.TestCase):
 
@@ -1012,6 +1764,68 @@ class TestGpgInfo(unittest.TestCase):
 
         self._validate_gpg_info(gpg_info)
 
+    def test_from_sequences(self):
+        if not self.should_run:
+            return
+
+        infos = deb822.GpgInfo.from_sequences(
+            [self.data, self.data.splitlines(), 'unsigned'], workers=2)
+        self._validate_gpg_info(infos[0])
+        self._validate_gpg_info(infos[1])
+        self.failIf(infos[2].valid())
+
+    # A stand-in for gpgv, to check the worker pool and timeouts without
+    # needing a keyring: it reports the first word of its input as the key
+    # id, and takes its time when asked to
+    fake_gpgv = [sys.executable, '-c', """if True:
+        import sys, time
+        data = sys.stdin.read()
+        if data.startswith('slow'):
+            time.sleep(30)
+        print '[GNUPG:] GOODSIG %s Someone' % data.split()[0]
+        """]
+
+    def test_from_sequences_order(self):
+        data = ['key%d\nfoo\n' % i for i in range(6)]
+        infos = deb822.GpgInfo.from_sequences(data, workers=3,
+                                              executable=self.fake_gpgv)
+        self.assertEqual([info['GOODSIG'][0] for info in infos],
+                         ['key%d' % i for i in range(6)])
+        self.failIf([info for info in infos if info.timed_out])
+        self.assertEqual(deb822.GpgInfo.from_sequences(
+            [], executable=self.fake_gpgv), [])
+
+    def test_timeout(self):
+        start = time.time()
+        infos = deb822.GpgInfo.from_sequences(
+            ['key1\n', 'slow\n', ['key2', 'bar']], workers=2, timeout=1,
+            executable=self.fake_gpgv)
+        self.assert_(time.time() - start < 20)
+        self.assertEqual(infos[0]['GOODSIG'][0], 'key1')
+        self.failIf(infos[0].timed_out)
+        self.assert_(infos[1].timed_out)
+        self.failIf(infos[1].valid())
+        self.assertEqual(infos[2]['GOODSIG'][0], 'key2')
+        info = deb822.GpgInfo.from_sequence('slow\n', timeout=0.5,
+                                            executable=self.fake_gpgv)
+        self.assert_(info.timed_out)
+
+    def test_from_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filenames = []
+            for i in range(3):
+                filenames.append(os.path.join(directory, '%d.dsc' % i))
+                f = open(filenames[-1], 'w')
+                f.write('key%d\n' % i)
+                f.close()
+            infos = deb822.GpgInfo.from_files(filenames, workers=2,
+                                              executable=self.fake_gpgv)
+            self.assertEqual([info['GOODSIG'][0] for info in infos],
+                             ['key0', 'key1', 'key2'])
+        finally:
+            shutil.rmtree(directory)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -18,7 +18,9 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import os
 import sys
+import tempfile
 import unittest
 
 sys.path.insert(0, '../lib/debian/')
@@ -169,6 +171,212 @@ class VersionTests(unittest.TestCase):
         self._test_comparison('1.5~rc1', '<', '1.5~rc2')
         self._test_comparison('1.5~rc1', '>', '1.5~dev0')
 
+        self._test_comparison('1.0', '>', '1.0~')
+        self._test_comparison('1.0', '<', '1.0a')
+        self._test_comparison('1.0', '<', '1.0.0')
+        self._test_comparison('1.01', '==', '1.1')
+        self._test_comparison('1.0-1', '==', '1.0-01')
+        self._test_comparison('1.0', '==', '1.0-0')
+
+    def test_sort_key(self):
+        versions = ['1.0', '1.0~', '1.0a', '1.0.0', '1:0.1', '1.0-1',
+                    '1.0-1~bpo1', '1.0+b1', '0.9~rc1-1', '2', '10', '1.0-0']
+        objects = [NativeVersion(v) for v in versions]
+        by_key = sorted(objects, key=lambda v: v.sort_key)
+        for a, b in zip(by_key, by_key[1:]):
+            self.assert_(a <= b, "%r > %r" % (a, b))
+            self.assertEqual(cmp(a, b), cmp(a.sort_key, b.sort_key))
+        self.assertEqual([str(v) for v in by_key],
+                         [str(v) for v in sorted(objects)])
+
+    def test_hashing(self):
+        for cls in (NativeVersion, Version):
+            # Versions hash like their string, so that they can be looked
+            # up in dicts and sets of strings
+            self.assertEqual(hash(cls('1.0-1')), hash('1.0-1'))
+            self.assert_(cls('1.0-1') in set(['1.0-1']))
+            self.assertEqual({'1.0-1': 'foo'}[cls('1.0-1')], 'foo')
+
+    def test_sort_key_updated(self):
+        v = NativeVersion('1.0-1')
+        key = v.sort_key
+        self.assert_(v.sort_key is key)
+        v.debian_revision = '2'
+        self.assertNotEqual(v.sort_key, key)
+        self.assertEqual(v.sort_key, NativeVersion('1.0-2').sort_key)
+        self.assert_(v > '1.0-1')
+
+
+class FrozenVersionTests(unittest.TestCase):
+    """Tests for debian_support.FrozenVersion"""
+
+    def test_attributes(self):
+        v = FrozenVersion('1:1.4.1-1')
+        self.assertEqual(v.full_version, '1:1.4.1-1')
+        self.assertEqual(str(v), '1:1.4.1-1')
+        self.assertEqual(v.epoch, '1')
+        self.assertEqual(v.upstream_version, '1.4.1')
+        self.assertEqual(v.debian_revision, '1')
+        self.assertEqual(v.debian_version, '1')
+        self.assertEqual(FrozenVersion('1.0').epoch, None)
+        self.assertEqual(FrozenVersion(NativeVersion('1.0')).full_version,
+                         '1.0')
+        self.assertRaises(ValueError, FrozenVersion, 'a1:1.8.8-070403-1~priv1')
+
+    def test_immutable(self):
+        v = FrozenVersion('1.0-1')
+        self.assertRaises(AttributeError, setattr, v, 'epoch', '1')
+        self.assertRaises(AttributeError, setattr, v, 'foo', 'bar')
+        self.assertRaises(AttributeError, delattr, v, 'epoch')
+
+    def test_comparisons(self):
+        versions = ['1.0~rc1', '1.0', '1.0-1', '1.0+b1', '1:0.1']
+        for a in versions:
+            for b in versions:
+                expected = cmp(NativeVersion(a), NativeVersion(b))
+                self.assertEqual(cmp(FrozenVersion(a), FrozenVersion(b)),
+                                 expected)
+                self.assertEqual(cmp(FrozenVersion(a), b), expected)
+                self.assertEqual(cmp(a, FrozenVersion(b)), expected)
+                self.assertEqual(cmp(FrozenVersion(a), NativeVersion(b)),
+                                 expected)
+                self.assertEqual(cmp(NativeVersion(a), FrozenVersion(b)),
+                                 expected)
+                self.assertEqual(cmp(FrozenVersion(a), Version(b)), expected)
+                self.assertEqual(cmp(Version(a), FrozenVersion(b)), expected)
+
+    def test_hashing(self):
+        v = FrozenVersion('1.0-1')
+        d = {v: 'foo'}
+        self.assertEqual(d[FrozenVersion('1.0-1')], 'foo')
+        self.assertEqual(len(set([v, FrozenVersion('1.0-1')])), 1)
+
+    def test_hashing_equal_spellings(self):
+        for spellings in (['1.0', '0:1.0', '1.00', '1.0-0'],
+                          ['1:2.0-1', '01:2.0-01']):
+            versions = [FrozenVersion(v) for v in spellings]
+            for v in versions:
+                self.assertEqual(v, versions[0])
+                self.assertEqual(hash(v), hash(versions[0]))
+            self.assertEqual(len(set(versions)), 1)
+        self.assert_(FrozenVersion('1.0') in {FrozenVersion('1.00'): 1})
+        self.assertEqual(len(set([FrozenVersion('1.0'),
+                                  FrozenVersion('1.0-1')])), 2)
+
+    def test_pickle(self):
+        import pickle
+        v = FrozenVersion('1:1.0-1')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(v, protocol)), v)
+
+
+class VersionListTests(unittest.TestCase):
+    """Tests for the functions working on many versions in debian_support"""
+
+    versions = ['1.0', '1.0~', '1:0.1', '1.0-1', '0.9~rc1-1', '10', '2',
+                '1.0+b1']
+    expected = ['0.9~rc1-1', '1.0~', '1.0', '1.0-1', '1.0+b1', '2', '10',
+                '1:0.1']
+
+    def test_sort_versions(self):
+        self.assertEqual(sort_versions(self.versions), self.expected)
+        self.assertEqual(sort_versions(self.versions, reverse=True),
+                         list(reversed(self.expected)))
+        objects = [NativeVersion(v) for v in self.versions]
+        self.assertEqual([str(v) for v in sort_versions(objects)],
+                         self.expected)
+        self.assert_(sort_versions(objects)[0] in objects)
+
+    def test_version_sort_key(self):
+        for a in self.versions:
+            for b in self.versions:
+                self.assertEqual(
+                    cmp(version_sort_key(a), version_sort_key(b)),
+                    cmp(NativeVersion(a), NativeVersion(b)))
+        self.assertRaises(ValueError, version_sort_key, 'a:1')
+
+    def test_max_version(self):
+        self.assertEqual(max_version(self.versions), '1:0.1')
+        self.assertEqual(max_version(iter(['1.0', '1.0~'])), '1.0')
+        self.assertRaises(ValueError, max_version, [])
+
+    def test_group_latest(self):
+        pairs = [('foo', '1.0'), ('bar', '2.0~rc1'), ('foo', '1.0+b1'),
+                 ('bar', '2.0~beta1'), ('foo', '1.0~rc1')]
+        self.assertEqual(group_latest(pairs),
+                         {'foo': '1.0+b1', 'bar': '2.0~rc1'})
+        self.assertEqual(group_latest([]), {})
+
+    def test_invalid_versions(self):
+        # Whether apt_pkg is available or not
+        for function in (sort_versions, max_version):
+            self.assertRaises(ValueError, function, ['1.0', 'a:1'])
+        self.assertRaises(ValueError, group_latest, [('foo', '1.0'),
+                                                     ('foo', 'a:1')])
+
+
+class VersionCompareCacheTests(unittest.TestCase):
+    """Tests for the version comparison cache in debian_support"""
+
+    def tearDown(self):
+        set_version_compare_cache_size(0)
+
+    def test_disabled_by_default(self):
+        self.assertEqual(version_compare('1.0', '1.1'), -1)
+        self.assertEqual(version_compare_cache_info(),
+                         {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 0})
+
+    def test_cache(self):
+        set_version_compare_cache_size(2)
+        self.assert_(version_compare('1.0', '1.1') < 0)
+        self.assert_(version_compare('1.0', '1.1') < 0)
+        self.assert_(version_compare('1.1', '1.0') > 0)
+        self.assertEqual(version_compare_cache_info(),
+                         {'hits': 1, 'misses': 2, 'size': 2, 'maxsize': 2})
+
+        # ('1.0', '1.1') was used more recently than ('1.1', '1.0')
+        self.assert_(Version('1.0') < Version('1.1'))
+        self.assertEqual(version_compare('2.0', '2.0'), 0)
+        info = version_compare_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']),
+                         (2, 3, 2))
+        self.assert_(version_compare('1.0', '1.1') < 0)
+        self.assert_(version_compare('1.1', '1.0') > 0)
+        info = version_compare_cache_info()
+        self.assertEqual((info['hits'], info['misses']), (3, 4))
+
+        set_version_compare_cache_size(10)
+        self.assertEqual(version_compare_cache_info(),
+                         {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 10})
+
+    def test_invalid_versions_not_cached(self):
+        set_version_compare_cache_size(10)
+        self.assertRaises(ValueError, version_compare, '1.0', 'a:1')
+        self.assertEqual(version_compare_cache_info()['size'], 0)
+
+    def test_threads(self):
+        import threading
+        set_version_compare_cache_size(5)
+        errors = []
+        def compare():
+            try:
+                for i in range(2000):
+                    a, b = '1.%d' % (i % 7), '1.%d' % (i % 11)
+                    expected = cmp(i % 7, i % 11)
+                    if cmp(Version(a), Version(b)) != expected:
+                        errors.append((a, b))
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=compare) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        info = version_compare_cache_info()
+        self.assertEqual(info['hits'] + info['misses'], 8000)
+        self.assertEqual(info['size'], 5)
+
 
 class ReleaseTests(unittest.TestCase):
     """Tests for debian_support.Release"""
@@ -197,6 +405,26 @@ class HelperRoutineTests(unittest.TestCase):
         patch_lines(file_a, patches_from_ed_script(patch))
         self.assertEqual(''.join(file_b), ''.join(file_a))
 
+    def test_data_file(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            data = {'names': ['foo', 'b\xe9r', 'b\xc3\xa9r'],
+                    'sizes': {'/srv/\xff': [1, 2.5]}}
+            debian_support._write_data_file(filename, 2, data)
+            self.failIf(os.path.exists(filename + '.new'))
+            read = debian_support._read_data_file(filename, 2)
+            self.assertEqual(read, dict(data, version=2))
+            self.assertEqual([type(name) for name in read['names']],
+                             [str, str, str])
+            self.assertRaises(ValueError, debian_support._read_data_file,
+                              filename, 1)
+            open(filename, 'w').write('not json')
+            self.assertRaises(ValueError, debian_support._read_data_file,
+                              filename, 2)
+        finally:
+            os.unlink(filename)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,137 @@
+#! /usr/bin/python
+
+# Tests for paragraph_index.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import cPickle
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, '../lib/debian/')
+
+import deb822
+import paragraph_index
+
+
+class TestParagraphIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'Packages')
+        self._write(open('test_Packages').read())
+
+    def tearDown(self):
+        for name in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir, name))
+        os.rmdir(self.tmpdir)
+
+    def _write(self, text):
+        f = open(self.filename, 'w')
+        f.write(text)
+        f.close()
+
+    def test_lookup(self):
+        index = paragraph_index.ParagraphIndex(self.filename)
+        expected = list(deb822.Packages.iter_paragraphs(file('test_Packages')))
+        for pkg in expected:
+            found = index.get(pkg['Package'], cls=deb822.Packages)
+            self.assertEqual(len(found), 1)
+            self.assertEqual(found[0].dump(), pkg.dump())
+        self.assertEqual(index.get('no-such-package'), [])
+        self.failIf('no-such-package' in index)
+        self.assert_(os.path.exists(self.filename + '.idx'))
+
+    def test_saved_index_is_used(self):
+        index = paragraph_index.ParagraphIndex(self.filename)
+        index.entries['package']['fake'] = index.lookup('mutt')
+        index.save()
+
+        index = paragraph_index.ParagraphIndex(self.filename)
+        self.assertEqual(index.lookup('fake'), index.lookup('mutt'))
+
+    def test_pickles_not_loaded(self):
+        created = os.path.join(self.tmpdir, 'created')
+        class Payload(object):
+            # Unpickling this creates a directory
+            def __reduce__(self):
+                return (os.mkdir, (created,))
+        index = paragraph_index.ParagraphIndex(self.filename)
+        data = {'version': index.format_version, 'fields': index.fields,
+                'size': index.size, 'mtime': index.mtime,
+                'sha1': index.sha1, 'entries': Payload()}
+        cPickle.dump(data, open(index.index_filename, 'wb'))
+
+        index = paragraph_index.ParagraphIndex(self.filename)
+        self.failIf(os.path.exists(created))
+        self.assert_('zssh' in index)
+        # The index was rebuilt, and saved again
+        self.assert_(index.load())
+
+    def test_rebuilt_when_file_changes(self):
+        index = paragraph_index.ParagraphIndex(self.filename)
+        self.failIf('foo' in index)
+
+        self._write('Package: foo\nVersion: 1.0\n')
+        os.utime(self.filename, (0, 0))
+        [foo] = index.get('foo')
+        self.assertEqual(foo['Version'], '1.0')
+
+        index = paragraph_index.ParagraphIndex(self.filename)
+        self.assertEqual(index.lookup('foo'), [(0, len('Package: foo\n'
+                                                       'Version: 1.0'))])
+
+    def test_lookup_refreshes(self):
+        index = paragraph_index.ParagraphIndex(self.filename)
+        self.assert_(index.lookup('zssh'))
+        self._write('Package: foo\nVersion: 1.0\n')
+        os.utime(self.filename, (0, 0))
+        self.assertEqual(index.lookup('zssh'), [])
+        self.assertEqual(index.lookup('foo', 'PACKAGE'),
+                         [(0, len('Package: foo\nVersion: 1.0'))])
+        self.assert_('foo' in index)
+        self.assertRaises(KeyError, index.lookup, 'foo', 'Source')
+
+    def test_touched_file_keeps_index(self):
+        index = paragraph_index.ParagraphIndex(self.filename)
+        sha1 = index.sha1
+        os.utime(self.filename, (0, 0))
+        self.failIf(index.is_current())
+        index.refresh()
+        self.assert_(index.is_current())
+        self.assertEqual(index.sha1, sha1)
+
+    def test_compressed(self):
+        f = gzip.GzipFile(self.filename, 'wb')
+        f.write(open('test_Packages').read())
+        f.close()
+        self.assertRaises(ValueError, paragraph_index.ParagraphIndex,
+                          self.filename)
+        self.failIf(os.path.exists(self.filename + '.idx'))
+
+    def test_other_fields(self):
+        self._write('Package: foo\nSource: bar (1.0-1)\n\n'
+                    'Package: baz\nSource: bar\n')
+        index = paragraph_index.ParagraphIndex(self.filename,
+                                      fields=['Package', 'Source'])
+        self.assertEqual([p['Package'] for p in index.get('bar', 'source')],
+                         ['foo', 'baz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
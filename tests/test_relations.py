@@ -0,0 +1,314 @@
+#! /usr/bin/python
+
+# Tests for relations.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import cPickle
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, '../lib/debian/')
+
+import deb822
+import relations
+
+
+UNIVERSE = '''\
+Package: libc6
+Version: 2.11.2-10
+Provides: glibc-2.11-1
+
+Package: mail
+Version: 1.0-1
+Depends: libc6 (>= 2.7), mail-transport-agent
+Recommends: mail-reader
+
+Package: exim4
+Version: 4.72-6
+Depends: libc6 (>= 2.12) | libc6.1 (>= 2.12), mail-base
+Provides: mail-transport-agent
+
+Package: mutt
+Version: 1.5.20-9
+Pre-Depends: libc6 (<< 2.11)
+Depends: libc6 [!i386], libc6.1 [alpha ia64], libfoo (= 1.0)
+Provides: mail-reader, libfoo (= 1.0)
+'''
+
+
+def universe():
+    return list(deb822.Packages.iter_paragraphs(UNIVERSE.splitlines()))
+
+
+class TestArchitectureFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = relations.ArchitectureFilter(['alpha', 'i386', 'ia64'])
+        self.rels = deb822.PkgRelation.parse_relations(
+            'libc6 [!i386], libc6.1 [alpha ia64] | libc0.1 [kfreebsd-i386], '
+            'foo [i386] | bar [!i386], baz')
+
+    def test_mask(self):
+        mask = self.filter.mask
+        self.assertEqual(mask(self.rels[0][0]), 5)
+        self.assertEqual(mask(self.rels[1][0]), 5)
+        self.assertEqual(mask(self.rels[1][1]), 0)
+        self.assertEqual(mask(self.rels[2][0]), 2)
+        self.assertEqual(mask(self.rels[3][0]), 7)
+        self.assertEqual(mask({'name': 'x', 'arch': [(True, 'i386'),
+                                                      (False, 'alpha')]}), 2)
+        self.assert_(self.filter.applies(self.rels[2][0], 'i386'))
+        self.failIf(self.filter.applies(self.rels[2][0], 'alpha'))
+
+    def test_wildcards(self):
+        arch_filter = relations.ArchitectureFilter(
+            ['amd64', 'i386', 'hurd-i386', 'kfreebsd-amd64', 'armel'])
+        rels = deb822.PkgRelation.parse_relations(
+            'libasound2-dev [linux-any], foo [!linux-any], bar [any-amd64], '
+            'baz [hurd-any i386], qux [!any-i386], quux [any-arm], '
+            'corge [any], grault [linux-amd64]')
+        self.assertEqual([arch_filter.mask(alts[0]) for alts in rels],
+                         [19, 12, 9, 6, 25, 16, 31, 1])
+        reduced = arch_filter.reduce_all(rels[:2])
+        self.assertEqual(deb822.PkgRelation.str(reduced['amd64']),
+                         'libasound2-dev [linux-any]')
+        self.assertEqual(deb822.PkgRelation.str(reduced['hurd-i386']),
+                         'foo [!linux-any]')
+
+    def test_reduce(self):
+        reduce = self.filter.reduce
+        self.assertEqual(deb822.PkgRelation.str(reduce(self.rels, 'i386')),
+                         'foo [i386], baz')
+        self.assertEqual(deb822.PkgRelation.str(reduce(self.rels, 'alpha')),
+                         'libc6 [!i386], libc6.1 [alpha ia64], '
+                         'bar [!i386], baz')
+        self.assertRaises(KeyError, reduce, self.rels, 'amd64')
+
+    def test_reduce_all(self):
+        reduced = self.filter.reduce_all(self.rels)
+        self.assertEqual(sorted(reduced.keys()), ['alpha', 'i386', 'ia64'])
+        for arch in self.filter.architectures:
+            self.assertEqual(reduced[arch],
+                             self.filter.reduce(self.rels, arch))
+
+
+class TestDependencyChecker(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = relations.DependencyChecker(universe())
+
+    def test_satisfied(self):
+        satisfied = self.checker.satisfied
+        self.assert_(satisfied({'name': 'libc6', 'version': None}))
+        self.assert_(satisfied({'name': 'libc6',
+                                'version': ('>=', '2.11.2')}))
+        self.assert_(satisfied({'name': 'libc6', 'version': ('>>', '2.7')}))
+        self.assert_(satisfied({'name': 'libc6', 'version': ('<', '2.12')}))
+        self.assert_(satisfied({'name': 'libc6',
+                                'version': ('=', '2.11.2-10')}))
+        self.failIf(satisfied({'name': 'libc6', 'version': ('>>', '2.12')}))
+        self.failIf(satisfied({'name': 'libc6', 'version': ('<<', '2.11')}))
+        self.failIf(satisfied({'name': 'libc6.1', 'version': None}))
+
+    def test_provides(self):
+        satisfied = self.checker.satisfied
+        self.assert_(satisfied({'name': 'mail-transport-agent',
+                                'version': None}))
+        self.failIf(satisfied({'name': 'mail-transport-agent',
+                               'version': ('>=', '1.0')}))
+        self.assert_(satisfied({'name': 'libfoo', 'version': ('>=', '1.0')}))
+        self.failIf(satisfied({'name': 'libfoo', 'version': ('>>', '1.0')}))
+
+    def test_check_all(self):
+        problems = [(p['Package'], field, deb822.PkgRelation.str([alts]))
+                    for p, field, alts in self.checker.check_all()]
+        self.assertEqual(problems, [
+            ('exim4', 'depends', 'libc6 (>= 2.12) | libc6.1 (>= 2.12)'),
+            ('exim4', 'depends', 'mail-base'),
+            ('mutt', 'pre-depends', 'libc6 (<< 2.11)'),
+            ('mutt', 'depends', 'libc6.1 [alpha ia64]'),
+        ])
+        problems = list(self.checker.check_all(['recommends']))
+        self.assertEqual(problems, [])
+
+    def test_architecture(self):
+        checker = relations.DependencyChecker(universe(), architecture='i386')
+        mutt = checker.packages[-1]
+        # libc6 [!i386] is ignored, and so is libc6.1 [alpha ia64]
+        self.assertEqual(checker.check(mutt, ['depends']), [])
+        checker.architecture = 'alpha'
+        self.assertEqual(
+            [deb822.PkgRelation.str([alts])
+             for field, alts in checker.check(mutt, ['depends'])],
+            ['libc6.1 [alpha ia64]'])
+
+    def test_architecture_wildcards(self):
+        rels = deb822.PkgRelation.parse_relations(
+            'libc6 [linux-any], libc0.3 [hurd-any], libc6.1 [!any-i386]')
+        checker = relations.DependencyChecker(universe())
+        for arch, unsatisfied in [('i386', []), ('hurd-i386', ['libc0.3']),
+                                  ('alpha', ['libc6.1'])]:
+            checker.architecture = arch
+            self.assertEqual([alts[0]['name']
+                              for alts in checker.unsatisfied(rels)],
+                             unsatisfied)
+
+    def test_unsatisfied(self):
+        rels = deb822.PkgRelation.parse_relations(
+            'libc6 (>= 2.7), foo | libc6, bar | baz')
+        self.assertEqual(self.checker.unsatisfied(rels), [rels[2]])
+
+    def test_add(self):
+        self.failIf(self.checker.satisfied({'name': 'mail-base',
+                                            'version': None}))
+        self.checker.add(deb822.Packages('Package: mail-base\nVersion: 1\n'))
+        self.assert_(self.checker.satisfied({'name': 'mail-base',
+                                             'version': None}))
+
+    def test_partial_paragraphs(self):
+        checker = relations.DependencyChecker(
+            [deb822.Deb822({'Version': '1'}),
+             deb822.Packages('Package: mail-base\n'),
+             deb822.Packages('Package: libfoo\nVersion: not a version\n')]
+            + universe())
+        self.assertEqual(len(checker.skipped), 1)
+        self.assertEqual(len(checker.packages), 6)
+        self.assert_(checker.satisfied({'name': 'mail-base',
+                                        'version': None}))
+        self.failIf(checker.satisfied({'name': 'mail-base',
+                                       'version': ('>=', '0')}))
+        problems = [(p['Package'], field, deb822.PkgRelation.str([alts]))
+                    for p, field, alts in checker.check_all()]
+        self.assertEqual(problems, [
+            ('exim4', 'depends', 'libc6 (>= 2.12) | libc6.1 (>= 2.12)'),
+            ('mutt', 'pre-depends', 'libc6 (<< 2.11)'),
+            ('mutt', 'depends', 'libc6.1 [alpha ia64]'),
+        ])
+
+    def test_sources(self):
+        """Relationship fields missing from the paragraphs are empty"""
+        source = deb822.Sources('Package: foo\nVersion: 1.0\n'
+                                'Build-Depends: libc6 (>= 3)\n')
+        self.assertEqual(self.checker.check(source), [])
+        self.assertEqual(len(self.checker.check(source, ['build-depends'])),
+                         1)
+
+
+class TestReverseDependencyIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = relations.ReverseDependencyIndex(universe())
+
+    def test_rdepends(self):
+        self.assertEqual(self.index.rdepends('libc6'),
+                         ['exim4', 'mail', 'mutt'])
+        self.assertEqual(self.index.rdepends('libc6', 'pre-depends'),
+                         ['mutt'])
+        self.assertEqual(self.index.rdepends('mail-reader', ['Recommends']),
+                         ['mail'])
+        self.assertEqual(self.index.rdepends('mail-reader'), [])
+        self.assertEqual(self.index.rdepends('nonexistent'), [])
+        self.assertRaises(KeyError, self.index.rdepends, 'libc6', 'foo')
+
+    def test_depends(self):
+        self.assertEqual(self.index.depends('exim4'),
+                         ['libc6', 'libc6.1', 'mail-base'])
+        self.assertEqual(self.index.depends('mutt', 'provides'),
+                         ['libfoo', 'mail-reader'])
+
+    def test_transitive_rdepends(self):
+        index = self.index
+        self.assertEqual(index.transitive_rdepends('libc6'),
+                         ['exim4', 'mail', 'mutt'])
+        self.assertEqual(index.transitive_rdepends('mail-base'), ['exim4'])
+        # mail depends on exim4 through mail-transport-agent
+        self.assertEqual(index.transitive_rdepends('mail-base',
+                                                   provides=True),
+                         ['exim4', 'mail'])
+        self.assertEqual(index.transitive_rdepends('mail'), [])
+
+    def test_architecture(self):
+        index = relations.ReverseDependencyIndex(universe(), 'i386')
+        self.assertEqual(index.architecture, 'i386')
+        self.assertEqual(index.rdepends('libc6'), ['exim4', 'mail', 'mutt'])
+        self.assertEqual(index.depends('mutt'), ['libc6', 'libfoo'])
+        indexes = relations.ReverseDependencyIndex.per_architecture(
+            universe(), ['alpha', 'i386'])
+        self.assertEqual(indexes['i386'].depends('mutt'),
+                         ['libc6', 'libfoo'])
+        self.assertEqual(indexes['alpha'].depends('mutt'),
+                         ['libc6', 'libc6.1', 'libfoo'])
+        self.assertEqual(indexes['alpha'].rdepends('libc6.1'),
+                         ['exim4', 'mutt'])
+        self.assertEqual(indexes['i386'].rdepends('libc6.1'), ['exim4'])
+        copied = cPickle.loads(cPickle.dumps(indexes['alpha'], 2))
+        self.assertEqual(copied.architecture, 'alpha')
+        self.assertEqual(self.index.architecture, None)
+
+    def test_membership(self):
+        self.assertEqual(len(self.index), 4)
+        self.assert_('mutt' in self.index)
+        self.failIf('mail-base' in self.index)
+        self.failIf('mail-reader' in self.index)
+
+    def test_partial_paragraphs(self):
+        index = relations.ReverseDependencyIndex(
+            [deb822.Deb822({'Version': '1', 'Depends': 'libc6'})]
+            + universe())
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.rdepends('libc6'), ['exim4', 'mail', 'mutt'])
+
+    def test_from_file(self):
+        index = relations.ReverseDependencyIndex.from_file(
+            UNIVERSE.splitlines())
+        self.assertEqual(index.rdepends('libc6'), ['exim4', 'mail', 'mutt'])
+        self.assertEqual(index.depends('mutt', 'provides'),
+                         ['libfoo', 'mail-reader'])
+
+    def test_pickle(self):
+        index = cPickle.loads(cPickle.dumps(self.index,
+                                            cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(index.names, self.index.names)
+        self.assertEqual(index.transitive_rdepends('mail-base', provides=True),
+                         ['exim4', 'mail'])
+        self.assert_('mutt' in index)
+
+    def test_save_load(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.index.save(filename)
+            index = relations.ReverseDependencyIndex.load(filename)
+            self.assertEqual(index.rdepends('libc6'),
+                             ['exim4', 'mail', 'mutt'])
+            self.assertEqual(index.transitive_rdepends('mail-base',
+                                                       provides=True),
+                             ['exim4', 'mail'])
+            cPickle.dump({}, open(filename, 'wb'))
+            self.assertRaises(ValueError,
+                              relations.ReverseDependencyIndex.load, filename)
+            open(filename, 'w').write('{"version": %d}'
+                                      % index.format_version)
+            self.assertRaises(ValueError,
+                              relations.ReverseDependencyIndex.load, filename)
+        finally:
+            os.unlink(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+#! /usr/bin/python
+
+# Tests for writer.py
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import hashlib
+import sys
+import unittest
+import zlib
+from StringIO import StringIO
+
+sys.path.insert(0, '../lib/debian/')
+
+import compact
+import deb822
+from writer import Deb822Writer
+from test_deb822 import CHANGES_FILE, UNPARSED_PACKAGE
+
+
+class TestDeb822Writer(unittest.TestCase):
+
+    def setUp(self):
+        self.paragraphs = list(deb822.Packages.iter_paragraphs(
+            file('test_Packages')))
+        self.paragraphs.append(deb822.Deb822(UNPARSED_PACKAGE))
+        self.paragraphs.append(deb822.Changes(CHANGES_FILE))
+        self.expected = '\n'.join([p.dump() for p in self.paragraphs]
+                                  ).encode('utf-8')
+
+    def _write(self, **kwargs):
+        out = StringIO()
+        writer = Deb822Writer(out, **kwargs)
+        writer.write_all(self.paragraphs)
+        writer.close()
+        return writer, out.getvalue()
+
+    def test_write(self):
+        for buffer_size in (None, 1, 100):
+            writer, data = self._write(buffer_size=buffer_size)
+            self.assertEqual(data, self.expected)
+            self.assertEqual(writer.count, len(self.paragraphs))
+            self.assertEqual(writer.size, len(data))
+            self.assertEqual(writer.checksums['sha256'],
+                             hashlib.sha256(data).hexdigest())
+            self.assertEqual(writer.checksums['md5'],
+                             hashlib.md5(data).hexdigest())
+
+    def test_write_compressed(self):
+        import bz2
+        compressions = [('gzip', lambda data: zlib.decompress(data, 31)),
+                        ('bzip2', bz2.decompress)]
+        try:
+            import lzma
+        except ImportError:
+            pass
+        else:
+            compressions.append(('xz', lzma.decompress))
+        for compression, decompress in compressions:
+            writer, data = self._write(compression=compression,
+                                       buffer_size=1000)
+            self.assertEqual(decompress(data), self.expected)
+            self.assertEqual(writer.size, len(data))
+            self.assertEqual(writer.checksums['sha1'],
+                             hashlib.sha1(data).hexdigest())
+            self.assertEqual(
+                [p.dump() for p in deb822.Deb822.iter_paragraphs(data)],
+                [p.dump() for p in deb822.Deb822.iter_paragraphs(
+                    self.expected)])
+
+    def test_close(self):
+        writer, data = self._write(checksums=['sha512'])
+        self.assertEqual(writer.checksums.keys(), ['sha512'])
+        writer.close()
+        self.assertRaises(ValueError, writer.write, self.paragraphs[0])
+        self.assertRaises(ValueError, Deb822Writer, StringIO(),
+                          compression='zip')
+
+    def test_several_outputs(self):
+        import bz2
+        plain, gz, bz = StringIO(), StringIO(), StringIO()
+        writer = Deb822Writer(plain, name='main/Packages',
+                                     buffer_size=500)
+        writer.add_output(gz, 'gzip', name='main/Packages.gz')
+        writer.add_output(bz, 'bzip2', name='main/Packages.bz2')
+        self.assertRaises(ValueError, writer.release_entries)
+        writer.write_all(self.paragraphs)
+        self.assertRaises(ValueError, writer.add_output, StringIO())
+        writer.close()
+        self.assertEqual(plain.getvalue(), self.expected)
+        self.assertEqual(zlib.decompress(gz.getvalue(), 31), self.expected)
+        self.assertEqual(bz2.decompress(bz.getvalue()), self.expected)
+
+        entries = writer.release_entries()
+        self.assertEqual(sorted(entries.keys()), ['MD5Sum', 'SHA1', 'SHA256'])
+        for data, entry in zip([plain, gz, bz], entries['SHA256']):
+            data = data.getvalue()
+            self.assertEqual(entry['sha256'], hashlib.sha256(data).hexdigest())
+            self.assertEqual(entry['size'], str(len(data)))
+        self.assertEqual(entries['MD5Sum'][1],
+                         {'md5sum': hashlib.md5(gz.getvalue()).hexdigest(),
+                          'size': str(len(gz.getvalue())),
+                          'name': 'main/Packages.gz'})
+
+        release = deb822.Release('Origin: Debian\nSHA1:\n'
+                                 ' %s 42 main/Contents\n' % ('0' * 40))
+        writer.add_to_release(release)
+        release = deb822.Release(release.dump())
+        self.assertEqual([entry['name'] for entry in release['SHA1']],
+                         ['main/Contents', 'main/Packages',
+                          'main/Packages.gz', 'main/Packages.bz2'])
+        self.assertEqual(release['SHA1'][1]['sha1'],
+                         hashlib.sha1(plain.getvalue()).hexdigest())
+        self.assertEqual(release['MD5Sum'][2]['size'],
+                         str(len(bz.getvalue())))
+
+    def test_unnamed_output(self):
+        writer, data = self._write()
+        self.assertRaises(ValueError, writer.release_entries)
+        writer, data = self._write(checksums=['sha256'], name='Packages')
+        self.assertEqual(writer.release_entries().keys(), ['SHA256'])
+
+    def test_single_line_release_field(self):
+        writer, data = self._write(name='main/Packages')
+        release = deb822.Release('Origin: Debian\n'
+                                 'MD5Sum: %s 42 main/Contents\n'
+                                 'SHA1:\n' % ('0' * 32))
+        self.assertEqual(release['SHA1'], {})
+        writer.add_to_release(release)
+        self.assertEqual([entry['name'] for entry in release['MD5Sum']],
+                         ['main/Contents', 'main/Packages'])
+        self.assertEqual([entry['name'] for entry in release['SHA1']],
+                         ['main/Packages'])
+        release = deb822.Release(release.dump())
+        self.assertEqual(len(release['MD5Sum']), 2)
+
+    def test_no_outputs(self):
+        writer = Deb822Writer()
+        self.assertRaises(ValueError, getattr, writer, 'size')
+        self.assertRaises(ValueError, getattr, writer, 'checksums')
+
+    def test_compact(self):
+        paragraphs = [compact.CompactDeb822(p) for p in self.paragraphs[:-1]]
+        out = StringIO()
+        writer = Deb822Writer(out)
+        writer.write_all(paragraphs)
+        writer.close()
+        self.assertEqual(out.getvalue(),
+                         '\n'.join([p.dump() for p in self.paragraphs[:-1]]
+                                   ).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()